@@ -71,3 +71,23 @@ class Config(object):
     # The factor by which we multiply current WRs to determine whether or not to automatically
     # blacklist results we are assuming to be fake
     AUTO_BL_FACTOR = float(environ.get('AUTO_BL_FACTOR', 1.0))
+
+    # The number of processes the full site rankings job fans its per-event work out across. The default of 1 leaves the
+    # process pool off, and it all happens in the Huey worker's own process. Incremental runs never use the pool.
+    RANKINGS_WORKERS = int(environ.get('RANKINGS_WORKERS', 1))
+
+    # A soft ceiling on how much memory, in MB, the site rankings job should use. If set, the job saves site rankings in
+    # a streaming mode, a small chunk of users at a time, and makes the chunks smaller if it goes over the ceiling.
+    RANKINGS_MEMORY_CEILING_MB = int(environ.get('RANKINGS_MEMORY_CEILING_MB', 0))
+
+    # Whether the site rankings job traces memory allocations, to record the peak memory used in each phase of the job.
+    # Tracing every allocation makes the job several times slower, so only turn this on when looking into memory use.
+    RANKINGS_TRACE_MEMORY = environ.get('RANKINGS_TRACE_MEMORY', 'false').lower() == 'true'
+
+    # How many seconds an event's in-process PB rank index is used for before it's reloaded from the database, to pick
+    # up PBs set in other processes.
+    RANK_INDEX_MAX_AGE_SECONDS = int(environ.get('RANK_INDEX_MAX_AGE_SECONDS', 300))
+
+    # Whether an event's PB rank index is loaded in a background thread, so requests looking up a rank never wait on the
+    # database for it. Tests turn this off, so the index is loaded right away with the database they've set up.
+    RANK_INDEX_LOAD_IN_BACKGROUND = environ.get('RANK_INDEX_LOAD_IN_BACKGROUND', 'true').lower() == 'true'
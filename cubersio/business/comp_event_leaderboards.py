@@ -0,0 +1,145 @@
+""" Serving competition event leaderboards.
+
+Each process caches a prepared leaderboard for each competition event, with every complete result already sorted and
+the individual solves shown for each one already worked out, good for as long as nobody's results for that competition
+event change. Everybody's view of the leaderboard comes from the same prepared one, just leaving out whichever
+blacklisted results they aren't allowed to see, and ranking what's left.
+
+Once a competition is over, its leaderboards are frozen into snapshots, so they can be loaded as-is rather than
+prepared from the results again, for as long as the results don't change. """
+
+from collections import namedtuple
+import json
+from typing import List, Optional, Tuple
+
+from cubersio.persistence.cache_generations_manager import get_cache_generation, comp_event_results_cache_key
+from cubersio.persistence.comp_snapshots_manager import get_competition_snapshot, save_competition_snapshot,\
+    comp_event_snapshot_key
+from cubersio.persistence.models import CompetitionEvent, UserEventResults
+from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event
+from cubersio.util.cache import GenerationalCache
+from cubersio.util.sorting import sort_user_results_with_rankings, rank_sorted
+from cubersio.util.times import convert_time_to_sort_key
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are intended to be used directly.
+# -------------------------------------------------------------------------------------------------
+
+# One user's results on a competition event leaderboard, with everything needed to show them. `solves_helper` is the
+# individual solves to show, always 5 of them, and `rank_key` is what the results are ranked by.
+LeaderboardRow = namedtuple('LeaderboardRow', ['id', 'username', 'is_verified', 'comment', 'single', 'average',
+                                               'result', 'is_blacklisted', 'was_gold_medal', 'was_silver_medal',
+                                               'was_bronze_medal', 'solves_helper', 'rank_key'])
+
+
+class PreparedLeaderboard:
+    """ Every complete result for a competition event, blacklisted or not, sorted from best to worst, along with the
+    competition event's scrambles. """
+
+    def __init__(self, rows: List[LeaderboardRow], scrambles: List[str]):
+        self.rows = rows
+        self.scrambles = scrambles
+
+
+    def ranked_rows(self, show_blacklisted: bool, username: Optional[str]) -> List[Tuple[int, str, LeaderboardRow]]:
+        """ Returns the results visible to the viewer, as a list of tuples of the form (ranking, visible_ranking,
+        row), ranked the same way as `sort_user_results_with_rankings` would. Blacklisted results are only visible if
+        `show_blacklisted` is set, or to the user they belong to. """
+
+        rows = [row for row in self.rows if show_blacklisted or not row.is_blacklisted or row.username == username]
+
+        # The rows are already sorted, so they only need ranking
+        return rank_sorted(rows, [row.rank_key for row in rows])
+
+
+    def to_json(self) -> str:
+        """ Serializes this leaderboard to JSON, for freezing it into a snapshot. """
+
+        return json.dumps({'rows': self.rows, 'scrambles': self.scrambles})
+
+
+    @staticmethod
+    def from_json(data: str) -> 'PreparedLeaderboard':
+        """ Deserializes a leaderboard frozen into a snapshot. """
+
+        data = json.loads(data)
+        rows = [LeaderboardRow(*row[:-1], rank_key=tuple(row[-1])) for row in data['rows']]
+
+        return PreparedLeaderboard(rows, data['scrambles'])
+
+
+def get_comp_event_leaderboard(comp_event: CompetitionEvent) -> PreparedLeaderboard:
+    """ Returns the prepared leaderboard for the competition event. """
+
+    generation = get_cache_generation(comp_event_results_cache_key(comp_event.id))
+    return __LEADERBOARDS_CACHE.get(comp_event.id, generation, lambda: __load_leaderboard(comp_event, generation))
+
+
+def freeze_comp_event_leaderboard(comp_event: CompetitionEvent):
+    """ Prepares the competition event's leaderboard and freezes it into a snapshot, which is served as-is once the
+    competition is over, until its results change. """
+
+    generation = get_cache_generation(comp_event_results_cache_key(comp_event.id))
+    save_competition_snapshot(comp_event_snapshot_key(comp_event.id), comp_event.competition_id, generation,
+                              __prepare_leaderboard(comp_event).to_json())
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are not meant to be used directly; instead these are just dependencies
+# of the publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+# The cached leaderboard for each competition event, good for as long as its results generation is current. Only the
+# current and most recent competitions' leaderboards get much traffic.
+__LEADERBOARDS_CACHE = GenerationalCache(max_entries=256)
+
+
+def __load_leaderboard(comp_event: CompetitionEvent, generation: int) -> PreparedLeaderboard:
+    """ Loads the competition event's leaderboard from its snapshot if the competition is over and the snapshot is of
+    the current generation of its results, or otherwise prepares it from the results. """
+
+    if not comp_event.Competition.active:
+        snapshot = get_competition_snapshot(comp_event_snapshot_key(comp_event.id))
+        if snapshot and snapshot.generation == generation:
+            return PreparedLeaderboard.from_json(snapshot.data)
+
+    return __prepare_leaderboard(comp_event)
+
+
+def __prepare_leaderboard(comp_event: CompetitionEvent) -> PreparedLeaderboard:
+    is_fmc = comp_event.Event.name == 'FMC'
+    results = get_all_complete_user_results_for_comp_event(comp_event.id, omit_blacklisted=False,
+                                                           include_solves=is_fmc)
+
+    rows = [__build_row(result, is_fmc) for _, _, result in
+            sort_user_results_with_rankings(results, comp_event.Event.eventFormat)]
+    scrambles = [scramble.scramble for scramble in comp_event.scrambles]
+
+    return PreparedLeaderboard(rows, scrambles)
+
+
+def __build_row(result: UserEventResults, is_fmc: bool) -> LeaderboardRow:
+    # Split the times string into components to show the individual solves, or for FMC, each solve's scramble,
+    # solution, and move count, and make sure there are 5 of them, filled with blanks if necessary
+    if is_fmc:
+        solves_helper = [(solve.Scramble.scramble, solve.fmc_explanation, solve.get_friendly_time())
+                         for solve in result.solves]
+        solves_helper.extend([(None, None, None)] * (5 - len(solves_helper)))
+    else:
+        solves_helper = result.times_string.split(', ')
+        solves_helper.extend([''] * (5 - len(solves_helper)))
+
+    return LeaderboardRow(id=result.id,
+                          username=result.User.username,
+                          is_verified=result.User.is_verified,
+                          comment=result.comment,
+                          single=result.single,
+                          average=result.average,
+                          result=result.result,
+                          is_blacklisted=result.is_blacklisted,
+                          was_gold_medal=result.was_gold_medal,
+                          was_silver_medal=result.was_silver_medal,
+                          was_bronze_medal=result.was_bronze_medal,
+                          solves_helper=solves_helper,
+                          rank_key=(convert_time_to_sort_key(result.result),
+                                    convert_time_to_sort_key(result.single)))
+
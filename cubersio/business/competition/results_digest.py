@@ -0,0 +1,194 @@
+""" A digest of a finished competition's results, worked out once when it wraps up.
+
+Wrapping up a competition awards the medals, posts the results thread, and sends everybody who took part a report of
+how they did. Rather than each of those ranking every event's results again, the results are loaded in one query and
+ranked once into a digest, which is saved as a snapshot and read by each of them. Like the other snapshots, the digest
+records the generation of each event's results it was built from, and is built again if any of them have changed. """
+
+from collections import defaultdict, namedtuple
+import json
+from typing import Dict, List, Tuple
+
+from cubersio.business.competition.snapshots import get_comp_events_results_generations,\
+    are_comp_events_results_unchanged
+from cubersio.business.user_results import get_podium_ranks
+from cubersio.persistence.cache_generations_manager import bump_cache_generation, comp_event_results_cache_key
+from cubersio.persistence.comp_manager import get_all_comp_events_for_comp
+from cubersio.persistence.comp_snapshots_manager import get_competition_snapshot, save_competition_snapshot,\
+    results_digest_snapshot_key
+from cubersio.persistence.user_results_manager import get_complete_results_and_solves_counts_for_comp,\
+    bulk_save_event_results
+from cubersio.util.events.resources import sort_comp_events_by_global_sort_order
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are intended to be used directly.
+# -------------------------------------------------------------------------------------------------
+
+GOLD   = 'gold'
+SILVER = 'silver'
+BRONZE = 'bronze'
+
+# One user's non-blacklisted results in an event, ranked, with the result as it's shown to people
+RankedResult = namedtuple('RankedResult', ['rank', 'username', 'friendly_result'])
+
+# An event which somebody took part in, with everybody's non-blacklisted results, best first
+EventDigest = namedtuple('EventDigest', ['comp_event_id', 'event_name', 'ranked_results'])
+
+# How one user did in the competition, across their non-blacklisted results. `pb_events` are the names of the events
+# they set a PB in, and `podiums` are (event name, medal) for each event they podiumed in, both in event ID order.
+UserDigest = namedtuple('UserDigest', ['username', 'events_count', 'solves_count', 'pb_events', 'podiums'])
+
+# The whole digest. `medals` maps each medal-winning results ID to its medal, `user_points` is a list of
+# (username, points) in the order users first appear in `events`, and `users` maps each user ID to their UserDigest.
+ResultsDigest = namedtuple('ResultsDigest', ['events', 'medals', 'user_points', 'users'])
+
+
+def build_results_digest(comp_id: int) -> ResultsDigest:
+    """ Ranks every event's results in the competition into a digest, awards the medals it works out, and saves it,
+    replacing any digest saved before. This is only for wrapping up the competition, since it's what awards the
+    medals. """
+
+    generations, all_results, digest = __rank_results(comp_id)
+
+    # Awarding the medals changes those events' results, so their generations are one newer once it's done
+    for comp_event_id in __award_medals(digest.medals, [results for results, _, _ in all_results]):
+        generations[comp_event_id] += 1
+
+    data = {'generations': generations, 'digest': digest}
+    save_competition_snapshot(results_digest_snapshot_key(comp_id), comp_id, None, json.dumps(data))
+
+    return digest
+
+
+def get_results_digest(comp_id: int) -> ResultsDigest:
+    """ Returns the competition's saved results digest, or ranks the results into one again if there isn't one, or any
+    of the results have changed since it was. A digest ranked here isn't saved, and its medals aren't awarded, since
+    the competition may not even be over yet. """
+
+    snapshot = get_competition_snapshot(results_digest_snapshot_key(comp_id))
+    if snapshot:
+        data = json.loads(snapshot.data)
+        if are_comp_events_results_unchanged(data['generations']):
+            return __digest_from_json(data['digest'])
+
+    _, _, digest = __rank_results(comp_id)
+    return digest
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are not meant to be used directly; instead these are just dependencies
+# of the publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+def __rank_results(comp_id: int) -> Tuple[Dict[int, int], List, ResultsDigest]:
+    """ Loads every complete result in the competition and ranks them into a digest, without changing anything.
+    Returns a tuple of the generations of each event's results it was ranked from, the results along with their
+    usernames and solves counts, and the digest. """
+
+    comp_events = sort_comp_events_by_global_sort_order(get_all_comp_events_for_comp(comp_id))
+
+    # Read the generations before loading the results, so if they change in the meantime, the digest looks out of date
+    # rather than up to date
+    generations = get_comp_events_results_generations(comp_event.id for comp_event in comp_events)
+
+    all_results = get_complete_results_and_solves_counts_for_comp(comp_id)
+
+    return generations, all_results, __build_digest(comp_events, all_results)
+
+
+def __build_digest(comp_events: List, all_results: List) -> ResultsDigest:
+    """ Ranks each event's non-blacklisted results once, and works out the medals, points, and each user's summary
+    from those. """
+
+    usernames = dict()
+    solves_counts = dict()
+    results_by_comp_event_id = defaultdict(list)
+    for results, username, solves_count in all_results:
+        usernames[results.id] = username
+        solves_counts[results.id] = solves_count
+        if not results.is_blacklisted:
+            results_by_comp_event_id[results.comp_event_id].append(results)
+
+    events = list()
+    medals = dict()
+    user_points = dict()
+    event_names = dict()
+    for comp_event in comp_events:
+        event_names[comp_event.id] = comp_event.Event.name
+        results_list = results_by_comp_event_id[comp_event.id]
+        if not results_list:
+            continue
+
+        ranked = sort_user_results_with_rankings(results_list, comp_event.Event.eventFormat)
+        gold_rank, silver_rank, bronze_rank = get_podium_ranks(rank for rank, _, _ in ranked)
+        medals_by_rank = {gold_rank: GOLD, silver_rank: SILVER, bronze_rank: BRONZE}
+
+        # Each event gives everybody who took part in it (number of participants - place) points
+        participants_count = len(ranked)
+        ranked_results = list()
+        for rank, _, results in ranked:
+            username = usernames[results.id]
+            user_points[username] = user_points.get(username, 0) + participants_count - rank
+            ranked_results.append(RankedResult(rank, username, results.friendly_result()))
+            if rank in medals_by_rank and results.result != 'DNF':
+                medals[results.id] = medals_by_rank[rank]
+
+        events.append(EventDigest(comp_event.id, comp_event.Event.name, ranked_results))
+
+    # The results are ordered by event, so each user's events are too
+    users = dict()
+    for results, _, _ in all_results:
+        if results.is_blacklisted:
+            continue
+        user = users.setdefault(results.user_id, UserDigest(usernames[results.id], 0, 0, list(), list()))
+        event_name = event_names[results.comp_event_id]
+        if results.was_pb_average or results.was_pb_single:
+            user.pb_events.append(event_name)
+        if results.id in medals:
+            user.podiums.append((event_name, medals[results.id]))
+        users[results.user_id] = user._replace(events_count=user.events_count + 1,
+                                               solves_count=user.solves_count + solves_counts[results.id])
+
+    return ResultsDigest(events, medals, list(user_points.items()), users)
+
+
+def __award_medals(medals: Dict[int, str], all_results: List) -> List[int]:
+    """ Sets the medal flags of each of the results to match the medals, and saves whichever changed. Returns the IDs
+    of the comp events whose results changed. """
+
+    changed_results = list()
+    changed_comp_event_ids = list()
+    for results in all_results:
+        medal = medals.get(results.id)
+        flags = (medal == GOLD, medal == SILVER, medal == BRONZE)
+        if (bool(results.was_gold_medal), bool(results.was_silver_medal), bool(results.was_bronze_medal)) == flags:
+            continue
+
+        results.was_gold_medal, results.was_silver_medal, results.was_bronze_medal = flags
+        changed_results.append(results)
+        if results.comp_event_id not in changed_comp_event_ids:
+            changed_comp_event_ids.append(results.comp_event_id)
+
+    # Make sure the competition events' leaderboards show the new medals
+    for comp_event_id in changed_comp_event_ids:
+        bump_cache_generation(comp_event_results_cache_key(comp_event_id))
+    bulk_save_event_results(changed_results)
+
+    return changed_comp_event_ids
+
+
+def __digest_from_json(data: List) -> ResultsDigest:
+    """ Rebuilds a digest from its saved JSON form, where the namedtuples are lists and the dictionary keys are
+    strings. """
+
+    events, medals, user_points, users = data
+
+    return ResultsDigest(
+        events=[EventDigest(comp_event_id, event_name, [RankedResult(*row) for row in ranked_results])
+                for comp_event_id, event_name, ranked_results in events],
+        medals={int(results_id): medal for results_id, medal in medals.items()},
+        user_points=[tuple(points) for points in user_points],
+        users={int(user_id): UserDigest(username, events_count, solves_count, pb_events,
+                                        [tuple(podium) for podium in podiums])
+               for user_id, (username, events_count, solves_count, pb_events, podiums) in users.items()},
+    )
@@ -2,11 +2,9 @@
 scoring users, and posting the results. """
 
 from cubersio import app
+from cubersio.business.competition.results_digest import get_results_digest
 from cubersio.persistence.comp_manager import get_competition, save_competition
-from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event
 from cubersio.integrations.reddit import submit_post, update_post
-from cubersio.util.sorting import sort_user_results_with_rankings
-from cubersio.util.events.resources import sort_comp_events_by_global_sort_order
 
 # -------------------------------------------------------------------------------------------------
 
@@ -49,38 +47,24 @@ __LEADERBOARDS_URL_TEMPLATE = __URL_ROOT + 'leaderboards/{comp_id}/'
 def post_results_thread(competition_id, is_rerun=False):
     """ Iterate over the events in the competition being scored """
 
-    user_points = dict()
-
-    # Retrieve the competition being scored
+    # Retrieve the competition being scored, and its results, ranked
     comp = get_competition(competition_id)
+    digest = get_results_digest(competition_id)
 
     title = __RESULTS_TITLE_TEMPLATE.format(comp_title=comp.title)
     post_body = __RESULTS_BODY_START_TEMPLATE.format(comp_title=comp.title, point_user_limit=__USER_LIMIT_IN_POINTS,
         event_user_limit=__USER_PER_EVENT_LIMIT, leaderboards_url=__LEADERBOARDS_URL_TEMPLATE.format(comp_id=comp.id))
 
-    # Iterate over all the events in the competition, simultaneously building up the post body and
-    # tallying user points
-    for comp_event in sort_comp_events_by_global_sort_order(list(comp.events)):
-        results = list(get_all_complete_user_results_for_comp_event(comp_event.id))
-        if not results:
-            continue
-
-        results_with_ranks = sort_user_results_with_rankings(results, comp_event.Event.eventFormat)
-
-        post_body += __RESULTS_EVENT_HEADER_TEMPLATE.format(event_name=comp_event.Event.name)
-
-        total_participants = len(results)
-        for i, _, result in results_with_ranks:
-            username = result.User.username
-            if username not in user_points.keys():
-                user_points[username] = 0
-            user_points[username] += (total_participants - i)
+    # Iterate over all the events anybody took part in, building up the post body
+    for event in digest.events:
+        post_body += __RESULTS_EVENT_HEADER_TEMPLATE.format(event_name=event.event_name)
 
+        for i, username, friendly_result in event.ranked_results:
             if i <= __USER_PER_EVENT_LIMIT:
                 post_body += __RESULTS_USER_LINE_TEMPLATE.format(username=__escape_username(username),
-                    profile_url=__profile_for(username), result=result.friendly_result())
+                    profile_url=__profile_for(username), result=friendly_result)
 
-    user_points = [(username, points) for username, points in user_points.items()]
+    user_points = list(digest.user_points)
     user_points.sort(key=lambda x: x[1], reverse=True)
 
     post_body += __RESULTS_POINTS_SECTION_HEADER
@@ -0,0 +1,138 @@
+""" Freezing finished competitions into snapshots.
+
+Once a competition is over, its results only change when an admin moderates them. So when it wraps up, each of its
+events' leaderboards is frozen into a snapshot, along with the list of its events and everybody's overall points, and
+the leaderboards pages for it are served from those instead of being worked out from the results. Each snapshot
+records the generation of the results it was built from, so if the results change anyway, it's known to be out of date
+and isn't used until it's frozen again. """
+
+from collections import namedtuple
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cubersio.business.comp_event_leaderboards import freeze_comp_event_leaderboard
+from cubersio.business.overall_points import get_overall_points, refresh_overall_points
+from cubersio.persistence.cache_generations_manager import get_cache_generations, comp_event_results_cache_key
+from cubersio.persistence.comp_manager import get_all_comp_events_for_comp
+from cubersio.persistence.comp_snapshots_manager import get_competition_snapshot, save_competition_snapshot,\
+    competition_snapshot_key
+from cubersio.persistence.models import CompetitionEvent
+from cubersio.util.events.resources import sort_comp_events_by_global_sort_order
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are intended to be used directly.
+# -------------------------------------------------------------------------------------------------
+
+# A competition's events, in the order they're shown on its leaderboards page, as a list of dicts of each event's name,
+# comp event ID and event ID, along with the comp event ID of 3x3, which is the tab shown first
+CompetitionEventsInfo = namedtuple('CompetitionEventsInfo', ['events_names_ids', 'id_3x3'])
+
+
+def get_competition_events_info(comp_id: int) -> CompetitionEventsInfo:
+    """ Returns the competition's events, in the order they're shown on its leaderboards page. They never change, so
+    they're served from the competition's snapshot if it has one. """
+
+    snapshot = get_competition_snapshot(competition_snapshot_key(comp_id))
+    if snapshot:
+        data = json.loads(snapshot.data)
+        return CompetitionEventsInfo(data['events_names_ids'], data['id_3x3'])
+
+    return __build_competition_events_info(__get_sorted_comp_events(comp_id))
+
+
+def get_frozen_overall_points(comp_id: int) -> Optional[List[Tuple[str, int]]]:
+    """ Returns the overall points frozen in the competition's snapshot, as a list of (username, points), or None if
+    there's no snapshot, or any of its events' results have changed since it was frozen. """
+
+    snapshot = get_competition_snapshot(competition_snapshot_key(comp_id))
+    if not snapshot:
+        return None
+
+    data = json.loads(snapshot.data)
+    if not are_comp_events_results_unchanged(data['generations']):
+        return None
+
+    return [tuple(user_points) for user_points in data['overall_points']]
+
+
+def get_comp_events_results_generations(comp_event_ids: Iterable[int]) -> Dict[int, int]:
+    """ Returns the current generation of each of the competition events' results, as a dictionary of comp event ID
+    to generation. """
+
+    keys_by_comp_event_id = {comp_event_id: comp_event_results_cache_key(comp_event_id)
+                             for comp_event_id in comp_event_ids}
+    generations = get_cache_generations(keys_by_comp_event_id.values())
+
+    return {comp_event_id: generations.get(key, 0) for comp_event_id, key in keys_by_comp_event_id.items()}
+
+
+def are_comp_events_results_unchanged(frozen_generations: Dict) -> bool:
+    """ Returns whether none of the competition events' results have changed since something was frozen from them,
+    where `frozen_generations` is the generation of each one's results at the time, keyed by comp event ID. Those
+    keys can be strings, as they are once they've been through JSON. """
+
+    generations = get_comp_events_results_generations(int(comp_event_id) for comp_event_id in frozen_generations)
+    return all(generations[int(comp_event_id)] == frozen_generation
+               for comp_event_id, frozen_generation in frozen_generations.items())
+
+
+def freeze_competition(comp_id: int):
+    """ Freezes every one of the competition's events' leaderboards into snapshots, along with its events and overall
+    points. """
+
+    comp_events = __get_sorted_comp_events(comp_id)
+    for comp_event in comp_events:
+        freeze_comp_event_leaderboard(comp_event)
+
+    __freeze_competition_overview(comp_id, comp_events)
+
+
+def refreeze_comp_event(comp_event: CompetitionEvent):
+    """ Freezes the competition event's leaderboard again after its results have changed, along with its competition's
+    overall points, which are likely to have changed too. """
+
+    freeze_comp_event_leaderboard(comp_event)
+    __freeze_competition_overview(comp_event.competition_id, __get_sorted_comp_events(comp_event.competition_id))
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are not meant to be used directly; instead these are just dependencies
+# of the publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+def __get_sorted_comp_events(comp_id: int) -> List[CompetitionEvent]:
+    return sort_comp_events_by_global_sort_order(get_all_comp_events_for_comp(comp_id))
+
+
+def __build_competition_events_info(comp_events: List[CompetitionEvent]) -> CompetitionEventsInfo:
+    events_names_ids = list()
+    id_3x3 = None
+    for comp_event in comp_events:
+        if comp_event.Event.name == '3x3':
+            id_3x3 = comp_event.id
+        events_names_ids.append({
+            'name':          comp_event.Event.name,
+            'comp_event_id': comp_event.id,
+            'event_id':      comp_event.Event.id,
+        })
+
+    return CompetitionEventsInfo(events_names_ids, id_3x3)
+
+
+def __freeze_competition_overview(comp_id: int, comp_events: List[CompetitionEvent]):
+    """ Freezes the competition's events and overall points into its snapshot, along with the generation of each
+    event's results the overall points were worked out from. """
+
+    # Read the generations before working out the points, so if results change in the meantime, the snapshot looks out
+    # of date rather than up to date
+    generations = get_comp_events_results_generations(comp_event.id for comp_event in comp_events)
+    refresh_overall_points(comp_id)
+
+    events_info = __build_competition_events_info(comp_events)
+    data = {
+        'events_names_ids': events_info.events_names_ids,
+        'id_3x3':           events_info.id_3x3,
+        'overall_points':   [tuple(user_points) for user_points in get_overall_points(comp_id)],
+        'generations':      generations,
+    }
+
+    save_competition_snapshot(competition_snapshot_key(comp_id), comp_id, None, json.dumps(data))
@@ -0,0 +1,127 @@
+""" Serving an event's records a page at a time.
+
+Each process caches a snapshot of every event's ordered single and average PBs, good for as long as nobody's PBs for
+that event change. Pages are keyset-paginated on the PBs' sort keys rather than by offset, so paging through the
+records doesn't skip or repeat anybody when PBs are set in the meantime. """
+
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+from cubersio.business.rankings import get_ordered_pbs_for_event
+from cubersio.persistence.cache_generations_manager import get_cache_generation, event_results_cache_key
+from cubersio.persistence.models import PersonalBestRecord
+from cubersio.util.cache import GenerationalCache
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are intended to be used directly.
+# -------------------------------------------------------------------------------------------------
+
+PB_TYPE_SINGLE  = 'single'
+PB_TYPE_AVERAGE = 'average'
+
+# How many PBs to show per page of an event's records
+EVENT_RECORDS_PAGE_SIZE = 100
+
+# One page of an event's single or average records. The cursors are for the pages before and after this one, or None if
+# this is the first or last page. `user_page_args` are the query args for a page the requested user appears on, or None
+# if they aren't in these records.
+EventRecordsPage = namedtuple('EventRecordsPage', ['records', 'before', 'after', 'user_page_args', 'user_on_page'])
+
+
+class RankedRecords:
+    """ An event's ordered single or average PBs, along with their sort keys, for finding where a page starts by binary
+    search, and where each user's PB is. """
+
+    def __init__(self, records: List[PersonalBestRecord]):
+        self.records = records
+        self.keys = [record.sort_key for record in records]
+        self.user_positions = {record.username: i for i, record in enumerate(records)}
+
+
+    def page(self, after: Optional[Tuple] = None, before: Optional[Tuple] = None,
+             username: Optional[str] = None) -> EventRecordsPage:
+        """ Returns the page of records which come right after the `after` sort key, or right before the `before` sort
+        key, or otherwise the first page. """
+
+        if after is not None:
+            start = bisect_right(self.keys, after)
+        elif before is not None:
+            start = max(0, bisect_left(self.keys, before) - EVENT_RECORDS_PAGE_SIZE)
+        else:
+            start = 0
+        end = min(start + EVENT_RECORDS_PAGE_SIZE, len(self.records))
+
+        before_cursor = encode_cursor(self.keys[start]) if start > 0 else None
+        after_cursor  = encode_cursor(self.keys[end - 1]) if end < len(self.records) else None
+
+        position = self.user_positions.get(username)
+        user_on_page = position is not None and start <= position < end
+
+        return EventRecordsPage(self.records[start:end], before_cursor, after_cursor,
+                                self._user_page_args(position), user_on_page)
+
+
+    def _user_page_args(self, position: Optional[int]) -> Optional[dict]:
+        """ Returns the query args for a page with the user at the specified position on it. That's the first page if
+        they're close enough to the top, or else the page starting with them, so they're easy to find. """
+
+        if position is None:
+            return None
+        if position < EVENT_RECORDS_PAGE_SIZE:
+            return dict()
+
+        return dict(after=encode_cursor(self.keys[position - 1]))
+
+
+def encode_cursor(sort_key: Tuple) -> str:
+    """ Encodes a PB's sort key as a cursor for a page's query args. """
+
+    return '.'.join(str(part) for part in sort_key)
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple]:
+    """ Decodes a cursor back into a sort key, or returns None if it isn't a valid cursor. """
+
+    if not cursor:
+        return None
+
+    try:
+        sort_key = tuple(int(part) for part in cursor.split('.'))
+    except ValueError:
+        return None
+
+    return sort_key if len(sort_key) == 3 else None
+
+
+def get_event_records_pages(event_id: int,
+                            include_averages: bool,
+                            pb_type: str,
+                            after: Optional[str] = None,
+                            before: Optional[str] = None,
+                            username: Optional[str] = None) -> Tuple[EventRecordsPage, EventRecordsPage]:
+    """ Returns a tuple of pages of an event's single and average records. The page of the records picked by `pb_type`
+    is the one after or before the specified cursor, and the other is the first page. """
+
+    generation = get_cache_generation(event_results_cache_key(event_id))
+    singles, averages = __EVENT_RECORDS_CACHE.get((event_id, include_averages), generation,
+                                                  lambda: __load_event_records(event_id, include_averages))
+
+    after, before = decode_cursor(after), decode_cursor(before)
+    if pb_type == PB_TYPE_AVERAGE:
+        return singles.page(username=username), averages.page(after, before, username)
+
+    return singles.page(after, before, username), averages.page(username=username)
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are not meant to be used directly; instead these are just dependencies
+# of the publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+# The cached single and average records for each event, good for as long as the event's results generation is current
+__EVENT_RECORDS_CACHE = GenerationalCache(max_entries=64)
+
+
+def __load_event_records(event_id: int, include_averages: bool) -> Tuple[RankedRecords, RankedRecords]:
+    singles, averages = get_ordered_pbs_for_event(event_id, include_averages=include_averages)
+    return RankedRecords(singles), RankedRecords(averages)
@@ -0,0 +1,148 @@
+""" Building, publishing, and serving the Sum of Ranks and Kinchranks leaderboards.
+
+Each site rankings run publishes a snapshot of every leaderboard, already sorted and ranked, so serving a page of a
+leaderboard is just a matter of slicing the latest snapshot. Snapshots are cached in-process by the ID of the rankings
+run which published them, so a new run's snapshots are picked up as soon as they're published. """
+
+from collections import namedtuple
+from functools import lru_cache
+import json
+from math import ceil
+from typing import Dict, List, Optional, Tuple
+
+from cubersio.persistence.leaderboard_snapshots_manager import save_leaderboard_snapshots,\
+    get_latest_leaderboard_snapshots_run_id, get_leaderboard_snapshot_data
+from cubersio.persistence.user_site_rankings_manager import get_all_sums_of_ranks_and_kinchranks
+
+# -------------------------------------------------------------------------------------------------
+
+SUM_OF_RANKS_ALL_SINGLE      = 'sum_of_ranks_all_single'
+SUM_OF_RANKS_ALL_AVERAGE     = 'sum_of_ranks_all_average'
+SUM_OF_RANKS_WCA_SINGLE      = 'sum_of_ranks_wca_single'
+SUM_OF_RANKS_WCA_AVERAGE     = 'sum_of_ranks_wca_average'
+SUM_OF_RANKS_NON_WCA_SINGLE  = 'sum_of_ranks_non_wca_single'
+SUM_OF_RANKS_NON_WCA_AVERAGE = 'sum_of_ranks_non_wca_average'
+KINCHRANKS_ALL               = 'kinchranks_all'
+KINCHRANKS_WCA               = 'kinchranks_wca'
+KINCHRANKS_NON_WCA           = 'kinchranks_non_wca'
+
+# A map of each leaderboard to the UserSiteRankings column it's ranked by, and whether it's a Kinchranks leaderboard,
+# where higher is better, rather than a Sum of Ranks leaderboard, where lower is better
+__LEADERBOARDS = {
+    SUM_OF_RANKS_ALL_SINGLE:      ('sum_all_single', False),
+    SUM_OF_RANKS_ALL_AVERAGE:     ('sum_all_average', False),
+    SUM_OF_RANKS_WCA_SINGLE:      ('sum_wca_single', False),
+    SUM_OF_RANKS_WCA_AVERAGE:     ('sum_wca_average', False),
+    SUM_OF_RANKS_NON_WCA_SINGLE:  ('sum_non_wca_single', False),
+    SUM_OF_RANKS_NON_WCA_AVERAGE: ('sum_non_wca_average', False),
+    KINCHRANKS_ALL:               ('all_kinchrank', True),
+    KINCHRANKS_WCA:               ('wca_kinchrank', True),
+    KINCHRANKS_NON_WCA:           ('non_wca_kinchrank', True),
+}
+
+# How many users to show per page of a leaderboard
+LEADERBOARD_PAGE_SIZE = 100
+
+# One page of a leaderboard. The rows are (rank, username, value) tuples, and `user_page` is the page the requested
+# user appears on, or None if they aren't on the leaderboard.
+LeaderboardPage = namedtuple('LeaderboardPage', ['rows', 'page', 'page_count', 'user_page'])
+
+# A leaderboard's rows, along with a map of username to position in those rows
+Leaderboard = Tuple[List[Tuple[int, str, str]], Dict[str, int]]
+
+# -------------------------------------------------------------------------------------------------
+
+def publish_leaderboard_snapshots(rankings_run_id: int) -> int:
+    """ Builds every leaderboard from the current site rankings, and saves them as the snapshots published by the
+    specified rankings run. Returns the total number of rows across all the leaderboards. """
+
+    site_rankings = get_all_sums_of_ranks_and_kinchranks()
+
+    snapshots = dict()
+    rows_count = 0
+    for leaderboard in __LEADERBOARDS:
+        rows = build_leaderboard_rows(site_rankings, leaderboard)
+        snapshots[leaderboard] = json.dumps(rows)
+        rows_count += len(rows)
+
+    save_leaderboard_snapshots(rankings_run_id, snapshots)
+
+    return rows_count
+
+
+def build_leaderboard_rows(site_rankings, leaderboard: str) -> List[Tuple[int, str, str]]:
+    """ Builds the rows of the specified leaderboard from the rows returned by `get_all_sums_of_ranks_and_kinchranks`,
+    as (rank, username, value) tuples in the order they're displayed.
+
+    Users who haven't participated in any of the leaderboard's events are left off. For Sum of Ranks that's everybody
+    with the worst possible sum, and for Kinchranks that's everybody with a Kinchrank of 0. Users with the same value
+    share a rank, and the next rank after them skips ahead accordingly, like 1, 2, 2, 4. Ties are listed by username. """
+
+    column, is_kinchranks = __LEADERBOARDS[leaderboard]
+
+    values = [(getattr(row, column), row.username) for row in site_rankings]
+    values = [value for value in values if value[0] is not None]
+    if not values:
+        return list()
+
+    if is_kinchranks:
+        values = [value for value in values if value[0] != 0]
+        values.sort(key=lambda value: (-value[0], value[1]))
+    else:
+        max_sum_of_ranks = max(value[0] for value in values)
+        values = [value for value in values if value[0] != max_sum_of_ranks]
+        values.sort()
+
+    rows = list()
+    rank = 0
+    previous_value = None
+    for i, (value, username) in enumerate(values, start=1):
+        # Kinchranks are compared as displayed, so users who look tied are tied
+        display_value = format(value, '.3f') if is_kinchranks else str(value)
+        if display_value != previous_value:
+            rank = i
+            previous_value = display_value
+        rows.append((rank, username, display_value))
+
+    return rows
+
+
+def get_leaderboard_page(leaderboard: str, page: int, username: Optional[str] = None) -> LeaderboardPage:
+    """ Returns the specified page of a leaderboard, from the latest published snapshot. Pages start at 1, and a page
+    out of range is clamped to the first or last page. If no snapshots have been published yet, the leaderboard is built
+    from the current site rankings instead. """
+
+    rankings_run_id = get_latest_leaderboard_snapshots_run_id()
+    loaded = __load_leaderboard_snapshot(rankings_run_id, leaderboard) if rankings_run_id is not None else None
+    rows, username_positions = loaded or __build_leaderboard(leaderboard)
+
+    page_count = max(1, ceil(len(rows) / LEADERBOARD_PAGE_SIZE))
+    page = min(max(page, 1), page_count)
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
+
+    user_position = username_positions.get(username)
+    user_page = user_position // LEADERBOARD_PAGE_SIZE + 1 if user_position is not None else None
+
+    return LeaderboardPage(rows[start:start + LEADERBOARD_PAGE_SIZE], page, page_count, user_page)
+
+
+@lru_cache(maxsize=2 * len(__LEADERBOARDS))
+def __load_leaderboard_snapshot(rankings_run_id: int, leaderboard: str) -> Optional[Leaderboard]:
+    """ Loads a leaderboard snapshot published by the specified rankings run, or returns None if it didn't publish
+    one. Cached by run ID, so each snapshot is only loaded from the database once. """
+
+    data = get_leaderboard_snapshot_data(rankings_run_id, leaderboard)
+    if data is None:
+        return None
+
+    return __with_username_positions([tuple(row) for row in json.loads(data)])
+
+
+def __build_leaderboard(leaderboard: str) -> Leaderboard:
+    """ Builds a leaderboard from the current site rankings, for when there's no snapshot to serve. """
+
+    return __with_username_positions(build_leaderboard_rows(get_all_sums_of_ranks_and_kinchranks(), leaderboard))
+
+
+def __with_username_positions(rows) -> Leaderboard:
+    return rows, {row[1]: i for i, row in enumerate(rows)}
@@ -0,0 +1,64 @@
+""" Keeping track of everybody's overall points for a competition.
+
+Each event in a competition gives everybody who took part in it (number of participants - place) points. Each user's
+points for each competition event are stored, along with their total for the competition. Whenever somebody's results
+in a competition event change, the generation of that competition event's results is bumped. When the points are
+refreshed, which is done by a task rather than whenever they're read, just the competition events whose results have
+changed since their points were worked out are ranked again by the database, and everybody's totals are adjusted by
+the difference. """
+
+from typing import Dict, List, Optional, Tuple
+
+from cubersio.persistence.cache_generations_manager import get_cache_generations, comp_event_results_cache_key
+from cubersio.persistence.comp_points_manager import get_comp_events_points_generations, get_user_comp_event_points,\
+    replace_user_comp_event_points, get_overall_points_leaderboard
+from cubersio.persistence.user_results_manager import get_user_ranks_for_comp_event
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are intended to be used directly.
+# -------------------------------------------------------------------------------------------------
+
+def get_overall_points(comp_id: int) -> List[Tuple[str, int]]:
+    """ Returns a list of (username, points) for everybody who has taken part in the specified competition, ordered
+    by their overall points for it, most first, as of when they were last refreshed. """
+
+    return get_overall_points_leaderboard(comp_id)
+
+
+def refresh_overall_points(comp_id: int):
+    """ Works out the points again for each of the competition's events whose results have changed since they last
+    were, and adjusts everybody's overall points for the competition by the difference. """
+
+    comp_events = get_comp_events_points_generations(comp_id)
+    generations = get_cache_generations(comp_event_results_cache_key(comp_event_id)
+                                        for comp_event_id, _ in comp_events)
+
+    for comp_event_id, points_generation in comp_events:
+        generation = generations.get(comp_event_results_cache_key(comp_event_id), 0)
+        if points_generation != generation:
+            __update_comp_event_points(comp_id, comp_event_id, points_generation, generation)
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are not meant to be used directly; instead these are just dependencies
+# of the publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+def __update_comp_event_points(comp_id: int,
+                               comp_event_id: int,
+                               old_generation: Optional[int],
+                               new_generation: int):
+    """ Works out everybody's points for the competition event from its results as of `new_generation`, and adjusts
+    their overall points by how much that's changed since `old_generation`. If somebody else got there first, their
+    update stands. """
+
+    new_points = __calculate_points(get_user_ranks_for_comp_event(comp_event_id))
+
+    replace_user_comp_event_points(comp_id, comp_event_id, old_generation, new_generation,
+                                   get_user_comp_event_points(comp_event_id), new_points)
+
+
+def __calculate_points(user_ranks: List) -> Dict[int, int]:
+    """ Returns the points each user gets for their rank in an event, as a dictionary of user ID to points. """
+
+    participants_count = len(user_ranks)
+    return {user_id: participants_count - rank for user_id, rank in user_ranks}
@@ -0,0 +1,216 @@
+""" An in-process index of everybody's PBs in each event, for looking up the site rank of a time without waiting for
+the site rankings job.
+
+Each event's single and average PBs are kept as sorted lists of their rank keys, so the rank of a time is found by
+binary search, without a database round-trip. An event's index is loaded from the ordered PBs in the background the
+first time it's looked up, so nothing waits on loading it, and kept current by recording each new PB once it's
+committed. Each process has its own index, and only hears about the PBs it sets itself, so an event's index is reloaded
+in the background once it's older than `RANK_INDEX_MAX_AGE_SECONDS` to pick up PBs set elsewhere, along with
+blacklistings and other changes which don't come through as new PBs. """
+
+from bisect import bisect_left, insort
+from threading import Lock, Thread
+from timeit import default_timer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from cubersio import app, DB
+from cubersio.business.rankings import get_ordered_pbs_for_event
+from cubersio.persistence.models import RankedPersonalBest
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are intended to be used directly.
+# -------------------------------------------------------------------------------------------------
+
+class PersonalBestRankIndex:
+    """ The rank keys of everybody's PBs of one type (single or average) in one event, in sorted order, along with each
+    user's current key so it can be replaced when they set a new PB. DNFs aren't included, since they can't be ranked
+    against any time. """
+
+    def __init__(self, ranked_pbs: Iterable[RankedPersonalBest]):
+        self._user_keys: Dict[int, int] = dict()
+        for ranked_pb in ranked_pbs:
+            key = rank_key(ranked_pb.personal_best)
+            if key is not None:
+                self._user_keys[ranked_pb.user_id] = key
+
+        self._keys = sorted(self._user_keys.values())
+
+
+    def __len__(self):
+        return len(self._keys)
+
+
+    def rank(self, key: int) -> int:
+        """ Returns the site rank of the specified rank key, which is one more than the number of PBs strictly faster
+        than it, the same as the ranks calculated for the ordered PBs. """
+
+        return bisect_left(self._keys, key) + 1
+
+
+    def update(self, user_id: int, key: int):
+        """ Records a new PB for the user, replacing their previous one. """
+
+        previous_key = self._user_keys.get(user_id)
+        if previous_key is not None:
+            del self._keys[bisect_left(self._keys, previous_key)]
+
+        self._user_keys[user_id] = key
+        insort(self._keys, key)
+
+
+def rank_key(value) -> Optional[int]:
+    """ Returns the rank key for a single or average as stored in UserEventResults, which is its integer value. DNFs
+    and missing values don't have one. """
+
+    if value is None or value in ('', 'DNF'):
+        return None
+
+    return int(value)
+
+
+def get_site_ranks(event_id: int, single=None, average=None) -> Tuple[Optional[int], Optional[int]]:
+    """ Returns a tuple of the site ranks a single and an average would have in the specified event, as the number of
+    people with a faster PB plus one. Either is None if the value wasn't given, or isn't a time, and both are if the
+    event's index hasn't been loaded yet. """
+
+    indexes = __get_event_rank_indexes(event_id)
+    if not indexes:
+        return None, None
+
+    singles, averages = indexes
+    single_key  = rank_key(single)
+    average_key = rank_key(average)
+
+    with __INDEXES_LOCK:
+        single_rank  = singles.rank(single_key) if single_key is not None else None
+        average_rank = averages.rank(average_key) if average_key is not None else None
+
+    return single_rank, average_rank
+
+
+def get_ranked_pbs_counts(event_id: int) -> Tuple[int, int]:
+    """ Returns a tuple of how many people have a single and an average PB in the specified event, other than DNFs, or
+    zero for both if the event's index hasn't been loaded yet. """
+
+    indexes = __get_event_rank_indexes(event_id)
+    if not indexes:
+        return 0, 0
+
+    singles, averages = indexes
+    return len(singles), len(averages)
+
+
+def record_personal_best(user_id: int, event_id: int, single=None, average=None):
+    """ Records a user's new single or average PB in the specified event, once the results it was set in are committed.
+    If they never are, it's forgotten. """
+
+    single_key  = rank_key(single)
+    average_key = rank_key(average)
+    if single_key is None and average_key is None:
+        return
+
+    DB.session.info.setdefault(__PENDING_PBS_KEY, list()).append((user_id, event_id, single_key, average_key))
+
+# -------------------------------------------------------------------------------------------------
+# Functions and types below are not meant to be used directly; instead these are just dependencies
+# of the publicly-visible functions above.
+# -------------------------------------------------------------------------------------------------
+
+# A map of event ID to (time loaded, single PBs index, average PBs index), guarded by the lock for updates
+__INDEXES: Dict[int, Tuple[float, PersonalBestRankIndex, PersonalBestRankIndex]] = dict()
+__INDEXES_LOCK = Lock()
+
+# A map of the ID of each event whose index is being loaded to the PBs recorded in the meantime, as (user ID, single
+# key, average key), which the loaded index might have missed. Guarded by the same lock.
+__LOADING: Dict[int, List[Tuple[int, Optional[int], Optional[int]]]] = dict()
+
+# The key in a session's info of the PBs set in it which are waiting for it to commit, as (user ID, event ID, single
+# key, average key)
+__PENDING_PBS_KEY = 'pending_personal_bests'
+
+
+@event.listens_for(DB.session, 'after_commit')
+def __record_pending_personal_bests(session):
+    """ Records the PBs set in the session in the loaded indexes, now they're committed. Events whose indexes aren't
+    loaded will pick them up when they are. """
+
+    with __INDEXES_LOCK:
+        for user_id, event_id, single_key, average_key in session.info.pop(__PENDING_PBS_KEY, list()):
+            if event_id in __LOADING:
+                __LOADING[event_id].append((user_id, single_key, average_key))
+
+            indexes = __INDEXES.get(event_id)
+            if indexes:
+                __update_indexes(indexes[1], indexes[2], user_id, single_key, average_key)
+
+
+@event.listens_for(DB.session, 'after_soft_rollback')
+def __forget_pending_personal_bests(session, previous_transaction):
+    """ Forgets the PBs set in the session, since they were never committed. """
+
+    session.info.pop(__PENDING_PBS_KEY, None)
+
+
+def __update_indexes(singles: PersonalBestRankIndex,
+                     averages: PersonalBestRankIndex,
+                     user_id: int,
+                     single_key: Optional[int],
+                     average_key: Optional[int]):
+    if single_key is not None:
+        singles.update(user_id, single_key)
+    if average_key is not None:
+        averages.update(user_id, average_key)
+
+
+def __get_event_rank_indexes(event_id: int) -> Optional[Tuple[PersonalBestRankIndex, PersonalBestRankIndex]]:
+    """ Returns the single and average PB indexes for the specified event, or None if they haven't been loaded yet. If
+    they haven't, or have gotten too old, they're loaded again in the background, and the old ones are used until
+    then. """
+
+    indexes = __INDEXES.get(event_id)
+    if not indexes or default_timer() - indexes[0] >= app.config['RANK_INDEX_MAX_AGE_SECONDS']:
+        __start_loading_event_rank_indexes(event_id)
+        indexes = __INDEXES.get(event_id)
+
+    return (indexes[1], indexes[2]) if indexes else None
+
+
+def __start_loading_event_rank_indexes(event_id: int):
+    """ Starts loading the indexes for the specified event in a background thread, unless they're already being
+    loaded. They're loaded right away instead if `RANK_INDEX_LOAD_IN_BACKGROUND` is off. """
+
+    with __INDEXES_LOCK:
+        if event_id in __LOADING:
+            return
+        __LOADING[event_id] = list()
+
+    if app.config['RANK_INDEX_LOAD_IN_BACKGROUND']:
+        Thread(target=__load_event_rank_indexes_in_app_context, args=(event_id,), daemon=True).start()
+    else:
+        __load_event_rank_indexes(event_id)
+
+
+def __load_event_rank_indexes_in_app_context(event_id: int):
+    with app.app_context():
+        __load_event_rank_indexes(event_id)
+
+
+def __load_event_rank_indexes(event_id: int):
+    """ Loads the indexes for the specified event from its ordered PBs, along with any PBs recorded while they were
+    loading. """
+
+    try:
+        loaded_at = default_timer()
+        singles, averages = get_ordered_pbs_for_event(event_id, compact=True)
+        singles_index, averages_index = PersonalBestRankIndex(singles), PersonalBestRankIndex(averages)
+
+        with __INDEXES_LOCK:
+            for user_id, single_key, average_key in __LOADING[event_id]:
+                __update_indexes(singles_index, averages_index, user_id, single_key, average_key)
+            __INDEXES[event_id] = (loaded_at, singles_index, averages_index)
+
+    finally:
+        with __INDEXES_LOCK:
+            del __LOADING[event_id]
@@ -1,380 +1,556 @@
 """ Business logic for determining user site rankings and PBs. """
 
-from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import gc
+from itertools import groupby, islice
 import json
+from multiprocessing import get_context
+from operator import attrgetter
+import os
 from timeit import default_timer
-from typing import Dict, List, Set
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from ranking import Ranking
+from sqlalchemy import BigInteger
+from sqlalchemy.sql import func, select, union_all, case, cast, or_, literal, null
 
-from cubersio import DB
-from cubersio.util.events.mbld import MbldSolve
+from cubersio import app, DB
+from cubersio.business.leaderboards import publish_leaderboard_snapshots
+from cubersio.business.rankings_matrix import calculate_site_rankings_matrix, calculate_event_kinch
 from cubersio.persistence.models import Competition, CompetitionEvent, Event, UserEventResults, User, UserSiteRankings,\
-    EventFormat, PersonalBestRecord
+    PersonalBestRecord, RankedPersonalBest, RankingsRun
+from cubersio.persistence.dialect import database_supports_window_functions
 from cubersio.persistence.events_manager import get_all_events, get_all_WCA_events
-from cubersio.persistence.user_site_rankings_manager import bulk_update_site_rankings
-from cubersio.util.sorting import sort_personal_best_records
+from cubersio.persistence.rankings_runs_manager import save_rankings_run, complete_rankings_run
+from cubersio.persistence.user_site_rankings_manager import bulk_update_site_rankings, get_all_site_rankings,\
+    get_site_rankings_dirty_events, clear_site_rankings_dirty_events
+from cubersio.util.profiling import JobProfiler
+from cubersio.util.times import NO_TIME_SORT_KEY
 
+# The ordered PB queries return singles and averages together, distinguished by this
+_PB_TYPE_SINGLE  = 0
+_PB_TYPE_AVERAGE = 1
 
-def calculate_user_site_rankings() -> None:
-    """ Calculate user event site rankings based on PBs. """
+# How many rows of ordered PBs to fetch from the database at a time
+_ORDERED_PBS_YIELD_PER = 1000
+
+# When saving site rankings in streaming mode, how many users' site rankings to save at a time to start with, and the
+# fewest it'll drop down to if memory use is over the ceiling
+_STREAMING_CHUNK_SIZE     = 500
+_STREAMING_MIN_CHUNK_SIZE = 50
+
+# The phases of the site rankings job, as recorded in each RankingsRun. PBs are fetched one phase per event, named like
+# "fetch_pbs:3x3".
+_PHASE_FETCH_PBS     = 'fetch_pbs'
+_PHASE_RANKING       = 'ranking'
+_PHASE_USER_RANKINGS = 'user_rankings'
+_PHASE_BULK_WRITE    = 'bulk_write'
+_PHASE_LEADERBOARDS  = 'leaderboards'
+
+
+def calculate_user_site_rankings(incremental: bool = False) -> None:
+    """ Calculate user event site rankings based on PBs.
+
+    If `incremental` is True, only the events which have been marked dirty since the last run are re-ranked, and each
+    user's existing rankings data is reused for all other events. Otherwise every event is re-ranked from scratch. """
 
     all_events = [e for e in get_all_events() if e.name != "COLL"]
     wca_event_ids = set(e.id for e in get_all_WCA_events())
 
-    # These are of the form dict[Event, [ordered list of PersonalBestRecords]]
+    # Grab the dirty events before doing anything else. Only the dirty records seen here are cleared at the end, so
+    # any results saved while the rankings are being calculated will get picked up on the next run.
+    dirty_record_ids, dirty_event_ids = get_site_rankings_dirty_events()
+
+    if incremental:
+        events_to_rank = [e for e in all_events if e.id in dirty_event_ids]
+        if not events_to_rank:
+            clear_site_rankings_dirty_events(dirty_record_ids)
+            print("[RANKINGS] No events have changed since site rankings were last calculated.")
+            return
+    else:
+        events_to_rank = all_events
+
+    # Only a full run has enough work to be worth farming out to other processes
+    workers = 1 if incremental else app.config['RANKINGS_WORKERS']
+
+    # The run is recorded up front, so the leaderboard snapshots it publishes can refer to it
+    rankings_run_id = save_rankings_run(RankingsRun(timestamp=datetime.now(), is_incremental=incremental,
+                                                    workers=workers))
+    t0 = default_timer()
+
+    with JobProfiler(trace_memory=app.config['RANKINGS_TRACE_MEMORY']) as profiler:
+        ranked_users_count, saved_count = _calculate_and_save_site_rankings(
+            profiler, incremental, events_to_rank, all_events, wca_event_ids, workers)
+
+        # Everything that was dirty when we started is now up-to-date
+        with profiler.phase(_PHASE_BULK_WRITE):
+            clear_site_rankings_dirty_events(dirty_record_ids)
+
+        with profiler.phase(_PHASE_LEADERBOARDS) as phase:
+            phase.rows = publish_leaderboard_snapshots(rankings_run_id)
+
+    t1 = default_timer()
+
+    complete_rankings_run(rankings_run_id, users_count=saved_count, total_seconds=round(t1 - t0, 3),
+                          phases=json.dumps([phase.to_dict() for phase in profiler.phases.values()]))
+
+    if incremental:
+        print(f"[RANKINGS] {t1 - t0}s elapsed to incrementally calculate site rankings for {len(events_to_rank)} " +
+              f"events, {saved_count} users updated.")
+    else:
+        print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {ranked_users_count} users " +
+              f"with {workers} worker(s).")
+
+
+def _calculate_and_save_site_rankings(profiler: JobProfiler,
+                                      incremental: bool,
+                                      events_to_rank: List[Event],
+                                      all_events: List[Event],
+                                      wca_event_ids: Set[int],
+                                      workers: int) -> Tuple[int, int]:
+    """ Ranks the specified events, calculates the site rankings for everybody affected, and saves them, recording each
+    phase of the work with the profiler. Returns a tuple of the number of users with PBs in the ranked events, and the
+    number of UserSiteRankings saved. """
+
+    # These are of the form dict[Event, [ordered list of RankedPersonalBests]]
     events_pb_singles = dict()
     events_pb_averages = dict()
 
-    # These are of the form dict[Event, dict[user ID, index in ordered PB records list]]
-    events_pb_singles_ix = dict()
-    events_pb_averages_ix = dict()
-
-    # These are of the form dict[Event, int]
-    events_singles_len = dict()
-    events_averages_len = dict()
+    # This is of the form dict[Event, dict[user ID, Kinch score]]
+    events_kinch = dict()
 
     # All user IDs seen, so we only iterate over users that have participated in something
     all_user_ids = set()
 
-    t0 = default_timer()
+    # Retrieve the ordered lists of RankedPersonalBests for singles and averages, and the Kinch scores, for every event.
+    # Events nobody has competed in aren't included.
+    for event, ordered_pb_singles, ordered_pb_averages, event_kinch in \
+            _profile_ranked_events(profiler, _rank_events(events_to_rank, workers)):
 
-    for event in all_events:
+        # If nobody has a single in this event, just move on to the next
+        if not ordered_pb_singles:
+            continue
+
+        with profiler.phase(_PHASE_RANKING) as phase:
+            phase.rows = len(ordered_pb_singles) + len(ordered_pb_averages)
+
+            events_pb_singles[event] = ordered_pb_singles
+            events_pb_averages[event] = ordered_pb_averages
+            events_kinch[event] = event_kinch
+
+            # Record which users we've seen
+            all_user_ids.update(pb_record.user_id for pb_record in ordered_pb_singles)
+            all_user_ids.update(pb_record.user_id for pb_record in ordered_pb_averages)
+
+    if incremental:
+        # Figure out everything that changed before saving anything, since saving commits the session and would expire
+        # the existing UserSiteRankings being compared against
+        with profiler.phase(_PHASE_USER_RANKINGS) as phase:
+            site_rankings_to_save = list(_recalculate_site_rankings_for_dirty_events(
+                all_user_ids, events_to_rank, events_pb_singles, events_pb_averages, events_kinch, wca_event_ids,
+                all_events))
+            phase.rows = len(site_rankings_to_save)
+    else:
+        with profiler.phase(_PHASE_RANKING):
+            ranked_events = [event for event in all_events if event in events_pb_singles]
+            site_rankings_matrix = calculate_site_rankings_matrix(list(all_user_ids), ranked_events, events_pb_singles,
+                                                                  events_pb_averages, events_kinch, wca_event_ids)
+
+            # The matrix is built, so the PBs aren't needed anymore. Let them go before everybody's site rankings are
+            # generated and saved.
+            events_pb_singles.clear()
+            events_pb_averages.clear()
+            events_kinch.clear()
+
+        # Each user's site rankings are generated from the matrix as they're being saved
+        site_rankings_to_save = profiler.iterate(site_rankings_matrix, _PHASE_USER_RANKINGS)
+
+    # Save/update the users' site rankings in bulk. If there's a memory ceiling, do it in streaming mode.
+    with profiler.phase(_PHASE_BULK_WRITE) as phase:
+        memory_ceiling_mb = app.config['RANKINGS_MEMORY_CEILING_MB']
+        if memory_ceiling_mb:
+            phase.rows = _save_site_rankings_in_chunks(site_rankings_to_save, memory_ceiling_mb)
+        else:
+            phase.rows = bulk_update_site_rankings(site_rankings_to_save)
 
-        # Retrieve the the ordered list of PersonalBestRecords for singles for this event
-        ordered_pb_singles = get_ordered_pb_singles_for_event(event.id)
+    return len(all_user_ids), phase.rows
 
-        # If nobody at all has competed in this event, just move on to the next
-        if not ordered_pb_singles:
+
+def _profile_ranked_events(profiler: JobProfiler,
+                           ranked_events: Iterator[Tuple[Event, List[RankedPersonalBest], List[RankedPersonalBest],
+                                                         Dict[int, float]]]):
+    """ Yields the ranked events, recording the time spent retrieving each one as a separate PB fetching phase. """
+
+    while True:
+        with profiler.phase(_PHASE_FETCH_PBS) as phase:
+            ranked_event = next(ranked_events, None)
+            if ranked_event is None:
+                return
+
+            event, ordered_pb_singles, ordered_pb_averages, _ = ranked_event
+            phase.name = f"{_PHASE_FETCH_PBS}:{event.name}"
+            phase.rows = len(ordered_pb_singles) + len(ordered_pb_averages)
+
+        yield ranked_event
+
+
+def _save_site_rankings_in_chunks(site_rankings: Iterable[UserSiteRankings], memory_ceiling_mb: int) -> int:
+    """ Saves the site rankings as they're generated, a chunk of users at a time, clearing out the database session
+    after each chunk so nothing from it piles up over the run. If this process is using more memory than the ceiling
+    after a chunk, the chunks get smaller from then on. Returns the number of UserSiteRankings saved. """
+
+    site_rankings = iter(site_rankings)
+    chunk_size = _STREAMING_CHUNK_SIZE
+    saved_count = 0
+
+    while True:
+        chunk = list(islice(site_rankings, chunk_size))
+        if not chunk:
+            return saved_count
+
+        saved_count += bulk_update_site_rankings(chunk)
+        del chunk
+        DB.session.expunge_all()
+
+        # Once the chunks are as small as they'll get, there's nothing more to do about it
+        if chunk_size == _STREAMING_MIN_CHUNK_SIZE:
             continue
 
-        events_pb_singles[event] = ordered_pb_singles
-        events_singles_len[event] = len(ordered_pb_singles)
-
-        # Iterate the ordered PB singles, recording which users we've seen, and also building a map of the user ID to
-        # their index in the ordered PB singles list, so we can retrieve the specific PersonalBestRecord for a user
-        # directly by their index in this list rather than having to iterate it again.
-        user_single_ix_map = dict()
-        for i, pb_record in enumerate(ordered_pb_singles):
-            user_single_ix_map[pb_record.user_id] = i
-            all_user_ids.add(pb_record.user_id)
-
-        events_pb_singles_ix[event] = user_single_ix_map
-
-        # Retrieve the the ordered list of PersonalBestRecords for averages for this event
-        ordered_pb_averages = get_ordered_pb_averages_for_event(event.id)
-        events_pb_averages[event] = ordered_pb_averages
-        events_averages_len[event] = len(ordered_pb_averages)
-
-        # Iterate the ordered PB averages, recording which users we've seen, and also building a map of the user ID to
-        # their index in the ordered PB averages list, so we can retrieve the specific PersonalBestRecord for a user
-        # directly by their index in this list rather than having to iterate it again.
-        user_average_ix_map = dict()
-        for i, pb_record in enumerate(ordered_pb_averages):
-            user_average_ix_map[pb_record.user_id] = i
-            all_user_ids.add(pb_record.user_id)
-
-        events_pb_averages_ix[event] = user_average_ix_map
-
-    # We'll update the users' site rankings in bulk.
-    site_rankings = list()
-    bulk_update_count = 0
-    bulk_update_limit = 250
-
-    # Iterate through all users to determine their site rankings and PBs
-    for user_id in all_user_ids:
-        rankings = _calculate_site_rankings_for_user(user_id, events_pb_singles, events_pb_singles_ix,
-                                                     events_singles_len, events_pb_averages, events_pb_averages_ix,
-                                                     events_averages_len, wca_event_ids, all_events)
-
-        site_rankings.append(rankings)
-        bulk_update_count += 1
-
-        # Save/update site rankings in bulk
-        if bulk_update_count == bulk_update_limit:
-            bulk_update_site_rankings(site_rankings)
-            site_rankings = list()
-            bulk_update_count = 0
-
-    # If there's any left that didn't get updated in bulk, do that now.
-    if site_rankings:
-        bulk_update_site_rankings(site_rankings)
+        rss_mb = _current_rss_mb()
+        if rss_mb is not None and rss_mb > memory_ceiling_mb:
+            gc.collect()
+            chunk_size = max(chunk_size // 2, _STREAMING_MIN_CHUNK_SIZE)
+            print(f"[RANKINGS] Using {rss_mb:.0f}MB, over the {memory_ceiling_mb}MB ceiling. Saving site rankings " +
+                  f"{chunk_size} users at a time.")
 
-    t1 = default_timer()
-    print(f"[RANKINGS] {t1 - t0}s elapsed to calculate site rankings for {len(all_user_ids)} users.")
 
+def _current_rss_mb() -> Optional[float]:
+    """ Returns how much memory this process is currently using, in MB, or None if that can't be determined because
+    this isn't running on Linux. """
 
-def _calculate_site_rankings_for_user(user_id: int,
-                                      event_singles_map: Dict[Event, List[PersonalBestRecord]],
-                                      event_singles_ix_map: Dict[Event, Dict[int, int]],
-                                      events_singles_len: Dict[Event, int],
-                                      event_averages_map: Dict[Event, List[PersonalBestRecord]],
-                                      event_averages_ix_map: Dict[Event, Dict[int, int]],
-                                      events_averages_len: Dict[Event, int],
-                                      wca_event_ids: Set[int],
-                                      all_events: List[Event]) -> UserSiteRankings:
-    """ Calculates the user's site rankings for all events, and returns a UserSiteRankings object which contains the raw
-    data (for each event, PB single and average, the site rank for those results, and Kinchranks), and also wraps up
-    the user's combined sum of ranks, separate sum of ranks for WCA and non-WCA events, and overall Kinchrank.
-
-    :param user_id: user ID of the user whose site rankings are being calculated
-    :param event_singles_map: map from Event to ordered list of single PBs
-    :param event_singles_ix_map: map from Event to map of user ID to index of that user's single PB record
-    :param events_singles_len: map from Event to the number of people with single records
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _rank_events(events: List[Event],
+                 workers: int) -> Iterator[Tuple[Event, List[RankedPersonalBest], List[RankedPersonalBest],
+                                                 Dict[int, float]]]:
+    """ Yields a tuple of (Event, ordered single PBs, ordered average PBs, map of user ID to Kinch score) for each of
+    the specified events which anybody has competed in.
+
+    If `workers` is more than 1, the events are fanned out across a pool of that many processes, each of which
+    retrieves and ranks the PBs for one event at a time. Otherwise all events are retrieved in one query in this process.
+    Either way the results are the same. """
+
+    if workers > 1:
+        # Spawn the worker processes rather than forking them, since this runs inside a threaded Huey worker and forking
+        # a process with other threads running can leave the child holding locks nobody will ever release
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=_init_rankings_worker) as executor:
+            ranked_events = executor.map(_rank_event_in_worker, [event.id for event in events],
+                                         [event.name for event in events], [event.eventFormat for event in events])
+            for event, (ordered_pb_singles, ordered_pb_averages, event_kinch) in zip(events, ranked_events):
+                if ordered_pb_singles:
+                    yield event, ordered_pb_singles, ordered_pb_averages, event_kinch
+
+    else:
+        events_by_id = {event.id: event for event in events}
+        for event_id, ordered_pb_singles, ordered_pb_averages in get_all_ordered_pbs(events_by_id.keys(),
+                                                                                     compact=True):
+            event = events_by_id[event_id]
+            event_kinch = _calculate_kinch_if_ranked(event.name, event.eventFormat, ordered_pb_singles,
+                                                     ordered_pb_averages)
+            yield event, ordered_pb_singles, ordered_pb_averages, event_kinch
+
+
+def _init_rankings_worker():
+    """ Sets up a rankings worker process with an app context, so it can talk to the database. """
+
+    app.app_context().push()
+
+
+def _rank_event_in_worker(event_id: int, event_name: str, event_format: str):
+    """ Retrieves the ordered PBs and calculates the Kinch scores for one event, in a rankings worker process. """
+
+    try:
+        ordered_pb_singles, ordered_pb_averages = get_ordered_pbs_for_event(event_id, compact=True)
+        event_kinch = _calculate_kinch_if_ranked(event_name, event_format, ordered_pb_singles, ordered_pb_averages)
+        return ordered_pb_singles, ordered_pb_averages, event_kinch
+    finally:
+        DB.session.remove()
+
+
+def _calculate_kinch_if_ranked(event_name: str,
+                               event_format: str,
+                               ordered_pb_singles: List[RankedPersonalBest],
+                               ordered_pb_averages: List[RankedPersonalBest]) -> Dict[int, float]:
+    """ Calculates Kinch scores for an event, unless nobody has a single for it, in which case it isn't ranked. """
+
+    if not ordered_pb_singles:
+        return dict()
+
+    return calculate_event_kinch(event_name, event_format, ordered_pb_singles, ordered_pb_averages)
+
+
+def _recalculate_site_rankings_for_dirty_events(ranked_user_ids: Set[int],
+                                                dirty_events: List[Event],
+                                                event_singles_map: Dict[Event, List[RankedPersonalBest]],
+                                                event_averages_map: Dict[Event, List[RankedPersonalBest]],
+                                                event_kinch_map: Dict[Event, Dict[int, float]],
+                                                wca_event_ids: Set[int],
+                                                all_events: List[Event]) -> Iterator[UserSiteRankings]:
+    """ Re-ranks just the dirty events for every user, reusing each user's existing rankings data for the rest of the
+    events, and yields a UserSiteRankings for each user whose site rankings actually changed. They're calculated by the
+    same matrix engine as a full run, so the two can't come out any different.
+
+    Every existing UserSiteRankings has to be considered, not just those for the users whose results changed, since a
+    change to one person's PB can shift the rank of everybody behind them in that event.
+
+    :param ranked_user_ids: IDs of the users with PBs in any of the dirty events
+    :param dirty_events: list of the Events which are being re-ranked
+    :param event_singles_map: map from Event to ordered list of single PBs, for the dirty events anybody competed in
     :param event_averages_map: map from Event to ordered list of average PBs
-    :param event_averages_ix_map: map from Event to map of user ID to index of that user's average PB record
-    :param events_averages_len: map from Event to the number of people with average records
+    :param event_kinch_map: map from Event to map of user ID to Kinch score
     :param wca_event_ids: set of WCA event IDs
     :param all_events: list of Events
-    :return: UserSiteRankings record for the specified user"""
-
-    # Holds the user's various types of rankings for each event
-    user_rankings_data = OrderedDict()
-
-    # Create the actual UserSiteRankings object to stick the data in when we're done, which will hold both the raw
-    # ranking data as well as sum of ranks, total Kinchranks, etc
-    user_site_rankings = UserSiteRankings()
-    user_site_rankings.user_id = user_id
-
-    # Start off all sum of ranks stats at 0
-    # [single, average]
-    sor_all     = [0, 0]
-    sor_wca     = [0, 0]
-    sor_non_wca = [0, 0]
-
-    # Hold site-wide Kinchrank (for WCA-only, non-WCA-only, and all events) for this user
-    overall_kinchranks = list()
-    wca_kinchranks     = list()
-    non_wca_kinchranks = list()
-
-    for event in all_events:
-        pb_single    = ''
-        single_rank  = ''
-        pb_average   = ''
-        average_rank = ''
-        event_kinch  = 0
-
-        event_is_wca = event.id in wca_event_ids
-
-        # Get the lists ranked singles and averages for the current event. If there's nothing in the map for that event,
-        # nobody has competed in it yet, so we can skip to the next.
-        ranked_singles = event_singles_map.get(event, None)
-        if not ranked_singles:
-            continue
-        ranked_averages = event_averages_map[event]
-        singles_ix_map = event_singles_ix_map[event]
-        averages_ix_map = event_averages_ix_map[event]
-
-        # See if there's a result for our user in the singles
-        single_ix = singles_ix_map.get(user_id, None)
-        if single_ix:
-            pb_single   = ranked_singles[single_ix].personal_best
-            single_rank = ranked_singles[single_ix].numerical_rank
-
-        # If our user has no single for this event, their site ranking is (1 + number of people in this event)
-        if not pb_single:
-            single_rank = events_singles_len[event] + 1
-
-        # See if there's a result for our user in the averages. It's ok if there isn't, either because the user doesn't
-        # have an average or this event doesn't have averages. We'll just record blank values.
-        average_ix = averages_ix_map.get(user_id, None)
-        if average_ix:
-            pb_average   = ranked_averages[average_ix].personal_best
-            average_rank = ranked_averages[average_ix].numerical_rank
-
-        # If our user has no average for this event, their site ranking is (1 + number of people in this event)
-        if not pb_average:
-            average_rank = events_averages_len[event] + 1
-
-        # Determine Kinchrank component for this event
-        # TODO: add explanations below
-        if event.name == 'MBLD':
-            best_mbld = int(ranked_singles[0].personal_best)
-            baseline_mbld = MbldSolve(best_mbld).sort_value
-            if pb_single and pb_single != 'DNF':
-                coded_mbld = int(pb_single)
-                this_mbld  = MbldSolve(coded_mbld).sort_value
-                event_kinch = round((this_mbld / baseline_mbld) * 100, 3)
-        elif event.name in ('FMC', '3BLD'):
-            single_kinch = 0
-            average_kinch = 0
-            if pb_single and pb_single != 'DNF':
-                single_kinch = round(int(ranked_singles[0].personal_best) / int(pb_single) * 100, 3)
-            if pb_average and pb_average != 'DNF':
-                average_kinch = round(int(ranked_averages[0].personal_best) / int(pb_average) * 100, 3)
-            event_kinch = max([single_kinch, average_kinch])
-        elif event.eventFormat in (EventFormat.Bo1, EventFormat.Bo3):
-            if pb_single and pb_single != 'DNF':
-                event_kinch = round(int(ranked_singles[0].personal_best) / int(pb_single) * 100, 3)
-        else:
-            if pb_average and pb_average != 'DNF':
-                event_kinch = round(int(ranked_averages[0].personal_best) / int(pb_average) * 100, 3)
+    :return: UserSiteRankings records for the users whose site rankings changed """
 
-        # Accumulate Kinchranks
-        overall_kinchranks.append(event_kinch)
-        if event_is_wca:
-            wca_kinchranks.append(event_kinch)
-        else:
-            non_wca_kinchranks.append(event_kinch)
+    dirty_event_ids = set(event.id for event in dirty_events)
 
-        # Records the user's rankings, PBs, and Kinchrank component for this event
-        user_rankings_data[event.id] = (pb_single, single_rank, pb_average, average_rank, format(event_kinch, '.3f'))
+    # The number of people with single and average PBs in the events which aren't being re-ranked. These haven't changed
+    # since the last run, and are needed to build the rankings for users who don't yet have rankings for them.
+    clean_event_pb_counts = get_pb_counts_by_event()
 
-        # Accumulate sum of ranks
-        sor_all[0] += single_rank
-        sor_all[1] += average_rank if average_rank else 0
-        if event_is_wca:
-            sor_wca[0] += single_rank
-            sor_wca[1] += average_rank if average_rank else 0
-        else:
-            sor_non_wca[0] += single_rank
-            sor_non_wca[1] += average_rank if average_rank else 0
-
-    # Save the event site rankings data as serialized json into the UserSiteRankings
-    # Set values for Sum Of Ranks, single and average, for combined, WCA, and non-WCA
-    # Set values for Kinchranks, for combined, WCA, and non-WCA
-    user_site_rankings.data                = json.dumps(user_rankings_data)
-    user_site_rankings.timestamp           = datetime.now()
-    user_site_rankings.sum_all_single      = sor_all[0]
-    user_site_rankings.sum_all_average     = sor_all[1]
-    user_site_rankings.sum_wca_single      = sor_wca[0]
-    user_site_rankings.sum_wca_average     = sor_wca[1]
-    user_site_rankings.sum_non_wca_single  = sor_non_wca[0]
-    user_site_rankings.sum_non_wca_average = sor_non_wca[1]
-
-    if overall_kinchranks:
-        user_site_rankings.all_kinchrank = round(sum(overall_kinchranks) / (len(overall_kinchranks) + 0.0), 3)
-    else:
-        user_site_rankings.all_kinchrank = 0
+    existing_site_rankings = {rankings.user_id: rankings for rankings in get_all_site_rankings()}
+    existing_data = {user_id: json.loads(rankings.data) for user_id, rankings in existing_site_rankings.items()}
 
-    if wca_kinchranks:
-        user_site_rankings.wca_kinchrank = round(sum(wca_kinchranks) / (len(wca_kinchranks) + 0.0), 3)
-    else:
-        user_site_rankings.wca_kinchrank = 0
+    # If nobody has competed in an event anymore, there's nothing to rank
+    ranked_events = [event for event in all_events if event in event_singles_map or
+                     (event.id not in dirty_event_ids and event.id in clean_event_pb_counts)]
 
-    if non_wca_kinchranks:
-        user_site_rankings.non_wca_kinchrank = round(sum(non_wca_kinchranks) / (len(non_wca_kinchranks) + 0.0), 3)
-    else:
-        user_site_rankings.non_wca_kinchrank = 0
-
-    return user_site_rankings
-
-
-def _build_personal_best_record(query_tuple):
-    """ Builds a PersonalBestRecord from the 5-tuple returned from the ordered PB queries below.
-    The tuple looks like (user_id, single/average, comp_id, comp_title, username). """
-
-    user_id, result, comp_id, comp_title, username, comment, user_is_verified = query_tuple
-    return PersonalBestRecord(personal_best=result, user_id=user_id, username=username, comp_id=comp_id,
-                              comp_title=comp_title, comment=comment, user_is_verified=user_is_verified)
-
-
-def _determine_ranks(personal_bests):
-    """ Takes an ordered list of PersonalBestRecords and assigns each PersonalBestRecord a rank.
-    Ranks are the same for PersonalBestRecords with identical times.
-    Ex: [12, 13, 14, 14, 15] would have ranks [1, 2, 3, 3, 5] """
-
-    # If `personal_bests` is empty, we can't use the ranking mechanism below, so just return
-    # the empty list
-    if not personal_bests:
-        return personal_bests
-
-    # Build a list of just the time values of the personal bests, to be fed into the ranking
-    # mechanism. If the PB time value cannot be interpreted as an int, it's probably a DNF so
-    # just pretend it's some humongous value which would sorted to the end
-    times_values = list()
-    for personal_best in personal_bests:
-        try:
-            times_values.append(int(personal_best.personal_best))
-        except ValueError:
-            times_values.append(9999999999999)
-
-    # Some clowns are entering really enormous numbers, larger than 9999999999999 above,
-    # and so we need to sort `times_values` so the Ranking mech doesn't choke.
-    times_values.sort()
-
-    # Rank the list of times. The result from this is (rank, time value) where the index
-    # of the element for each time value doesn't change from the input to the output
-    ranked_times = list(Ranking(times_values, start=1, reverse=True))
-
-    # Give each PersonalBestRecord its rank from the corresponding element in ranked_times
-    ranks_seen = set()
-    for i, personal_best in enumerate(personal_bests):
-        rank = ranked_times[i][0]
-        if rank not in ranks_seen:
-            ranks_seen.add(rank)
-            personal_best.rank = rank
-            personal_best.numerical_rank = rank
-        else:
-            personal_best.rank = ''
-            personal_best.numerical_rank = rank
+    user_ids = list(ranked_user_ids.union(existing_site_rankings.keys()))
+    for new_rankings in calculate_site_rankings_matrix(user_ids, ranked_events, event_singles_map, event_averages_map,
+                                                       event_kinch_map, wca_event_ids, existing_data,
+                                                       clean_event_pb_counts):
+        existing_rankings = existing_site_rankings.get(new_rankings.user_id, None)
+        if not existing_rankings or _site_rankings_differ(existing_rankings, new_rankings):
+            yield new_rankings
+
+
+def _site_rankings_differ(existing_rankings: UserSiteRankings, new_rankings: UserSiteRankings) -> bool:
+    """ Returns whether the two UserSiteRankings have any differences, other than their timestamp. """
+
+    return any(getattr(existing_rankings, attr) != getattr(new_rankings, attr) for attr in (
+        'data', 'sum_all_single', 'sum_all_average', 'sum_wca_single', 'sum_wca_average', 'sum_non_wca_single',
+        'sum_non_wca_average', 'all_kinchrank', 'wca_kinchrank', 'non_wca_kinchrank'))
+
+
+def _build_personal_best_record(row, rank, visible_rank) -> PersonalBestRecord:
+    """ Builds a PersonalBestRecord from a row returned by the ordered PB query below. Its sort key is what the PBs are
+    ordered by, which is unique to each PB. """
+
+    personal_best = PersonalBestRecord(personal_best=row.personal_best, user_id=row.user_id, username=row.username,
+                                       comp_id=row.comp_id, comp_title=row.comp_title, comment=row.comment,
+                                       user_is_verified=row.user_is_verified,
+                                       sort_key=(row.rank_key, row.is_missing, row.results_id))
+    personal_best.rank = visible_rank
+    personal_best.numerical_rank = rank
+
+    return personal_best
+
+
+def get_all_ordered_pbs(event_ids: Optional[Iterable[int]] = None,
+                        include_averages: bool = True,
+                        compact: bool = False) -> Iterator[Tuple[int, List[PersonalBestRecord],
+                                                                  List[PersonalBestRecord]]]:
+    """ Yields a tuple of (event ID, ordered single PBs, ordered average PBs) for each event anybody has PBs for, where
+    the PBs are lists of PersonalBestRecords built from the fastest single or average which doesn't belong to a
+    blacklisted result, one per user, sorted by time with DNFs at the end, and ranked.
 
-    return personal_bests
+    All events (or just those specified by `event_ids`) come back in a single streamed query, ordered and ranked by the
+    database. Ranks are the same for PersonalBestRecords with identical times. Ex: [12, 13, 14, 14, 15] would have
+    ranks [1, 2, 3, 3, 5]. The visible rank is blank for all but the first of those with the same rank.
 
+    If `compact` is True, the PBs are RankedPersonalBests instead, with none of the display fields, for calculating
+    site rankings. """
 
-def get_ordered_pb_singles_for_event(event_id):
+    query = _build_ordered_pbs_query(event_ids, include_averages, compact)
+    rows = DB.session.execute(query.execution_options(yield_per=_ORDERED_PBS_YIELD_PER))
+
+    for event_id, event_rows in groupby(rows, key=attrgetter('event_id')):
+        personal_bests = {_PB_TYPE_SINGLE: list(), _PB_TYPE_AVERAGE: list()}
+
+        for pb_type, pb_type_rows in groupby(event_rows, key=attrgetter('pb_type')):
+            previous_rank     = None
+            previous_rank_key = None
+
+            for i, row in enumerate(pb_type_rows):
+                # The database doesn't do the ranking for us if it doesn't support window functions, so do it here. The
+                # rows are ordered by rank key, so a row shares the previous row's rank if the keys match, or else its
+                # rank is its position in the list.
+                if row.rank is not None:
+                    rank = row.rank
+                elif row.rank_key == previous_rank_key:
+                    rank = previous_rank
+                else:
+                    rank = i + 1
+
+                if compact:
+                    personal_bests[pb_type].append(RankedPersonalBest(row.user_id, row.personal_best, rank))
+                else:
+                    visible_rank = rank if rank != previous_rank else ''
+                    personal_bests[pb_type].append(_build_personal_best_record(row, rank, visible_rank))
+
+                previous_rank     = rank
+                previous_rank_key = row.rank_key
+
+        yield event_id, personal_bests[_PB_TYPE_SINGLE], personal_bests[_PB_TYPE_AVERAGE]
+
+
+def get_ordered_pbs_for_event(event_id: int,
+                              include_averages: bool = True,
+                              compact: bool = False) -> Tuple[List[PersonalBestRecord],
+                                                              List[PersonalBestRecord]]:
+    """ Returns a tuple of the ordered single PBs and average PBs for the specified event. See `get_all_ordered_pbs`.
+    """
+
+    for _, singles, averages in get_all_ordered_pbs([event_id], include_averages=include_averages, compact=compact):
+        return singles, averages
+
+    return list(), list()
+
+
+def get_ordered_pb_singles_for_event(event_id: int) -> List[PersonalBestRecord]:
     """ Gets a list of PersonalBestRecords, comprised of the fastest single which doesn't belong to
     a blacklisted result, one per user, for the specified event, sorted by single value. """
 
-    results = DB.session.\
-        query(UserEventResults).\
+    singles, _ = get_ordered_pbs_for_event(event_id, include_averages=False)
+    return singles
+
+
+def get_ordered_pb_averages_for_event(event_id: int) -> List[PersonalBestRecord]:
+    """ Gets a list of PersonalBestRecords, comprised of the fastest average which doesn't belong to
+    a blacklisted result, one per user, for the specified event, sorted by average value.  """
+
+    _, averages = get_ordered_pbs_for_event(event_id)
+    return averages
+
+
+def get_pb_pairs_for_event(event_id: int) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """ Yields a tuple of (username, single PB, average PB) for each user with a single PB in the specified event, in the
+    same order as the ordered single PBs. The average PB is None if the user doesn't have one. The rows are streamed from
+    the database as they're iterated over, rather than loaded all at once. """
+
+    singles = _build_ordered_pbs_select(UserEventResults.single, UserEventResults.is_latest_pb_single,
+                                        _PB_TYPE_SINGLE, [event_id], compact=False).subquery()
+    averages = _build_ordered_pbs_select(UserEventResults.average, UserEventResults.is_latest_pb_average,
+                                         _PB_TYPE_AVERAGE, [event_id], compact=True).subquery()
+
+    query = select(singles.c.username, singles.c.personal_best, averages.c.personal_best).\
+        outerjoin(averages, averages.c.user_id == singles.c.user_id).\
+        order_by(singles.c.rank_key, singles.c.is_missing, singles.c.results_id)
+
+    for username, single, average in DB.session.execute(query.execution_options(yield_per=_ORDERED_PBS_YIELD_PER)):
+        yield username, single, average
+
+
+def _build_ordered_pbs_query(event_ids: Optional[Iterable[int]], include_averages: bool, compact: bool):
+    """ Builds the query behind `get_all_ordered_pbs`, which unions the single and average PBs for the events and
+    orders them by event, then PB type, then rank. """
+
+    selects = [_build_ordered_pbs_select(UserEventResults.single, UserEventResults.is_latest_pb_single,
+                                         _PB_TYPE_SINGLE, event_ids, compact)]
+    if include_averages:
+        selects.append(_build_ordered_pbs_select(UserEventResults.average, UserEventResults.is_latest_pb_average,
+                                                 _PB_TYPE_AVERAGE, event_ids, compact))
+
+    ordered_pbs = union_all(*selects).subquery()
+
+    # DNFs and missing results share the same rank key so they're ranked as tied, but DNFs are listed before
+    # missing results. The results ID is just there so that ties are always listed in the same order.
+    return select(ordered_pbs).\
+        order_by(ordered_pbs.c.event_id, ordered_pbs.c.pb_type, ordered_pbs.c.rank_key, ordered_pbs.c.is_missing,
+                 ordered_pbs.c.results_id)
+
+
+def _build_ordered_pbs_select(pb_column, is_latest_pb_column, pb_type: int, event_ids: Optional[Iterable[int]],
+                              compact: bool):
+    """ Builds a select for the latest PBs of one type (single or average) for the specified events, or all events.
+    If `compact` is True, the display fields are left out. """
+
+    is_missing = or_(pb_column.is_(None), pb_column == '')
+
+    # The times are stored as strings, so cast them to integers to get them to sort properly. If it's not a time, it's
+    # probably a DNF, so just pretend it's some humongous value which would be sorted to the end
+    rank_key = case((or_(is_missing, pb_column == 'DNF'), NO_TIME_SORT_KEY), else_=cast(pb_column, BigInteger))
+
+    if database_supports_window_functions():
+        rank = func.rank().over(partition_by=CompetitionEvent.event_id, order_by=rank_key)
+    else:
+        rank = null()
+
+    columns = [CompetitionEvent.event_id.label('event_id'),
+               literal(pb_type).label('pb_type'),
+               UserEventResults.id.label('results_id'),
+               UserEventResults.user_id.label('user_id'),
+               pb_column.label('personal_best'),
+               rank_key.label('rank_key'),
+               case((is_missing, 1), else_=0).label('is_missing'),
+               rank.label('rank')]
+
+    if not compact:
+        columns += [Competition.id.label('comp_id'),
+                    Competition.title.label('comp_title'),
+                    User.username.label('username'),
+                    UserEventResults.comment.label('comment'),
+                    User.is_verified.label('user_is_verified')]
+
+    query = select(*columns).\
+        select_from(UserEventResults).\
         join(User).\
         join(CompetitionEvent).\
-        join(Event).\
         join(Competition).\
-        filter(Event.id == event_id).\
-        filter(UserEventResults.is_complete).\
-        filter(UserEventResults.is_latest_pb_single).\
-        filter(UserEventResults.is_blacklisted.isnot(True)).\
-        group_by(UserEventResults.id, UserEventResults.user_id, UserEventResults.single, Competition.id,
-                 Competition.title, User.username, User.is_verified).\
-        values(UserEventResults.user_id, UserEventResults.single, Competition.id, Competition.title, User.username,
-               UserEventResults.comment, User.is_verified)
+        where(UserEventResults.is_complete).\
+        where(is_latest_pb_column).\
+        where(UserEventResults.is_blacklisted.isnot(True))
 
-    # NOTE: if adding anything to this tuple being selected in values(...) above, add it to the
-    # end so that code indexing this tuple doesn't get all jacked. Make sure to make an identical
-    # addition to `get_ordered_pb_averages_for_event` and update `_build_PersonalBestRecord`
+    if event_ids is not None:
+        query = query.where(CompetitionEvent.event_id.in_(list(event_ids)))
 
-    personal_bests = [_build_personal_best_record(result) for result in results]
-    personal_bests.sort(key=sort_personal_best_records)
-    personal_bests = _determine_ranks(personal_bests)
+    return query
 
-    return personal_bests
 
+def get_pb_counts_by_event() -> Dict[int, Tuple[int, int]]:
+    """ Returns a map of event ID to a tuple of the number of people with single PBs and the number of people with
+    average PBs for that event, counting the same PB records as the ordered PB queries above. Events which nobody has
+    competed in are not present in the map. """
 
-def get_ordered_pb_averages_for_event(event_id):
-    """ Gets a list of PersonalBestRecords, comprised of the fastest average which doesn't belong to
-    a blacklisted result, one per user, for the specified event, sorted by average value.  """
+    singles_counts = DB.session.\
+        query(CompetitionEvent.event_id, func.count(UserEventResults.id)).\
+        join(UserEventResults).\
+        join(User).\
+        join(Competition).\
+        filter(UserEventResults.is_complete).\
+        filter(UserEventResults.is_latest_pb_single).\
+        filter(UserEventResults.is_blacklisted.isnot(True)).\
+        group_by(CompetitionEvent.event_id).\
+        all()
 
-    results = DB.session.\
-        query(UserEventResults).\
+    averages_counts = DB.session.\
+        query(CompetitionEvent.event_id, func.count(UserEventResults.id)).\
+        join(UserEventResults).\
         join(User).\
-        join(CompetitionEvent).\
-        join(Event).\
         join(Competition).\
-        filter(Event.id == event_id).\
         filter(UserEventResults.is_complete).\
         filter(UserEventResults.is_latest_pb_average).\
         filter(UserEventResults.is_blacklisted.isnot(True)).\
-        group_by(UserEventResults.id, UserEventResults.user_id, UserEventResults.average, Competition.id,
-                 Competition.title, User.username, User.is_verified).\
-        values(UserEventResults.user_id, UserEventResults.average, Competition.id, Competition.title, User.username,
-               UserEventResults.comment, User.is_verified)
-
-    # NOTE: if adding anything to this tuple being selected in values(...) above, add it to the
-    # end so that code indexing this tuple doesn't get all jacked. Make sure to make an identical
-    # addition to `get_ordered_pb_singles_for_event` and update `_build_PersonalBestRecord`
-
-    personal_bests = [_build_personal_best_record(result) for result in results]
-
-    # Some events don't have averages, so it's ok to just return an empty list. Checking here
-    # instead of checking `results` above, because `results` is a generator and the contents have't
-    # been iterated yet
-    if not personal_bests:
-        return list()
-
-    personal_bests.sort(key=sort_personal_best_records)
-    personal_bests = _determine_ranks(personal_bests)
+        group_by(CompetitionEvent.event_id).\
+        all()
 
-    return personal_bests
+    averages_counts = dict(averages_counts)
+    return {event_id: (count, averages_counts.get(event_id, 0)) for event_id, count in singles_counts}
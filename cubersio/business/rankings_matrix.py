@@ -0,0 +1,243 @@
+""" A vectorized engine for calculating every user's site rankings, sum of ranks, and Kinchranks at once.
+
+Rather than walking every event once per user, the per-event ranks, PBs, and Kinch scores are laid out in a
+users x events matrix, one event column at a time, and the sums of ranks and Kinchranks are then calculated for
+all users at once from that matrix. The results are identical to calculating them user by user.
+
+This is used for both full and incremental site rankings runs. An incremental run only fills in the columns for the
+events it re-ranks from their PBs, and fills in the rest from everybody's existing rankings. """
+
+from datetime import datetime
+import json
+from typing import Dict, Iterator, List, Set, Tuple
+
+import numpy as np
+
+from cubersio.util.events.mbld import MbldSolve
+from cubersio.persistence.models import Event, EventFormat, RankedPersonalBest, UserSiteRankings
+
+# -------------------------------------------------------------------------------------------------
+
+def calculate_site_rankings_matrix(user_ids: List[int],
+                                   ranked_events: List[Event],
+                                   event_singles_map: Dict[Event, List[RankedPersonalBest]],
+                                   event_averages_map: Dict[Event, List[RankedPersonalBest]],
+                                   event_kinch_map: Dict[Event, Dict[int, float]],
+                                   wca_event_ids: Set[int],
+                                   kept_rankings_data: Dict[int, Dict[str, list]] = None,
+                                   kept_pb_counts: Dict[int, Tuple[int, int]] = None) -> Iterator[UserSiteRankings]:
+    """ Calculates site rankings for all of the specified users, and returns a generator yielding a UserSiteRankings
+    for each of them. The matrix is built before this returns, so the PBs passed in aren't needed by the time the
+    UserSiteRankings are being generated.
+
+    :param user_ids: IDs of the users whose site rankings are being calculated
+    :param ranked_events: list of the Events which anybody has competed in, in the order they should be displayed
+    :param event_singles_map: map from Event to ordered list of single PBs, for the events being ranked from their PBs
+    :param event_averages_map: map from Event to ordered list of average PBs
+    :param event_kinch_map: map from Event to map of user ID to Kinch score, see `calculate_event_kinch`
+    :param wca_event_ids: set of WCA event IDs
+    :param kept_rankings_data: for the ranked events which aren't in `event_singles_map`, whose rankings are kept as
+        they are, map from user ID to that user's existing rankings data, as stored in UserSiteRankings
+    :param kept_pb_counts: map from event ID to the number of people with single and average PBs, for the events whose
+        rankings are kept as they are, for ranking the users who don't have rankings data for them yet
+    :return: UserSiteRankings records for each user """
+
+    user_ix_map = {user_id: i for i, user_id in enumerate(user_ids)}
+    matrix_shape = (len(user_ids), len(ranked_events))
+
+    # Every user gets a cell for every event. If a user doesn't have a PB for an event, the cell's PB is blank, their
+    # rank is (1 + number of people in that event), and their Kinch score is 0.
+    single_ranks  = np.zeros(matrix_shape, dtype=np.int64)
+    average_ranks = np.zeros(matrix_shape, dtype=np.int64)
+    pb_singles    = np.full(matrix_shape, '', dtype=object)
+    pb_averages   = np.full(matrix_shape, '', dtype=object)
+    kinch         = np.zeros(matrix_shape, dtype=np.float64)
+
+    for j, event in enumerate(ranked_events):
+        if event not in event_singles_map:
+            __fill_kept_column(j, event.id, user_ids, kept_rankings_data, kept_pb_counts[event.id], pb_singles,
+                               single_ranks, pb_averages, average_ranks, kinch)
+            continue
+
+        singles  = event_singles_map[event]
+        averages = event_averages_map[event]
+
+        __fill_pb_column(j, singles, user_ix_map, pb_singles, single_ranks)
+        __fill_pb_column(j, averages, user_ix_map, pb_averages, average_ranks)
+
+        event_kinch = event_kinch_map[event]
+        if event_kinch:
+            kinch_rows = np.fromiter((user_ix_map[user_id] for user_id in event_kinch.keys()), dtype=np.int64,
+                                     count=len(event_kinch))
+            kinch[kinch_rows, j] = list(event_kinch.values())
+
+    is_wca_column = np.array([event.id in wca_event_ids for event in ranked_events], dtype=bool)
+
+    # Sum of ranks, single and average, for combined, WCA, and non-WCA
+    sum_all_single      = single_ranks.sum(axis=1).tolist()
+    sum_all_average     = average_ranks.sum(axis=1).tolist()
+    sum_wca_single      = single_ranks[:, is_wca_column].sum(axis=1).tolist()
+    sum_wca_average     = average_ranks[:, is_wca_column].sum(axis=1).tolist()
+    sum_non_wca_single  = single_ranks[:, ~is_wca_column].sum(axis=1).tolist()
+    sum_non_wca_average = average_ranks[:, ~is_wca_column].sum(axis=1).tolist()
+
+    # Kinchranks for combined, WCA, and non-WCA
+    all_kinchrank     = __calculate_kinchranks(kinch)
+    wca_kinchrank     = __calculate_kinchranks(kinch[:, is_wca_column])
+    non_wca_kinchrank = __calculate_kinchranks(kinch[:, ~is_wca_column])
+
+    sums_and_kinchranks = (sum_all_single, sum_all_average, sum_wca_single, sum_wca_average, sum_non_wca_single,
+                           sum_non_wca_average, all_kinchrank, wca_kinchrank, non_wca_kinchrank)
+
+    return __generate_site_rankings(user_ids, [event.id for event in ranked_events], pb_singles, single_ranks,
+                                    pb_averages, average_ranks, kinch, sums_and_kinchranks)
+
+
+def calculate_event_kinch(event_name: str,
+                          event_format: str,
+                          singles: List[RankedPersonalBest],
+                          averages: List[RankedPersonalBest]) -> Dict[int, float]:
+    """ Calculates the Kinch scores for one event, and returns a map of user ID to Kinch score for the users who have a
+    qualifying result. Kinch scores are rounded with Python's `round` one result at a time, the same as they've always
+    been, since numpy rounds slightly differently and the stored values need to stay identical. """
+
+    event_kinch = dict()
+
+    if event_name == 'MBLD':
+        baseline_mbld = MbldSolve(int(singles[0].personal_best)).sort_value
+        for pb in singles:
+            if pb.personal_best and pb.personal_best != 'DNF':
+                this_mbld = MbldSolve(int(pb.personal_best)).sort_value
+                event_kinch[pb.user_id] = round((this_mbld / baseline_mbld) * 100, 3)
+
+    elif event_name in ('FMC', '3BLD'):
+        # Kinch score is the better of the single and average Kinch scores
+        single_kinch = __calculate_time_kinch(singles)
+        average_kinch = __calculate_time_kinch(averages)
+        for user_id in single_kinch.keys() | average_kinch.keys():
+            event_kinch[user_id] = max([single_kinch.get(user_id, 0), average_kinch.get(user_id, 0)])
+
+    elif event_format in (EventFormat.Bo1, EventFormat.Bo3):
+        event_kinch = __calculate_time_kinch(singles)
+
+    else:
+        event_kinch = __calculate_time_kinch(averages)
+
+    return event_kinch
+
+# -------------------------------------------------------------------------------------------------
+# Functions below are not meant to be used directly; instead these are just dependencies of the
+# functions above.
+# -------------------------------------------------------------------------------------------------
+
+def __generate_site_rankings(user_ids: List[int],
+                             event_ids: List[int],
+                             pb_singles: np.ndarray,
+                             single_ranks: np.ndarray,
+                             pb_averages: np.ndarray,
+                             average_ranks: np.ndarray,
+                             kinch: np.ndarray,
+                             sums_and_kinchranks: Tuple[List, ...]) -> Iterator[UserSiteRankings]:
+    """ Yields a UserSiteRankings for each user from the filled-in matrices. Each user's row is only converted from
+    numpy values when it's needed, rather than converting the whole matrix up front. """
+
+    sum_all_single, sum_all_average, sum_wca_single, sum_wca_average, sum_non_wca_single, sum_non_wca_average,\
+        all_kinchrank, wca_kinchrank, non_wca_kinchrank = sums_and_kinchranks
+
+    timestamp = datetime.now()
+
+    for i, user_id in enumerate(user_ids):
+        # The raw rankings data for each event is (PB single, single rank, PB average, average rank, Kinch score)
+        kinch_display = [format(value, '.3f') for value in kinch[i].tolist()]
+        user_rankings_data = dict(zip(event_ids, zip(pb_singles[i], single_ranks[i].tolist(), pb_averages[i],
+                                                     average_ranks[i].tolist(), kinch_display)))
+
+        user_site_rankings = UserSiteRankings()
+        user_site_rankings.user_id             = user_id
+        user_site_rankings.data                = json.dumps(user_rankings_data)
+        user_site_rankings.timestamp           = timestamp
+        user_site_rankings.sum_all_single      = sum_all_single[i]
+        user_site_rankings.sum_all_average     = sum_all_average[i]
+        user_site_rankings.sum_wca_single      = sum_wca_single[i]
+        user_site_rankings.sum_wca_average     = sum_wca_average[i]
+        user_site_rankings.sum_non_wca_single  = sum_non_wca_single[i]
+        user_site_rankings.sum_non_wca_average = sum_non_wca_average[i]
+        user_site_rankings.all_kinchrank       = all_kinchrank[i]
+        user_site_rankings.wca_kinchrank       = wca_kinchrank[i]
+        user_site_rankings.non_wca_kinchrank   = non_wca_kinchrank[i]
+
+        yield user_site_rankings
+
+
+def __fill_pb_column(column: int,
+                     personal_bests: List[RankedPersonalBest],
+                     user_ix_map: Dict[int, int],
+                     pb_matrix: np.ndarray,
+                     rank_matrix: np.ndarray) -> None:
+    """ Fills in one event's column of the PB and rank matrices from that event's ordered PBs. """
+
+    no_pb_rank = len(personal_bests) + 1
+    rank_matrix[:, column] = no_pb_rank
+
+    if not personal_bests:
+        return
+
+    rows = np.fromiter((user_ix_map[pb.user_id] for pb in personal_bests), dtype=np.int64, count=len(personal_bests))
+    pb_matrix[rows, column] = [pb.personal_best for pb in personal_bests]
+    rank_matrix[rows, column] = [pb.numerical_rank if pb.personal_best else no_pb_rank for pb in personal_bests]
+
+
+def __fill_kept_column(column: int,
+                       event_id: int,
+                       user_ids: List[int],
+                       kept_rankings_data: Dict[int, Dict[str, list]],
+                       pb_counts: Tuple[int, int],
+                       pb_singles: np.ndarray,
+                       single_ranks: np.ndarray,
+                       pb_averages: np.ndarray,
+                       average_ranks: np.ndarray,
+                       kinch: np.ndarray) -> None:
+    """ Fills in one event's column of every matrix from everybody's existing rankings for that event. Users who don't
+    have rankings for it haven't competed in it, so they're ranked after everybody who has. """
+
+    singles_count, averages_count = pb_counts
+    no_rankings = ('', singles_count + 1, '', averages_count + 1, 0)
+
+    for i, user_id in enumerate(user_ids):
+        pb_single, single_rank, pb_average, average_rank, event_kinch = \
+            kept_rankings_data.get(user_id, dict()).get(str(event_id), no_rankings)
+
+        pb_singles[i, column]    = pb_single
+        single_ranks[i, column]  = single_rank
+        pb_averages[i, column]   = pb_average
+        average_ranks[i, column] = average_rank
+        kinch[i, column]         = float(event_kinch)
+
+
+def __calculate_time_kinch(personal_bests: List[RankedPersonalBest]) -> Dict[int, float]:
+    """ Calculates Kinch scores for timed PBs, which are the percentage of the best time that each time represents. """
+
+    best = None
+    time_kinch = dict()
+    for pb in personal_bests:
+        if pb.personal_best and pb.personal_best != 'DNF':
+            if best is None:
+                best = int(personal_bests[0].personal_best)
+            time_kinch[pb.user_id] = round(best / int(pb.personal_best) * 100, 3)
+
+    return time_kinch
+
+
+def __calculate_kinchranks(kinch: np.ndarray) -> List[float]:
+    """ Calculates each user's overall Kinchrank, the average of their Kinch scores across the events in the matrix. """
+
+    user_count, event_count = kinch.shape
+    if not event_count:
+        return [0] * user_count
+
+    # Sum the Kinch scores one event at a time, left to right, rather than using `sum`, which adds things up in a
+    # different order and can come out ever so slightly different than adding them up one by one.
+    kinch_sums = np.cumsum(kinch, axis=1)[:, -1]
+    averages = kinch_sums / (event_count + 0.0)
+
+    return [round(average, 3) for average in averages.tolist()]
@@ -1,7 +1,7 @@
 """ A package for creating and managing user event results. """
 
-from cubersio.persistence.user_results_manager import bulk_save_event_results, get_results_for_comp_event
-from cubersio.util.sorting import sort_user_results_with_rankings
+from cubersio.persistence.cache_generations_manager import bump_cache_generation, comp_event_results_cache_key
+from cubersio.persistence.user_results_manager import bulk_save_event_results, get_ranked_results_for_comp_event
 
 # -------------------------------------------------------------------------------------------------
 
@@ -14,47 +14,55 @@ DNS = 'DNS'
 #              Stuff related to processing medals for top results in events
 # -------------------------------------------------------------------------------------------------
 
+def get_podium_ranks(ranks):
+    """ Returns the gold, silver, and bronze ranks for an event from the ranks of its results, with
+    -1 for any podium spot nobody is ranked for. """
+
+    # Since identically-ranked results get the same podium (if they get a podium), it may be
+    # that the silver and bronze raw rankings aren't "2" and "3". If there are 3 users with a
+    # gold podium, then silver will be 4 and bronze will be 5, and so on.
+    raw_available_ranks = set(ranks)
+    ranking_thresholds = sorted(list(raw_available_ranks))[:3]
+    gold_rank   = ranking_thresholds[0] if len(ranking_thresholds) > 0 else -1
+    silver_rank = ranking_thresholds[1] if len(ranking_thresholds) > 1 else -1
+    bronze_rank = ranking_thresholds[2] if len(ranking_thresholds) > 2 else -1
+
+    return gold_rank, silver_rank, bronze_rank
+
+
 def set_medals_on_best_event_results(comp_events):
     """ Iterates over a list of CompetitionEvents, gets the fastest 3 results for that event and
     sets the gold, silver, or bronze medal flags as appropriate. """
 
     for comp_event in comp_events:
-        results = get_results_for_comp_event(comp_event.id)
+        # The results come ranked by the database, with blacklisted results unranked
+        ranked_results = get_ranked_results_for_comp_event(comp_event.id)
+        results = [result for _, result in ranked_results]
 
-        # Simultaneously pull out the unblacklisted results, and ensure that blacklisted
-        # results do not have any medals set.
-        unblacklisted_results = list()
+        # Ensure blacklisted results do not have any medals set.
         for result in results:
             if result.is_blacklisted:
                 result.was_bronze_medal = False
                 result.was_silver_medal = False
                 result.was_gold_medal   = False
-            else:
-                unblacklisted_results.append(result)
 
-        # Handle the case where nobody participated in an event. The Ranking(...) mechanism used
-        # in sort_user_results_with_rankings chokes on empty iterables.
-        if not unblacklisted_results:
+        # Handle the case where nobody participated in an event.
+        results_with_rankings = [(rank, result) for rank, result in ranked_results if rank is not None]
+        if not results_with_rankings:
             print('Skipping {}, no results to process'.format(comp_event.Event.name))
             continue
 
-        results_with_rankings = sort_user_results_with_rankings(unblacklisted_results, comp_event.Event.eventFormat)
         print('Processed {} with {} total results'.format(comp_event.Event.name, len(results_with_rankings)))
 
-        # Since identically-ranked results get the same podium (if they get a podium), it may be
-        # that the silver and bronze raw rankings aren't "2" and "3". If there are 3 users with a
-        # gold podium, then silver will be 4 and bronze will be 5, and so on.
-        raw_available_ranks = set(r for r, _, _ in results_with_rankings)
-        ranking_thresholds = sorted(list(raw_available_ranks))[:3]
-        gold_rank   = ranking_thresholds[0] if len(ranking_thresholds) > 0 else -1
-        silver_rank = ranking_thresholds[1] if len(ranking_thresholds) > 1 else -1
-        bronze_rank = ranking_thresholds[2] if len(ranking_thresholds) > 2 else -1
+        gold_rank, silver_rank, bronze_rank = get_podium_ranks(r for r, _ in results_with_rankings)
 
         # Apply medals based on rankings
-        for ranking, _, result in results_with_rankings:
+        for ranking, result in results_with_rankings:
             result.was_gold_medal   = (ranking == gold_rank) and result.result != 'DNF'
             result.was_silver_medal = (ranking == silver_rank) and result.result != 'DNF'
             result.was_bronze_medal = (ranking == bronze_rank) and result.result != 'DNF'
 
-        # Save all event results with their updated medal flags
+        # Save all event results with their updated medal flags, and make sure the competition event's leaderboard shows
+        # them
+        bump_cache_generation(comp_event_results_cache_key(comp_event.id))
         bulk_save_event_results(results)
@@ -3,7 +3,7 @@ from arrow import now
 
 from cubersio import app
 from cubersio.util.events.mbld import MbldSolve
-from cubersio.persistence.comp_manager import get_comp_event_name_by_id
+from cubersio.persistence.events_manager import get_event_metadata
 
 # -------------------------------------------------------------------------------------------------
 
@@ -98,8 +98,8 @@ def take_blacklist_action_if_necessary(results, user):
     if user.always_blacklist:
         return __perform_perma_blacklist_action(results, user), True
 
-    # Get comp event name
-    comp_event_name = get_comp_event_name_by_id(results.comp_event_id)
+    # Get the name of the event these results are for
+    comp_event_name = get_event_metadata(results.event_id).name
 
     # Get the auto-blacklist thresholds for the event these results are for.
     # If we don't have thresholds, leave without taking any blacklist action
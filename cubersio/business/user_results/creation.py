@@ -31,6 +31,8 @@ def process_event_results(results, comp_event, user):
     expected_num_solves = comp_event.Event.totalSolves
     event_name          = comp_event.Event.name
 
+    results.event_id = event_id
+
     # Set the best single and overall average for this event
     __set_single_and_average(results, expected_num_solves, event_format)
 
@@ -1,18 +1,35 @@
 """ Stuff related to handling user PBs (personal bests) in user event results. """
 
+from collections import namedtuple
+from itertools import groupby
+from operator import attrgetter
+from typing import Iterable, List, Optional
+
+from cubersio import DB
 from cubersio.persistence.models import EventFormat, UserEventResults
-from cubersio.persistence.events_manager import get_event_format_for_event, get_events_name_id_mapping
+from cubersio.persistence.events_manager import get_event_format_for_event, get_event_id_for_name,\
+    get_all_event_metadata
+from cubersio.persistence.user_event_pbs_manager import get_user_event_pbs, update_user_event_pbs,\
+    get_all_user_event_pbs, replace_user_event_pbs, PBsTuple
 from cubersio.persistence.user_results_manager import get_pb_single_event_results_except_current_comp,\
     bulk_save_event_results, get_pb_average_event_results_except_current_comp,\
-    get_all_complete_user_results_for_user_and_event
+    get_all_complete_user_results_for_user_and_event, stream_all_complete_results_for_pbs, bulk_update_pb_flags
+from cubersio.persistence.user_site_rankings_manager import mark_site_rankings_dirty, mark_many_site_rankings_dirty
 from cubersio.util.events.resources import EVENT_MBLD
 
+from cubersio.business.rank_index import record_personal_best
 from cubersio.business.user_results import DNF
 
 # -------------------------------------------------------------------------------------------------
 
 EVENT_FORMATS_TO_SKIP_PB_AVERAGE_CHECK = [EventFormat.Bo1]
 
+# How many UserEventResults' changed PB flags to write per statement when recalculating everybody's PBs
+PB_FLAGS_UPDATE_BATCH_SIZE = 1000
+
+# The PB flags for one UserEventResults
+PBFlags = namedtuple('PBFlags', ['was_pb_single', 'was_pb_average', 'is_latest_pb_single', 'is_latest_pb_average'])
+
 # -------------------------------------------------------------------------------------------------
 # Functions and types below are intended to be used directly.
 # -------------------------------------------------------------------------------------------------
@@ -20,7 +37,7 @@ EVENT_FORMATS_TO_SKIP_PB_AVERAGE_CHECK = [EventFormat.Bo1]
 def set_pb_flags(user_id: int, event_result: UserEventResults, event_id: int, event_format: EventFormat):
     """ Sets the appropriate flag if either the single or average for this event is a PB. """
 
-    pb_single, pb_average = __get_pbs_for_user_and_event_excluding_latest(user_id, event_id)
+    pb_single, pb_average = __get_pbs_for_user_and_event_excluding_latest(user_id, event_id, event_result)
 
     # If the current single or average are tied with, or faster than, the user's current PB,
     # then flag this result as a PB. Tied PBs count as PBs in WCA rules
@@ -31,7 +48,7 @@ def set_pb_flags(user_id: int, event_result: UserEventResults, event_id: int, ev
 
     # PB average flag isn't valid for Bo1, so don't bother checking
     # PB average flag isn't valid for MBLD, so don't bother checking
-    if (event_format in EVENT_FORMATS_TO_SKIP_PB_AVERAGE_CHECK) or (event_id in [get_events_name_id_mapping()[EVENT_MBLD.name]]):
+    if (event_format in EVENT_FORMATS_TO_SKIP_PB_AVERAGE_CHECK) or (event_id == get_event_id_for_name(EVENT_MBLD.name)):
         event_result.was_pb_average = False
     else:
         if pb_average == __DNF_AS_PB and __pb_representation(event_result.average) == pb_average:
@@ -46,35 +63,56 @@ def set_pb_flags(user_id: int, event_result: UserEventResults, event_id: int, ev
     if event_result.was_pb_average:
         event_result.is_latest_pb_average = True
 
+    # Keep this process's site rank index up-to-date once these results are saved, so we can tell the user where their
+    # new PB ranks right away
+    record_personal_best(user_id, event_id,
+                         single=event_result.single if event_result.was_pb_single else None,
+                         average=event_result.average if event_result.was_pb_average else None)
+
     return event_result
 
 
 def recalculate_user_pbs_for_event(user_id, event_id):
     """ Recalculates PBs for all UserEventResults for the specified user and event. """
 
-    # Get the user's event results for this event. If they don't have any, we can just bail
+    # Get the user's event results for this event. If they don't have any, we can just make sure they don't have any
+    # PBs left over from results which have since been deleted, and bail
     results = get_all_complete_user_results_for_user_and_event(user_id, event_id)
     if not results:
+        update_user_event_pbs(user_id, event_id, results)
+        bulk_save_event_results(results)
         return
 
     event_format = get_event_format_for_event(event_id)
+    for result, flags in zip(results, calculate_pb_flags(results, event_format)):
+        result.was_pb_single        = flags.was_pb_single
+        result.was_pb_average       = flags.was_pb_average
+        result.is_latest_pb_single  = flags.is_latest_pb_single
+        result.is_latest_pb_average = flags.is_latest_pb_average
+
+    # Save all the UserEventResults with the modified PB flags along with the user's current PBs, and flag this event
+    # for the next site rankings run
+    update_user_event_pbs(user_id, event_id, results)
+    mark_site_rankings_dirty(user_id, event_id)
+    bulk_save_event_results(results)
+
+
+def calculate_pb_flags(results: Iterable, event_format: str) -> List[PBFlags]:
+    """ Returns the PB flags for each of a user's complete results for one event, which can be UserEventResults or
+    anything else with `single`, `average`, and `is_blacklisted`, ordered from earliest to latest. """
 
     # Start off at the beginning assuming no PBs
     pb_single_so_far  = __NO_PB_YET
     pb_average_so_far = __NO_PB_YET
 
     # Iterate over each result from earliest to latest, checking the singles and averages to see if they are faster than
-    # the current fastest to date. Update the UserEventResult PB flags as appropriate.
+    # the current fastest to date.
+    was_pb_flags = list()
     for result in results:
 
-        result.is_latest_pb_single = False
-        result.is_latest_pb_average = False
-
         # If the result is blacklisted, it's not under consideration for PBs.
-        # Make sure the PB flags are False and skip to the next result.
         if result.is_blacklisted:
-            result.was_pb_single  = False
-            result.was_pb_average = False
+            was_pb_flags.append((False, False))
             continue
 
         current_single  = __pb_representation(result.single)
@@ -83,37 +121,85 @@ def recalculate_user_pbs_for_event(user_id, event_id):
         # If the current single or average are tied with, or faster than, the user's current PB,
         # then flag this result as a PB. Tied PBs count as PBs in WCA rules.
         if __DNF_AS_PB == pb_single_so_far and __DNF_AS_PB == current_single:
-            result.was_pb_single = False
+            was_pb_single = False
         elif current_single <= pb_single_so_far:
             pb_single_so_far = current_single
-            result.was_pb_single = True
+            was_pb_single = True
         else:
-            result.was_pb_single = False
+            was_pb_single = False
 
         # PB average flag for Bo1 isn't valid, so don't bother checking
         if event_format != EventFormat.Bo1:
             if __DNF_AS_PB == pb_average_so_far and __DNF_AS_PB == current_average:
-                result.was_pb_average = False
+                was_pb_average = False
             elif current_average <= pb_average_so_far:
                 pb_average_so_far = current_average
-                result.was_pb_average = True
+                was_pb_average = True
             else:
-                result.was_pb_average = False
+                was_pb_average = False
         else:
-            result.was_pb_average = False
+            was_pb_average = False
 
-    for result in reversed(results):
-        if result.was_pb_single:
-            result.is_latest_pb_single = True
-            break
+        was_pb_flags.append((was_pb_single, was_pb_average))
 
-    for result in reversed(results):
-        if result.was_pb_average:
-            result.is_latest_pb_average = True
-            break
+    return __with_latest_pb_flags(was_pb_flags)
 
-    # Save all the UserEventResults with the modified PB flags
-    bulk_save_event_results(results)
+
+def calculate_latest_pb_flags(results: Iterable) -> List[PBFlags]:
+    """ Returns the PB flags for each of a user's complete results for one event, ordered from earliest to latest,
+    keeping their existing `was_pb_single` and `was_pb_average` flags and only working out which are the latest PBs. """
+
+    return __with_latest_pb_flags([(bool(result.was_pb_single), bool(result.was_pb_average)) for result in results])
+
+
+def recalculate_all_pbs(latest_only: bool = False) -> int:
+    """ Recalculates the PB flags on every complete UserEventResults, and everybody's current PBs, in one pass over all
+    the results. If `latest_only` is True, the existing PB flags are kept and only the latest PBs are worked out.
+
+    Only the results whose flags actually change are written, a batch at a time, and everything is committed together
+    at the end. Returns the number of results whose flags changed. """
+
+    event_formats = {event.id: event.eventFormat for event in get_all_event_metadata()}
+    previous_pbs  = get_all_user_event_pbs()
+
+    changed_pbs     = dict()
+    changed_events  = set()
+    flags_to_update = list()
+    changed_count   = 0
+
+    for (user_id, event_id), rows in groupby(stream_all_complete_results_for_pbs(),
+                                             key=attrgetter('user_id', 'event_id')):
+        rows = list(rows)
+        if latest_only:
+            all_flags = calculate_latest_pb_flags(rows)
+        else:
+            all_flags = calculate_pb_flags(rows, event_formats[event_id])
+
+        for row, flags in zip(rows, all_flags):
+            if flags != (row.was_pb_single, row.was_pb_average, row.is_latest_pb_single, row.is_latest_pb_average):
+                flags_to_update.append(dict(id=row.id, **flags._asdict()))
+                changed_events.add((user_id, event_id))
+
+        pbs = __current_pbs(rows, all_flags)
+        if pbs != previous_pbs.pop((user_id, event_id), None):
+            changed_pbs[(user_id, event_id)] = pbs
+
+        if len(flags_to_update) >= PB_FLAGS_UPDATE_BATCH_SIZE:
+            changed_count += len(flags_to_update)
+            bulk_update_pb_flags(flags_to_update)
+            flags_to_update = list()
+
+    changed_count += len(flags_to_update)
+    bulk_update_pb_flags(flags_to_update)
+
+    # Anybody with PBs left over no longer has any complete results for that event
+    changed_pbs.update({user_and_event: None for user_and_event in previous_pbs})
+    replace_user_event_pbs(changed_pbs)
+
+    mark_many_site_rankings_dirty(changed_events)
+    DB.session.commit()
+
+    return changed_count
 
 # -------------------------------------------------------------------------------------------------
 # Functions and types below are not meant to be used directly; instead these are just dependencies
@@ -144,18 +230,67 @@ def __pb_representation(time):
 __DNF_AS_PB = __pb_representation(DNF)
 
 
-def __get_pbs_for_user_and_event_excluding_latest(user_id, event_id):
+def __get_pbs_for_user_and_event_excluding_latest(user_id, event_id, event_result: UserEventResults):
     """ Returns a tuple of PB single and average for this event for the specified user, except
     for the current comp. Excluding the current comp allows for the user to keep updating their
     results for this comp, and the logic determining if this comp has a PB result doesn't include
-    this comp itself. """
+    this comp itself.
 
-    results_with_pb_singles = get_pb_single_event_results_except_current_comp(user_id, event_id)
-    singles = [__pb_representation(r.single) for r in results_with_pb_singles]
-    pb_single = min(singles) if singles else __NO_PB_YET
+    The user's current PBs are looked up directly. Only if one of them was set by these very results, which are being
+    updated, do we have to go looking through their other results for the PB before it. """
 
-    results_with_pb_averages = get_pb_average_event_results_except_current_comp(user_id, event_id)
-    averages = [__pb_representation(r.average) for r in results_with_pb_averages]
-    pb_average = min(averages) if averages else __NO_PB_YET
+    pbs = get_user_event_pbs(user_id, event_id)
+    if not pbs:
+        return __NO_PB_YET, __NO_PB_YET
+
+    if pbs.single_results_id is None:
+        pb_single = __NO_PB_YET
+    elif event_result.id is None or pbs.single_results_id != event_result.id:
+        pb_single = __pb_representation(pbs.single)
+    else:
+        results_with_pb_singles = get_pb_single_event_results_except_current_comp(user_id, event_id)
+        singles = [__pb_representation(r.single) for r in results_with_pb_singles]
+        pb_single = min(singles) if singles else __NO_PB_YET
+
+    if pbs.average_results_id is None:
+        pb_average = __NO_PB_YET
+    elif event_result.id is None or pbs.average_results_id != event_result.id:
+        pb_average = __pb_representation(pbs.average)
+    else:
+        results_with_pb_averages = get_pb_average_event_results_except_current_comp(user_id, event_id)
+        averages = [__pb_representation(r.average) for r in results_with_pb_averages]
+        pb_average = min(averages) if averages else __NO_PB_YET
 
     return pb_single, pb_average
+
+
+def __with_latest_pb_flags(was_pb_flags) -> List[PBFlags]:
+    """ Takes a list of (was PB single, was PB average) flags for a user's results for one event, ordered from earliest
+    to latest, and returns the full PB flags with the last of each type of PB flagged as the latest. """
+
+    latest_single  = max((i for i, flags in enumerate(was_pb_flags) if flags[0]), default=None)
+    latest_average = max((i for i, flags in enumerate(was_pb_flags) if flags[1]), default=None)
+
+    return [PBFlags(was_pb_single, was_pb_average, i == latest_single, i == latest_average)
+            for i, (was_pb_single, was_pb_average) in enumerate(was_pb_flags)]
+
+
+def __current_pbs(rows, all_flags: List[PBFlags]) -> Optional[PBsTuple]:
+    """ Returns the user's current PBs as of the specified results and their PB flags, in the same form as stored for
+    the user and event, or None if they don't have any. The current PBs are the latest flagged as PBs which aren't
+    blacklisted. """
+
+    pb_single, pb_average = None, None
+    for row, flags in zip(rows, all_flags):
+        if row.is_blacklisted:
+            continue
+        if flags.was_pb_single:
+            pb_single = row
+        if flags.was_pb_average:
+            pb_average = row
+
+    if not (pb_single or pb_average):
+        return None
+
+    return (pb_single.single if pb_single else None, pb_single.id if pb_single else None,
+            pb_average.average if pb_average else None, pb_average.id if pb_average else None)
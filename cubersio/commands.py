@@ -7,14 +7,15 @@ import click
 from cubersio import app
 from cubersio.persistence.models import UserSolve, UserEventResults
 from cubersio.business.user_results.blacklisting import __AUTO_BLACKLIST_THRESHOLDS
-from cubersio.business.user_results.personal_bests import recalculate_user_pbs_for_event
+from cubersio.business.user_results.personal_bests import recalculate_all_pbs
 from cubersio.persistence.comp_manager import get_complete_competitions, get_all_comp_events_for_comp,\
     get_competition, override_title_for_next_comp, set_all_events_flag_for_next_comp,\
     get_active_competition
-from cubersio.persistence.events_manager import get_all_events
+from cubersio.persistence.rankings_runs_manager import get_recent_rankings_runs
 from cubersio.persistence.user_results_manager import save_event_results
-from cubersio.persistence.user_manager import get_all_users, get_all_admins, set_user_as_admin,\
+from cubersio.persistence.user_manager import get_all_admins, set_user_as_admin,\
     unset_user_as_admin, UserDoesNotExistException, update_or_create_user_for_reddit
+from cubersio.business.competition.snapshots import freeze_competition
 from cubersio.business.user_results import set_medals_on_best_event_results
 from cubersio.business.user_results.creation import process_event_results
 from cubersio.tasks.competition_management import post_results_thread_task,\
@@ -81,10 +82,31 @@ def generate_new_comp_only(all_events, title):
 
 
 @app.cli.command()
-def calculate_all_user_site_rankings():
-    """ Calculates UserSiteRankings for all users as of the current comp. """
+@click.option('--incremental', is_flag=True, default=False)
+def calculate_all_user_site_rankings(incremental):
+    """ Calculates UserSiteRankings for all users as of the current comp. With --incremental, only re-ranks the events
+    whose results have changed since the last run. """
 
-    run_user_site_rankings()
+    run_user_site_rankings(incremental=incremental)
+
+
+@app.cli.command()
+@click.option('--count', '-n', type=int, default=3)
+def show_rankings_runs(count):
+    """ Shows how long each phase of the most recent site rankings runs took, and how much memory they used. """
+
+    for run in get_recent_rankings_runs(count):
+        run_type = 'incremental' if run.is_incremental else 'full'
+        if run.phases is None:
+            print(f"\n{run.timestamp:%Y-%m-%d %H:%M:%S} {run_type} run, {run.workers} worker(s), unfinished")
+            continue
+        print(f"\n{run.timestamp:%Y-%m-%d %H:%M:%S} {run_type} run, {run.users_count} users, {run.workers} worker(s), " +
+              f"{run.total_seconds}s")
+        print(f"    {'phase':<32}{'wall (s)':>10}{'db (s)':>10}{'rows':>10}{'peak (KB)':>12}")
+        for phase in run.to_dict()['phases']:
+            peak_memory_kb = phase['peak_memory_kb'] if phase['peak_memory_kb'] is not None else '-'
+            print(f"    {phase['name']:<32}{phase['wall_seconds']:>10}{phase['db_seconds']:>10}{phase['rows']:>10}" +
+                  f"{peak_memory_kb:>12}")
 
 
 @app.cli.command()
@@ -134,23 +156,16 @@ def list_admins():
 
 @app.cli.command()
 def recalculate_pbs():
-    """ Works through every user, every event type, and re-calculates PB averages and singles
-    and sets appropriate flags on UserEventResults. """
-
-    all_users = get_all_users()
-    user_count = len(all_users)
-
-    all_events = get_all_events()
+    """ Re-calculates PB averages and singles for every user and every event type in one pass over all results, and
+    sets appropriate flags on UserEventResults. """
 
-    for i, user in enumerate(all_users):
-        print("Recalculating PBs for {} ({}/{})".format(user.username, i + 1, user_count))
-        for event in all_events:
-            recalculate_user_pbs_for_event(user.id, event.id)
+    changed_count = recalculate_all_pbs()
+    print("Recalculated PBs, flags changed on {} results".format(changed_count))
 
 
 @app.cli.command()
 def calculate_latest_pbs():
-    """ Works through every user, every event type, and calculates latest PB averages and singles. """
+    """ Calculates latest PB averages and singles for every user and every event type. """
 
     update_pbs()
 
@@ -178,6 +193,19 @@ def backfill_results_medals():
         print('\nBackfilling for comp {} ({}/{})'.format(comp.id, i + 1, total_num))
         set_medals_on_best_event_results(get_all_comp_events_for_comp(comp.id))
 
+
+@app.cli.command()
+@click.option('--comp_id', '-i', type=int, default=None)
+def freeze_competitions(comp_id):
+    """ Utility command to freeze the leaderboards of the specified past competition, or every
+    past competition if none is specified, into snapshots. """
+
+    all_comps = [get_competition(comp_id)] if comp_id else get_complete_competitions()
+    total_num = len(all_comps)
+    for i, comp in enumerate(all_comps):
+        print('\nFreezing comp {} ({}/{})'.format(comp.id, i + 1, total_num))
+        freeze_competition(comp.id)
+
 # -------------------------------------------------------------------------------------------------
 # Below are utility commands intended just for development use
 # -------------------------------------------------------------------------------------------------
@@ -250,4 +278,4 @@ def generate_fake_comp_results():
                 results.solves.append(solve)
 
             process_event_results(results, comp_event, user)
-            save_event_results(results)
+            save_event_results(results, comp_event.Event.id)
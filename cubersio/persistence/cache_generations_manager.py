@@ -0,0 +1,57 @@
+""" Utility functions for dealing with CacheGeneration records. """
+
+from typing import Dict, Iterable
+
+from cubersio import DB
+from cubersio.persistence.models import CacheGeneration
+from cubersio.persistence.dialect import dialect_insert
+
+# -------------------------------------------------------------------------------------------------
+
+def event_results_cache_key(event_id: int) -> str:
+    """ Returns the cache generation key for anything cached from the PBs in the specified event. It's bumped every time
+    any results which are, or were, a user's PB for that event change. """
+
+    return f'event_results:{event_id}'
+
+
+def comp_event_results_cache_key(comp_event_id: int) -> str:
+    """ Returns the cache generation key for anything cached from the results of the specified competition event. It's
+    bumped every time any user's results for that competition event change. """
+
+    return f'comp_event_results:{comp_event_id}'
+
+
+def get_cache_generation(key: str) -> int:
+    """ Returns the current generation for the specified cache key, which is 0 if it's never been bumped. """
+
+    generation = DB.session.\
+        query(CacheGeneration.generation).\
+        filter(CacheGeneration.key == key).\
+        scalar()
+
+    return generation or 0
+
+
+def get_cache_generations(keys: Iterable[str]) -> Dict[str, int]:
+    """ Returns the current generation for each of the specified cache keys, as a dictionary of key to generation. Keys
+    which have never been bumped are left out. """
+
+    rows = DB.session.\
+        query(CacheGeneration.key, CacheGeneration.generation).\
+        filter(CacheGeneration.key.in_(list(keys))).\
+        all()
+
+    return {key: generation for key, generation in rows}
+
+
+def bump_cache_generation(key: str):
+    """ Bumps the generation for the specified cache key, so anything cached at an older generation is known to be out
+    of date. The bump isn't committed here, it goes out with whatever changes prompted it. """
+
+    upsert = dialect_insert(CacheGeneration.__table__).values(key=key, generation=1)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[CacheGeneration.key],
+        set_={'generation': CacheGeneration.generation + 1}
+    )
+    DB.session.execute(upsert)
@@ -10,7 +10,7 @@ from sqlalchemy.orm import joinedload
 from cubersio import DB
 from cubersio.persistence.models import Competition, CompetitionEvent, Event, Scramble,\
     CompetitionGenResources, UserEventResults, User
-from cubersio.persistence.events_manager import get_event_by_name
+from cubersio.persistence.events_manager import get_event_id_for_name
 from cubersio.persistence.user_manager import get_user_by_id
 
 # -------------------------------------------------------------------------------------------------
@@ -70,9 +70,10 @@ def get_comp_event_name_by_id(comp_event_id):
 
 
 def get_comp_event_by_id(comp_event_id):
-    """ Returns a competition_event by id. """
+    """ Returns a competition_event by id, along with its competition and event. """
 
     return CompetitionEvent.query.\
+        options(joinedload(CompetitionEvent.Competition), joinedload(CompetitionEvent.Event)).\
         filter(CompetitionEvent.id == comp_event_id).\
         first()
 
@@ -207,8 +208,7 @@ def save_new_competition(title, event_data):
     new_comp = Competition(title=title, active=True, start_timestamp=now)
 
     for data in event_data:
-        event = get_event_by_name(data['name'])
-        comp_event = CompetitionEvent(event_id=event.id)
+        comp_event = CompetitionEvent(event_id=get_event_id_for_name(data['name']))
 
         for scramble_text in data['scrambles']:
             scramble = Scramble(scramble=scramble_text)
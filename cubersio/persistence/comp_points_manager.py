@@ -0,0 +1,104 @@
+""" Utility functions for dealing with UserCompEventPoints and UserCompPoints records. """
+
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, update
+
+from cubersio import DB
+from cubersio.persistence.models import CompetitionEvent, User, UserCompEventPoints, UserCompPoints
+from cubersio.persistence.dialect import dialect_insert
+
+# -------------------------------------------------------------------------------------------------
+
+def get_comp_events_points_generations(comp_id: int) -> List[Tuple[int, Optional[int]]]:
+    """ Returns a list of (comp event ID, points generation) for every event in the specified competition,
+    where the points generation is the generation of the competition event's results its points were last worked out
+    from, or None if they never have been. """
+
+    return DB.session.\
+        query(CompetitionEvent.id, CompetitionEvent.points_generation).\
+        filter(CompetitionEvent.competition_id == comp_id).\
+        all()
+
+
+def get_user_comp_event_points(comp_event_id: int) -> Dict[int, int]:
+    """ Returns the points each user earned in the specified competition event, as a dictionary of user ID to
+    points. """
+
+    rows = DB.session.\
+        query(UserCompEventPoints.user_id, UserCompEventPoints.points).\
+        filter(UserCompEventPoints.comp_event_id == comp_event_id).\
+        all()
+
+    return {user_id: points for user_id, points in rows}
+
+
+def replace_user_comp_event_points(comp_id: int,
+                                   comp_event_id: int,
+                                   old_generation: Optional[int],
+                                   new_generation: int,
+                                   old_points: Dict[int, int],
+                                   new_points: Dict[int, int]):
+    """ Replaces the points for the specified competition event, which were worked out from the `old_generation` of
+    its results, with points worked out from the `new_generation`, and adjusts each user's overall points for the
+    competition by the difference. Only users whose points changed are touched.
+
+    If the points were already replaced by somebody else since `old_generation` was read, their update stands and
+    nothing is changed. Otherwise, the changes are committed. """
+
+    # Claim this update first, so if somebody else is doing the same thing at the same time only one of the adjustments
+    # to users' overall points is made
+    generation_filter = CompetitionEvent.points_generation == old_generation if old_generation is not None else\
+        CompetitionEvent.points_generation.is_(None)
+    claimed = DB.session.execute(
+        update(CompetitionEvent).
+        where(CompetitionEvent.id == comp_event_id).
+        where(generation_filter).
+        values(points_generation=new_generation).
+        execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        DB.session.rollback()
+        return
+
+    adjustments = list()
+    for user_id in set(old_points) | set(new_points):
+        points_change = new_points.get(user_id, 0) - old_points.get(user_id, 0)
+        events_count_change = int(user_id in new_points) - int(user_id in old_points)
+        if points_change or events_count_change:
+            adjustments.append(dict(comp_id=comp_id, user_id=user_id, points=points_change,
+                                    events_count=events_count_change))
+
+    if adjustments:
+        DB.session.execute(
+            delete(UserCompEventPoints).
+            where(UserCompEventPoints.comp_event_id == comp_event_id).
+            execution_options(synchronize_session=False)
+        )
+        if new_points:
+            DB.session.execute(insert(UserCompEventPoints.__table__),
+                               [dict(comp_event_id=comp_event_id, user_id=user_id, points=points)
+                                for user_id, points in new_points.items()])
+
+        upsert = dialect_insert(UserCompPoints.__table__)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[UserCompPoints.comp_id, UserCompPoints.user_id],
+            set_={'points':       UserCompPoints.points + upsert.excluded.points,
+                  'events_count': UserCompPoints.events_count + upsert.excluded.events_count}
+        )
+        DB.session.execute(upsert, adjustments)
+
+    DB.session.commit()
+
+
+def get_overall_points_leaderboard(comp_id: int) -> List[Tuple[str, int]]:
+    """ Returns a list of (username, points) for everybody who has taken part in the specified competition, ordered
+    by their overall points for it, most first. """
+
+    return DB.session.\
+        query(User.username, UserCompPoints.points).\
+        join(User, User.id == UserCompPoints.user_id).\
+        filter(UserCompPoints.comp_id == comp_id).\
+        filter(UserCompPoints.events_count > 0).\
+        order_by(UserCompPoints.points.desc(), User.username).\
+        all()
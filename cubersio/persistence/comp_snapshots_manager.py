@@ -0,0 +1,40 @@
+""" Utility functions for dealing with CompetitionSnapshot records. """
+
+from datetime import datetime
+from typing import Optional
+
+from cubersio import DB
+from cubersio.persistence.models import CompetitionSnapshot
+
+# -------------------------------------------------------------------------------------------------
+
+def comp_event_snapshot_key(comp_event_id: int) -> str:
+    """ Returns the snapshot key for the leaderboard of the specified competition event. """
+
+    return f'comp_event:{comp_event_id}'
+
+
+def competition_snapshot_key(comp_id: int) -> str:
+    """ Returns the snapshot key for the events and overall points of the specified competition. """
+
+    return f'competition:{comp_id}'
+
+
+def results_digest_snapshot_key(comp_id: int) -> str:
+    """ Returns the snapshot key for the results digest of the specified competition. """
+
+    return f'results_digest:{comp_id}'
+
+
+def get_competition_snapshot(key: str) -> Optional[CompetitionSnapshot]:
+    """ Returns the snapshot with the specified key, or None if there isn't one. """
+
+    return DB.session.get(CompetitionSnapshot, key)
+
+
+def save_competition_snapshot(key: str, comp_id: int, generation: Optional[int], data: str):
+    """ Creates or replaces the snapshot with the specified key. """
+
+    snapshot = CompetitionSnapshot(key=key, comp_id=comp_id, generation=generation, timestamp=datetime.now(), data=data)
+    DB.session.merge(snapshot)
+    DB.session.commit()
@@ -0,0 +1,28 @@
+""" Utility functions for dealing with the differences between the databases the app runs on, which is either
+PostgreSQL in prod, or SQLite locally. """
+
+import sqlite3
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from cubersio import DB
+
+# -------------------------------------------------------------------------------------------------
+
+def dialect_insert(table):
+    """ Returns an INSERT for the table that supports ON CONFLICT clauses for the database in use. """
+
+    if DB.engine.dialect.name == 'postgresql':
+        return postgresql_insert(table)
+
+    return sqlite_insert(table)
+
+
+def database_supports_window_functions() -> bool:
+    """ Returns whether the database supports window functions. SQLite didn't until 3.25. """
+
+    if DB.engine.dialect.name != 'sqlite':
+        return True
+
+    return sqlite3.sqlite_version_info >= (3, 25, 0)
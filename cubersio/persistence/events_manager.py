@@ -1,13 +1,28 @@
 """ Utility module for persisting and retrieving Events, and information related to Events. """
 
-from collections import OrderedDict
-from functools import lru_cache
-from typing import List
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+from typing import List, Optional
 
 from cubersio import DB
 from cubersio.persistence.models import Event, CompetitionEvent, UserEventResults, ScramblePool
-from cubersio.util.events.resources import WCA_EVENTS, NON_WCA_EVENTS, BONUS_EVENTS
+from cubersio.util.events.resources import BONUS_EVENTS, get_event_definition_for_name, get_global_sort_position
 
+# -------------------------------------------------------------------------------------------------
+
+# Everything about an event which doesn't change while the site is running, combining its Event record with its
+# EventDefinition. `sort_order` is the event's position in the global event sort order, or None if it's not in it.
+EventMetadata = namedtuple('EventMetadata', ['id', 'name', 'totalSolves', 'eventFormat', 'description', 'is_wca',
+                                             'is_weekly', 'is_bonus', 'sort_order'])
+
+# Every event's metadata, by ID and by name, and ordered by ID
+__EventRegistry = namedtuple('__EventRegistry', ['by_id', 'by_name', 'all'])
+
+# Events only ever change through migrations, so every event's metadata is loaded just once per process, the first time
+# any of it is needed, and then kept here. See `reload_event_metadata`.
+__EVENT_REGISTRY = None
+
+# -------------------------------------------------------------------------------------------------
 
 def get_event_by_name(name):
     """ Returns an event by name. """
@@ -26,42 +41,77 @@ def get_all_events() -> List[Event]:
         all()
 
 
-@lru_cache()
+def get_event_metadata(event_id) -> Optional[EventMetadata]:
+    """ Returns the metadata for the event with the specified ID, or None if there isn't one. """
+
+    return __get_event_registry().by_id.get(event_id)
+
+
+def get_event_metadata_by_name(name) -> Optional[EventMetadata]:
+    """ Returns the metadata for the event with the specified name, or None if there isn't one. """
+
+    return __get_event_registry().by_name.get(name)
+
+
+def get_all_event_metadata() -> List[EventMetadata]:
+    """ Returns the metadata for every event, ordered by ID. """
+
+    return list(__get_event_registry().all)
+
+
+def get_all_event_metadata_in_sort_order() -> List[EventMetadata]:
+    """ Returns the metadata for every event in the global event sort order, leaving out any events which aren't in
+    it. """
+
+    sortable_events = [event for event in __get_event_registry().all if event.sort_order is not None]
+    return sorted(sortable_events, key=lambda event: event.sort_order)
+
+
+def reload_event_metadata():
+    """ Forgets every event's metadata, so it's loaded fresh from the database the next time it's needed. Events only
+    change through migrations, so this is only needed if they're changed while this process is running. This only
+    affects the current process. """
+
+    global __EVENT_REGISTRY
+    __EVENT_REGISTRY = None
+
+
+def get_event_id_for_name(name):
+    """ Gets the ID of the event with the specified name, or None if there isn't one. """
+
+    event = get_event_metadata_by_name(name)
+    return event.id if event else None
+
+
 def get_event_format_for_event(event_id):
     """ Gets the event format for the specified event. """
 
-    return Event.query.\
-        filter(Event.id == event_id).\
-        first().\
-        eventFormat
+    return get_event_metadata(event_id).eventFormat
 
 
-def get_all_WCA_events():
+def get_all_WCA_events() -> List[EventMetadata]:
     """ Returns a list of all WCA events. """
 
-    wca_names = set(e.name for e in WCA_EVENTS)
-    return [e for e in get_all_events() if e.name in wca_names]
+    return [e for e in get_all_event_metadata() if e.is_wca]
 
 
-def get_all_non_WCA_events():
+def get_all_non_WCA_events() -> List[EventMetadata]:
     """ Returns a list of all non-WCA events. """
 
-    non_wca_names = set(e.name for e in NON_WCA_EVENTS)
-    return [e for e in get_all_events() if e.name in non_wca_names]
+    return [e for e in get_all_event_metadata() if not e.is_wca]
 
 
-def get_all_bonus_events():
+def get_all_bonus_events() -> List[EventMetadata]:
     """ Returns a list of all bonus events. """
 
-    bonus_event_names = set(e.name for e in BONUS_EVENTS)
-    return [e for e in get_all_events() if e.name in bonus_event_names]
+    return [e for e in get_all_event_metadata() if e.is_bonus]
 
 
 def get_events_name_id_mapping():
     """ Returns a dictionary of event name to ID mappings. """
 
     mapping = OrderedDict()
-    for event in get_all_events():
+    for event in get_all_event_metadata():
         mapping[event.name] = event.id
 
     return mapping
@@ -104,3 +154,41 @@ def add_scramble_to_scramble_pool(scramble: str, event_id: int) -> None:
 
     DB.session.add(ScramblePool(scramble=scramble, event_id=event_id))
     DB.session.commit()
+
+# -------------------------------------------------------------------------------------------------
+
+def __get_event_registry():
+    """ Returns every event's metadata, loading it from the database if it hasn't been already. """
+
+    global __EVENT_REGISTRY
+    if __EVENT_REGISTRY is None:
+        __EVENT_REGISTRY = __build_event_registry()
+
+    return __EVENT_REGISTRY
+
+
+def __build_event_registry():
+    """ Builds the metadata for every event from their Event records and their EventDefinitions. """
+
+    bonus_names = set(e.name for e in BONUS_EVENTS)
+
+    all_metadata = list()
+    for event in get_all_events():
+        definition = get_event_definition_for_name(event.name)
+        all_metadata.append(EventMetadata(
+            id          = event.id,
+            name        = event.name,
+            totalSolves = event.totalSolves,
+            eventFormat = event.eventFormat,
+            description = event.description,
+            is_wca      = bool(definition and definition.is_wca),
+            is_weekly   = bool(definition and definition.is_weekly),
+            is_bonus    = event.name in bonus_names,
+            sort_order  = get_global_sort_position(event.name),
+        ))
+
+    return __EventRegistry(
+        by_id   = MappingProxyType({event.id: event for event in all_metadata}),
+        by_name = MappingProxyType({event.name: event for event in all_metadata}),
+        all     = tuple(all_metadata),
+    )
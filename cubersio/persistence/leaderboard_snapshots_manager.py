@@ -0,0 +1,46 @@
+""" Utility functions for dealing with LeaderboardSnapshot records. """
+
+from typing import Dict, Optional
+
+from sqlalchemy.sql import func
+
+from cubersio import DB
+from cubersio.persistence.models import LeaderboardSnapshot
+
+# -------------------------------------------------------------------------------------------------
+
+def save_leaderboard_snapshots(rankings_run_id: int, snapshots: Dict[str, str]):
+    """ Saves the serialized leaderboards published by a rankings run, as a map of leaderboard name to data. Snapshots
+    from runs before the previously published one are deleted, since nothing reads them anymore. The previous one is
+    kept so requests which looked up the latest run just before this one was published can still be served. """
+
+    previous_run_id = get_latest_leaderboard_snapshots_run_id()
+
+    for leaderboard, data in snapshots.items():
+        DB.session.add(LeaderboardSnapshot(rankings_run_id=rankings_run_id, leaderboard=leaderboard, data=data))
+
+    if previous_run_id is not None:
+        DB.session.\
+            query(LeaderboardSnapshot).\
+            filter(LeaderboardSnapshot.rankings_run_id < previous_run_id).\
+            delete(synchronize_session=False)
+
+    DB.session.commit()
+
+
+def get_latest_leaderboard_snapshots_run_id() -> Optional[int]:
+    """ Returns the ID of the most recent rankings run which published leaderboard snapshots, or None if none have. """
+
+    return DB.session.\
+        query(func.max(LeaderboardSnapshot.rankings_run_id)).\
+        scalar()
+
+
+def get_leaderboard_snapshot_data(rankings_run_id: int, leaderboard: str) -> Optional[str]:
+    """ Returns the serialized data for a leaderboard published by the specified rankings run. """
+
+    return DB.session.\
+        query(LeaderboardSnapshot.data).\
+        filter(LeaderboardSnapshot.rankings_run_id == rankings_run_id).\
+        filter(LeaderboardSnapshot.leaderboard == leaderboard).\
+        scalar()
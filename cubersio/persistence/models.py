@@ -4,10 +4,11 @@ from collections import namedtuple
 import json
 
 from flask_login import LoginManager, UserMixin, AnonymousUserMixin
-from sqlalchemy.orm import relationship, reconstructor
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, validates
 
 from cubersio import DB, app
-from cubersio.util.times import convert_centiseconds_to_friendly_time
+from cubersio.util.times import convert_centiseconds_to_friendly_time, convert_time_to_sort_key
 from cubersio.util.events.mbld import MbldSolve
 
 
@@ -25,10 +26,24 @@ class PersonalBestRecord:
         self.personal_best    = kwargs.get('personal_best')
         self.comment          = kwargs.get('comment')
         self.user_is_verified = kwargs.get('user_is_verified')
+        self.sort_key         = kwargs.get('sort_key')
         self.rank             = '-1'
         self.numerical_rank   = '-1'
 
 
+class RankedPersonalBest:
+    """ A compact PB record, with only what's needed to calculate site rankings: whose PB it is, the PB itself, and its
+    rank. The site rankings job holds one of these for every PB in every event at once, so it uses `__slots__` and
+    skips all the display fields of a PersonalBestRecord. """
+
+    __slots__ = ('user_id', 'personal_best', 'numerical_rank')
+
+    def __init__(self, user_id, personal_best, numerical_rank):
+        self.user_id        = user_id
+        self.personal_best  = personal_best
+        self.numerical_rank = numerical_rank
+
+
 Text       = DB.Text
 Enum       = DB.Enum
 Model      = DB.Model
@@ -37,6 +52,7 @@ String     = DB.String
 Float      = DB.Float
 Boolean    = DB.Boolean
 Integer    = DB.Integer
+BigInteger = DB.BigInteger
 DateTime   = DB.DateTime
 ForeignKey = DB.ForeignKey
 
@@ -146,15 +162,24 @@ class Scramble(Model):
 class UserEventResults(Model):
     """ A model detailing a user's results for a single event at competition. References the user,
     the competitionEvent, the single and average result for the event. These values are either in
-    centiseconds (ex: "1234" = 12.34s), 10x units for FMC (ex: "2833" = 28.33 moves) or "DNF". """
+    centiseconds (ex: "1234" = 12.34s), 10x units for FMC (ex: "2833" = 28.33 moves) or "DNF".
+
+    The event ID is copied from the competitionEvent when the results are saved, so a user's results
+    for an event, and their latest PBs for it, can be found without joining through competitionEvent.
+
+    The single and result are also kept as integer sort keys, so results can be sorted and ranked by the
+    database. They're kept up to date whenever the single or result is set. """
 
     __tablename__        = 'user_event_results'
     id                   = Column(Integer, primary_key=True)
     user_id              = Column(Integer, ForeignKey('users.id'))
     comp_event_id        = Column(Integer, ForeignKey('competition_event.id'), index=True)
+    event_id             = Column(Integer, ForeignKey('events.id'))
     single               = Column(String(10))
     average              = Column(String(10))
     result               = Column(String(10))
+    single_key           = Column(BigInteger)
+    result_key           = Column(BigInteger)
     comment              = Column(Text)
     solves               = relationship('UserSolve', order_by=lambda: UserSolve.scramble_id)
     reddit_comment       = Column(String(10))
@@ -170,16 +195,91 @@ class UserEventResults(Model):
     was_silver_medal     = Column(Boolean)
     was_bronze_medal     = Column(Boolean)
 
-    @reconstructor
-    def init_on_load(self):
-        """ Determine on load if these results are for FMC, or for a blind event, to facilitate
-        getting user-friendly representations of individual solve times and overall result, single
-        or average. """
+    __table_args__ = (
+        DB.UniqueConstraint('user_id', 'comp_event_id', name='unique_user_comp_event_results'),
+        DB.Index('ix_user_event_results_user_event_latest_pb_single', 'user_id', 'event_id', 'is_latest_pb_single'),
+        DB.Index('ix_user_event_results_user_event_latest_pb_average', 'user_id', 'event_id', 'is_latest_pb_average'),
+        DB.Index('ix_user_event_results_comp_event_sort_keys', 'comp_event_id', 'result_key', 'single_key'),
+    )
+
+    # Whether these results were complete before they were first changed, and whether anything shown for them on the
+    # competition event's leaderboard has changed since they were loaded. Unlike the attribute history, these survive
+    # the session being flushed, and they're forgotten once the changes are committed.
+    _was_complete         = None
+    _shown_values_changed = False
+
+    @validates('single', 'average', 'result', 'times_string', 'comment', 'is_complete')
+    def __track_changes(self, column, value):
+        """ Keeps the sort key for the single or result up to date whenever it's set, and keeps track of changes which
+        affect what's shown on the competition event's leaderboard. """
+
+        if column in ('single', 'result'):
+            setattr(self, f'{column}_key', convert_time_to_sort_key(value))
+
+        previous_value = getattr(self, column)
+        if column == 'is_complete':
+            if self._was_complete is None:
+                self._was_complete = bool(previous_value)
+        elif value != previous_value:
+            self._shown_values_changed = True
+
+        return value
+
+
+    @property
+    def was_complete(self):
+        """ Whether these results were complete when they were loaded, before being changed. """
+
+        return bool(self.is_complete) if self._was_complete is None else self._was_complete
+
+
+    @property
+    def is_leaderboard_changed(self):
+        """ Whether the changes to these results change what's shown on the competition event's leaderboard, which only
+        shows complete results. That's the case if they've become complete, or stopped being complete, or if anything
+        shown for them changed while they're complete. """
+
+        if bool(self.is_complete) != self.was_complete:
+            return True
+
+        return bool(self.is_complete) and self._shown_values_changed
+
+
+    @property
+    def is_fmc(self):
+        """ Whether these results are for FMC, to facilitate getting user-friendly representations of
+        individual solve times and overall result, single or average. """
 
-        event_name = self.CompetitionEvent.Event.name
-        self.is_fmc   = event_name == 'FMC'
-        self.is_blind = event_name in ('2BLD', '3BLD', '4BLD', '5BLD')
-        self.is_mbld  = event_name == 'MBLD'
+        return self.__event_name() == 'FMC'
+
+
+    @property
+    def is_blind(self):
+        """ Whether these results are for a blind event. """
+
+        return self.__event_name() in ('2BLD', '3BLD', '4BLD', '5BLD')
+
+
+    @property
+    def is_mbld(self):
+        """ Whether these results are for MBLD. """
+
+        return self.__event_name() == 'MBLD'
+
+
+    def __event_name(self):
+        """ Returns the name of the event these results are for. This is only worked out when it's needed, rather than
+        every time results are loaded, and it's looked up by event ID rather than through the CompetitionEvent, so it
+        doesn't lazy-load anything per results. Each event is only loaded once per session, and then comes from the
+        session's identity map. """
+
+        event_id = self.event_id
+        if event_id is None and self.comp_event_id is not None:
+            event_id = DB.session.get(CompetitionEvent, self.comp_event_id).event_id
+        if event_id is None:
+            return None
+
+        return DB.session.get(Event, event_id).name
 
 
     def set_solves(self, incoming_solves):
@@ -228,6 +328,17 @@ class UserEventResults(Model):
         return convert_centiseconds_to_friendly_time(value)
 
 
+@event.listens_for(UserEventResults, 'expire')
+def __forget_tracked_changes(results, attrs):
+    """ Forgets the changes tracked for the leaderboard once the results are expired, which they are when their changes
+    are committed. """
+
+    # The results may already have been garbage collected, in which case there's nothing to forget
+    if results is not None and attrs is None:
+        results._was_complete = None
+        results._shown_values_changed = False
+
+
 class CompetitionEvent(Model):
     """ Associative model for an event held at a competition - FKs to the competition and event,
     and a JSON array of scrambles. """
@@ -236,6 +347,11 @@ class CompetitionEvent(Model):
     id             = Column(Integer, primary_key=True)
     competition_id = Column(Integer, ForeignKey('competitions.id'), index=True)
     event_id       = Column(Integer, ForeignKey('events.id'), index=True)
+
+    # The generation of this competition event's results which its UserCompEventPoints were last worked out from, or
+    # None if they never have been
+    points_generation = Column(Integer)
+
     scrambles      = relationship('Scramble', backref='CompetitionEvent',
                                   primaryjoin=id == Scramble.competition_event_id, order_by=lambda: Scramble.id)
     user_results   = relationship('UserEventResults', backref='CompetitionEvent',
@@ -272,6 +388,45 @@ class Competition(Model):
                                     primaryjoin=id == CompetitionEvent.competition_id)
 
 
+class UserCompEventPoints(Model):
+    """ The points a user earned in one competition event towards the overall points for the competition, which is
+    the number of people who took part in the event minus the user's place. """
+
+    __tablename__ = 'user_comp_event_points'
+    comp_event_id = Column(Integer, ForeignKey('competition_event.id'), primary_key=True)
+    user_id       = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    points        = Column(Integer, nullable=False)
+
+
+class UserCompPoints(Model):
+    """ A user's overall points for a competition, and how many of its events they earned them in, which is the sum of
+    their UserCompEventPoints for the competition. It's adjusted by the difference whenever the points for one of the
+    competition's events are worked out again, so the overall points leaderboard can be read straight off of it. """
+
+    __tablename__ = 'user_comp_points'
+    comp_id       = Column(Integer, ForeignKey('competitions.id'), primary_key=True)
+    user_id       = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    points        = Column(Integer, nullable=False)
+    events_count  = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        DB.Index('ix_user_comp_points_comp_points', 'comp_id', 'points'),
+    )
+
+
+class CompetitionSnapshot(Model):
+    """ A prebuilt view of part of a finished competition, like one event's leaderboard, serialized as JSON so it can be
+    served as-is. The generation is the generation of the results it was built from, so it's known to be out of date if
+    they've changed since. """
+
+    __tablename__ = 'competition_snapshots'
+    key           = Column(String(64), primary_key=True)
+    comp_id       = Column(Integer, ForeignKey('competitions.id'), index=True)
+    generation    = Column(Integer)
+    timestamp     = Column(DateTime)
+    data          = Column(Text)
+
+
 class CompetitionGenResources(Model):
     """ A record for maintaining the current state of the competition generation. """
 
@@ -292,9 +447,9 @@ class UserSiteRankings(Model):
 
     __tablename__  = 'user_site_rankings'
     id                  = Column(Integer, primary_key=True)
-    user_id             = Column(Integer, ForeignKey('users.id'), index=True)
+    user_id             = Column(Integer, ForeignKey('users.id'), index=True, unique=True)
     user                = relationship('User', primaryjoin=user_id == User.id)
-    data                = Column(String(2048))
+    data                = Column(Text)
     timestamp           = Column(DateTime)
     sum_all_single      = Column(Integer)
     sum_all_average     = Column(Integer)
@@ -376,6 +531,134 @@ class UserSiteRankings(Model):
             display=format(self.non_wca_kinchrank, '.3f'))
 
 
+class UserEventSiteRankings(Model):
+    """ A user's PB single and average for one event, their site rankings for those, and their Kinch score for the
+    event. There is one of these for every user with site rankings, for every event anybody has competed in. Users who
+    haven't competed in an event have blank PBs, and are ranked (1 + number of people in the event).
+
+    This holds the same per-event data as the serialized UserSiteRankings.data, which is still written alongside it for
+    compatibility. """
+
+    __tablename__ = 'user_event_site_rankings'
+    user_id       = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    event_id      = Column(Integer, ForeignKey('events.id'), primary_key=True)
+    single        = Column(String(10))
+    single_rank   = Column(Integer)
+    average       = Column(String(10))
+    average_rank  = Column(Integer)
+    kinch         = Column(Float)
+
+    __table_args__ = (
+        DB.Index('ix_user_event_site_rankings_event_single_rank', 'event_id', 'single_rank'),
+        DB.Index('ix_user_event_site_rankings_event_average_rank', 'event_id', 'average_rank'),
+    )
+
+
+    def as_site_rankings_tuple(self):
+        """ Returns this event's rankings in the same format as an entry in the UserSiteRankings data:
+        (single, single_site_ranking, average, average_site_ranking, kinch). """
+
+        return self.single, self.single_rank, self.average, self.average_rank, format(self.kinch, '.3f')
+
+
+class UserEventPBs(Model):
+    """ A user's current PB single and average for one event, and the IDs of the UserEventResults they were set in.
+    Maintained alongside the PB flags on UserEventResults, whenever a user's results for the event are saved, deleted,
+    blacklisted, or unblacklisted, so checking a new result against the user's PBs is a single lookup. """
+
+    __tablename__      = 'user_event_pbs'
+    user_id            = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    event_id           = Column(Integer, ForeignKey('events.id'), primary_key=True)
+    single             = Column(String(10))
+    single_results_id  = Column(Integer)
+    average            = Column(String(10))
+    average_results_id = Column(Integer)
+
+
+class SiteRankingsDirtyEvent(Model):
+    """ A record indicating that a user's results for an event have changed since site rankings were last calculated,
+    so the rankings job can recalculate just the affected events instead of everything. """
+
+    __tablename__ = 'site_rankings_dirty_events'
+    id            = Column(Integer, primary_key=True)
+    user_id       = Column(Integer, ForeignKey('users.id'))
+    event_id      = Column(Integer, ForeignKey('events.id'), index=True)
+    timestamp     = Column(DateTime)
+
+
+class RankingsRun(Model):
+    """ A record of one run of the site rankings job, with how long it took overall, and the wall time, database time,
+    rows processed, and peak memory for each phase of the run, serialized as a JSON list. A run is recorded when it
+    starts, so a run without any phases either is still going or didn't finish. """
+
+    __tablename__  = 'rankings_runs'
+    id             = Column(Integer, primary_key=True)
+    timestamp      = Column(DateTime, index=True)
+    is_incremental = Column(Boolean)
+    workers        = Column(Integer)
+    users_count    = Column(Integer)
+    total_seconds  = Column(Float)
+    phases         = Column(Text)
+
+    def to_dict(self):
+        """ Returns a dictionary representation of this object, for serializing to JSON. """
+
+        return {
+            'id':             self.id,
+            'timestamp':      self.timestamp.isoformat(),
+            'is_incremental': self.is_incremental,
+            'workers':        self.workers,
+            'users_count':    self.users_count,
+            'total_seconds':  self.total_seconds,
+            'phases':         json.loads(self.phases) if self.phases else None,
+        }
+
+
+class LeaderboardSnapshot(Model):
+    """ A Sum of Ranks or Kinchranks leaderboard as of a specific site rankings run, already sorted and ranked so it can
+    be served as-is. The data is a JSON list of [rank, username, displayed value], one per user on the leaderboard. """
+
+    __tablename__   = 'leaderboard_snapshots'
+    __table_args__  = (
+        DB.UniqueConstraint('rankings_run_id', 'leaderboard', name='unique_leaderboard_per_rankings_run'),
+    )
+    id              = Column(Integer, primary_key=True)
+    rankings_run_id = Column(Integer, ForeignKey('rankings_runs.id'))
+    leaderboard     = Column(String(32))
+    data            = Column(Text)
+
+
+class CacheGeneration(Model):
+    """ A counter which is bumped every time the data behind some cache changes. Each process compares the generation
+    it cached something at against the current one to tell whether it's still good, so nothing needs to be told to
+    invalidate anything. """
+
+    __tablename__ = 'cache_generations'
+    key           = Column(String(64), primary_key=True)
+    generation    = Column(Integer, nullable=False, default=0)
+
+
+class PendingRecalculation(Model):
+    """ A record indicating that some derived data, like a user's PBs for an event or the medals for a competition
+    event, is out of date and a background task has been queued to recalculate it. The generation is bumped every time
+    it's requested again, so the task can tell whether anything changed while it was recalculating, and the timestamp
+    is when the latest task for it was queued. The record is removed once the data is consistent again. """
+
+    __tablename__ = 'pending_recalculations'
+    key           = Column(String(64), primary_key=True)
+    generation    = Column(Integer, nullable=False, default=0)
+    timestamp     = Column(DateTime)
+
+    def to_dict(self):
+        """ Returns a dictionary representation of this object, for serializing to JSON. """
+
+        return {
+            'key':        self.key,
+            'generation': self.generation,
+            'timestamp':  self.timestamp.isoformat(),
+        }
+
+
 class UserSolve(Model):
     """ A user's solve for a specific scramble, in a specific event, at a competition.
     Solve times are in centiseconds (ex: 1234 = 12.34s)."""
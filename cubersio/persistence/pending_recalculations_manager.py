@@ -0,0 +1,88 @@
+""" Utility functions for dealing with PendingRecalculation records. """
+
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import case
+
+from cubersio import DB
+from cubersio.persistence.models import PendingRecalculation
+from cubersio.persistence.dialect import dialect_insert
+
+# -------------------------------------------------------------------------------------------------
+
+# How long a recalculation can be pending before it's assumed the task queued for it was lost, and
+# requesting it again queues another one
+STALE_RECALCULATION_AGE = timedelta(minutes=15)
+
+# -------------------------------------------------------------------------------------------------
+
+def user_event_pbs_recalculation_key(user_id: int, event_id: int) -> str:
+    """ Returns the pending recalculation key for the specified user's PBs for the specified event. """
+
+    return f'user_event_pbs:{user_id}:{event_id}'
+
+
+def comp_event_medals_recalculation_key(comp_event_id: int) -> str:
+    """ Returns the pending recalculation key for the medals of the specified competition event. """
+
+    return f'comp_event_medals:{comp_event_id}'
+
+
+def request_recalculation(key: str) -> bool:
+    """ Records that the derived data for the specified key needs recalculating, bumping its generation if it's already
+    pending. Returns whether a task needs to be queued to do it, which is only the case if it wasn't already pending, or
+    has been pending for so long that the task queued for it must have been lost. Otherwise the task which is already
+    queued will pick up this request too. The request must be committed before the task is queued. """
+
+    timestamp = datetime.now()
+
+    # The timestamp is when a task was last queued for it, so it's only moved on when another one is about to be. That
+    # way, once a replacement is queued for a lost task, requests are coalesced into that one again.
+    upsert = dialect_insert(PendingRecalculation.__table__).values(key=key, generation=1, timestamp=timestamp)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[PendingRecalculation.key],
+        set_={
+            'generation': PendingRecalculation.generation + 1,
+            'timestamp':  case((PendingRecalculation.timestamp < timestamp - STALE_RECALCULATION_AGE, timestamp),
+                               else_=PendingRecalculation.timestamp),
+        }
+    )
+    upsert = upsert.returning(PendingRecalculation.timestamp)
+
+    return DB.session.execute(upsert).scalar_one() == timestamp
+
+
+def get_pending_recalculation_generation(key: str) -> Optional[int]:
+    """ Returns the current generation of the pending recalculation for the specified key, or None if it's not
+    pending. """
+
+    return DB.session.\
+        query(PendingRecalculation.generation).\
+        filter(PendingRecalculation.key == key).\
+        scalar()
+
+
+def finish_recalculation(key: str, generation: int) -> bool:
+    """ Marks the recalculation for the specified key as done, as long as it hasn't been requested again since the
+    specified generation was read. Returns whether it was marked done, and if it wasn't, it needs recalculating again to
+    pick up whatever changed in the meantime. """
+
+    deleted_count = DB.session.\
+        query(PendingRecalculation).\
+        filter(PendingRecalculation.key == key).\
+        filter(PendingRecalculation.generation == generation).\
+        delete(synchronize_session=False)
+
+    DB.session.commit()
+
+    return deleted_count == 1
+
+
+def get_pending_recalculations() -> List[PendingRecalculation]:
+    """ Returns every pending recalculation, oldest first. """
+
+    return DB.session.\
+        query(PendingRecalculation).\
+        order_by(PendingRecalculation.timestamp).\
+        all()
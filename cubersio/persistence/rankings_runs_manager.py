@@ -0,0 +1,67 @@
+""" Utility functions for dealing with RankingsRun records. """
+
+from typing import List
+
+from cubersio import DB
+from cubersio.persistence.models import RankingsRun, LeaderboardSnapshot
+
+# -------------------------------------------------------------------------------------------------
+
+# How many of the most recent RankingsRuns to keep around
+RANKINGS_RUNS_HISTORY_SIZE = 100
+
+# -------------------------------------------------------------------------------------------------
+
+def save_rankings_run(rankings_run: RankingsRun) -> int:
+    """ Saves a RankingsRun, and deletes the oldest runs beyond the history we keep, along with any leaderboard snapshots
+    they published. Returns the new run's ID. """
+
+    DB.session.add(rankings_run)
+    DB.session.flush()
+    rankings_run_id = rankings_run.id
+
+    oldest_kept_id = DB.session.\
+        query(RankingsRun.id).\
+        order_by(RankingsRun.id.desc()).\
+        offset(RANKINGS_RUNS_HISTORY_SIZE - 1).\
+        limit(1).\
+        scalar()
+
+    if oldest_kept_id is not None:
+        DB.session.\
+            query(LeaderboardSnapshot).\
+            filter(LeaderboardSnapshot.rankings_run_id < oldest_kept_id).\
+            delete(synchronize_session=False)
+        DB.session.\
+            query(RankingsRun).\
+            filter(RankingsRun.id < oldest_kept_id).\
+            delete(synchronize_session=False)
+
+    DB.session.commit()
+
+    return rankings_run_id
+
+
+def complete_rankings_run(rankings_run_id: int, users_count: int, total_seconds: float, phases: str):
+    """ Records the outcome of a RankingsRun which has finished. """
+
+    DB.session.\
+        query(RankingsRun).\
+        filter(RankingsRun.id == rankings_run_id).\
+        update({
+            RankingsRun.users_count:   users_count,
+            RankingsRun.total_seconds: total_seconds,
+            RankingsRun.phases:        phases,
+        }, synchronize_session=False)
+
+    DB.session.commit()
+
+
+def get_recent_rankings_runs(count: int) -> List[RankingsRun]:
+    """ Returns the most recent RankingsRuns, newest first. """
+
+    return DB.session.\
+        query(RankingsRun).\
+        order_by(RankingsRun.id.desc()).\
+        limit(count).\
+        all()
@@ -0,0 +1,141 @@
+""" Utility functions for dealing with UserEventPBs records. """
+
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, inspect, tuple_
+
+from cubersio import DB
+from cubersio.persistence.models import UserEventPBs, UserEventResults
+
+# -------------------------------------------------------------------------------------------------
+
+# How many users' PBs for an event to replace per statement when replacing them in bulk
+REPLACE_BATCH_SIZE = 500
+
+# A user's current PBs for an event, as (single, single results ID, average, average results ID)
+PBsTuple = Tuple[Optional[str], Optional[int], Optional[str], Optional[int]]
+
+# Each UserEventResults PB flag, along with the UserEventResults and UserEventPBs attribute holding that type of PB, and
+# the UserEventPBs attribute holding the ID of the results the PB was set in
+__PB_FLAGS_AND_ATTRS = (('was_pb_single', 'single', 'single_results_id'),
+                        ('was_pb_average', 'average', 'average_results_id'))
+
+# -------------------------------------------------------------------------------------------------
+
+def get_user_event_pbs(user_id: int, event_id: int) -> Optional[UserEventPBs]:
+    """ Returns the specified user's current PBs for the specified event, or None if they don't have any. """
+
+    return DB.session.get(UserEventPBs, (user_id, event_id))
+
+
+def update_user_event_pbs(user_id: int, event_id: int, results: List[UserEventResults]):
+    """ Brings the user's current PBs for the event up-to-date with the PB flags on all their complete results for that
+    event, ordered from earliest to latest. PBs only ever get faster, so each current PB is the latest result flagged as
+    a PB which isn't blacklisted. Nothing is committed, so these are saved along with the changes to the results.
+    """
+
+    pb_single  = __latest_pb_result(results, 'was_pb_single')
+    pb_average = __latest_pb_result(results, 'was_pb_average')
+
+    pbs = get_user_event_pbs(user_id, event_id)
+    if not (pb_single or pb_average):
+        if pbs:
+            DB.session.delete(pbs)
+        return
+
+    if not pbs:
+        pbs = UserEventPBs(user_id=user_id, event_id=event_id)
+
+    pbs.single             = pb_single.single if pb_single else None
+    pbs.single_results_id  = pb_single.id if pb_single else None
+    pbs.average            = pb_average.average if pb_average else None
+    pbs.average_results_id = pb_average.id if pb_average else None
+
+    DB.session.add(pbs)
+
+
+def update_user_event_pbs_for_results(results: UserEventResults, event_id: int, is_removed: bool = False):
+    """ Brings the user's current PBs for the event up-to-date after just the specified results have changed, or have
+    been removed. If these results are now the latest PB, they become the current PB. If they were the current PB and
+    aren't anymore, the latest PB before them takes their place. Either way, none of the user's other results need to
+    be looked at. Doesn't commit. """
+
+    user_id = results.user_id
+    pbs = get_user_event_pbs(user_id, event_id) or UserEventPBs(user_id=user_id, event_id=event_id)
+
+    for pb_flag, value_attr, results_id_attr in __PB_FLAGS_AND_ATTRS:
+        current_results_id = getattr(pbs, results_id_attr)
+        is_pb = not is_removed and results.is_complete and getattr(results, pb_flag) and not results.is_blacklisted
+
+        if is_pb and (current_results_id is None or results.id >= current_results_id):
+            setattr(pbs, value_attr, getattr(results, value_attr))
+            setattr(pbs, results_id_attr, results.id)
+
+        elif not is_pb and current_results_id == results.id:
+            previous_pb = __get_latest_pb_results_excluding(user_id, event_id, pb_flag, value_attr, results.id)
+            setattr(pbs, value_attr, previous_pb[1] if previous_pb else None)
+            setattr(pbs, results_id_attr, previous_pb[0] if previous_pb else None)
+
+    has_pbs = pbs.single_results_id is not None or pbs.average_results_id is not None
+    if has_pbs:
+        DB.session.add(pbs)
+    elif inspect(pbs).persistent:
+        DB.session.delete(pbs)
+
+
+def get_all_user_event_pbs() -> Dict[Tuple[int, int], PBsTuple]:
+    """ Returns everybody's current PBs for every event, as a dictionary of (user ID, event ID) to PBs tuple. """
+
+    rows = DB.session.\
+        query(UserEventPBs.user_id, UserEventPBs.event_id, UserEventPBs.single, UserEventPBs.single_results_id,
+              UserEventPBs.average, UserEventPBs.average_results_id).\
+        all()
+
+    return {(row[0], row[1]): tuple(row[2:]) for row in rows}
+
+
+def replace_user_event_pbs(pbs_by_user_and_event: Dict[Tuple[int, int], Optional[PBsTuple]]):
+    """ Replaces the current PBs for each of the specified (user ID, event ID) pairs with the specified PBs tuple, or
+    removes them if that's None, without committing. """
+
+    keys = list(pbs_by_user_and_event.keys())
+    for i in range(0, len(keys), REPLACE_BATCH_SIZE):
+        batch = keys[i:i + REPLACE_BATCH_SIZE]
+        DB.session.execute(
+            delete(UserEventPBs).
+            where(tuple_(UserEventPBs.user_id, UserEventPBs.event_id).in_(batch)).
+            execution_options(synchronize_session=False)
+        )
+
+        rows = list()
+        for user_id, event_id in batch:
+            pbs = pbs_by_user_and_event[(user_id, event_id)]
+            if pbs is not None:
+                rows.append(dict(user_id=user_id, event_id=event_id, single=pbs[0], single_results_id=pbs[1],
+                                 average=pbs[2], average_results_id=pbs[3]))
+        if rows:
+            DB.session.execute(insert(UserEventPBs.__table__), rows)
+
+
+def __latest_pb_result(results: List[UserEventResults], pb_flag: str) -> Optional[UserEventResults]:
+    for result in reversed(results):
+        if getattr(result, pb_flag) and not result.is_blacklisted:
+            return result
+
+    return None
+
+
+def __get_latest_pb_results_excluding(user_id: int, event_id: int, pb_flag: str, value_attr: str, results_id: int):
+    """ Returns (ID, single or average) of the user's latest complete, non-blacklisted results for the event flagged
+    with the specified PB flag, other than the specified results, or None if there aren't any. """
+
+    return DB.session.\
+        query(UserEventResults.id, getattr(UserEventResults, value_attr)).\
+        filter(UserEventResults.user_id == user_id).\
+        filter(UserEventResults.event_id == event_id).\
+        filter(getattr(UserEventResults, pb_flag)).\
+        filter(UserEventResults.is_complete).\
+        filter(UserEventResults.is_blacklisted.isnot(True)).\
+        filter(UserEventResults.id != results_id).\
+        order_by(UserEventResults.id.desc()).\
+        first()
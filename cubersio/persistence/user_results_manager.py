@@ -1,12 +1,22 @@
 """ Utility module for persisting and retrieving UserEventResults """
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from sqlalchemy.orm import joinedload
+from sqlalchemy import false, func, inspect, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 
 from cubersio import DB
+from cubersio.persistence.cache_generations_manager import bump_cache_generation, comp_event_results_cache_key
 from cubersio.persistence.comp_manager import get_active_competition
+from cubersio.persistence.dialect import database_supports_window_functions
 from cubersio.persistence.models import Competition, CompetitionEvent, Event, UserEventResults,\
     User, UserSolve
+from cubersio.persistence.user_event_pbs_manager import update_user_event_pbs, update_user_event_pbs_for_results
+from cubersio.persistence.user_site_rankings_manager import mark_site_rankings_dirty
+from cubersio.util.sorting import rank_sorted
+
+# How many complete results to fetch from the database at a time when recalculating everybody's PBs
+PB_RECALCULATION_YIELD_PER = 2000
 
 # -------------------------------------------------------------------------------------------------
 
@@ -38,6 +48,10 @@ def blacklist_results(results_id, note):
     results.blacklist_note = note
 
     DB.session.add(results)
+    if __is_or_was_pb(results):
+        mark_site_rankings_dirty(results.user_id, results.CompetitionEvent.event_id)
+    bump_cache_generation(comp_event_results_cache_key(results.comp_event_id))
+    __update_user_event_pbs(results.user_id, results.CompetitionEvent.event_id)
     DB.session.commit()
 
     return results
@@ -58,6 +72,10 @@ def unblacklist_results(results_id):
     results.blacklist_note = ''
 
     DB.session.add(results)
+    if __is_or_was_pb(results):
+        mark_site_rankings_dirty(results.user_id, results.CompetitionEvent.event_id)
+    bump_cache_generation(comp_event_results_cache_key(results.comp_event_id))
+    __update_user_event_pbs(results.user_id, results.CompetitionEvent.event_id)
     DB.session.commit()
 
     return results
@@ -107,21 +125,11 @@ def get_user_medals_count(user_id):
     return (gold_count, silver_count, bronze_count)
 
 
-def get_user_solve_for_scramble_id(user_id, scramble_id):
-    """ Returns a specific user solve for the given user ID and scramble ID. """
-
-    return DB.session.\
-        query(UserSolve).\
-        join(UserEventResults).\
-        filter(UserEventResults.user_id == user_id).\
-        filter(UserSolve.scramble_id == scramble_id).\
-        count()
-
-
 def get_event_results_for_user(comp_event_id, user):
-    """ Retrieves a UserEventResults for a specific user and competition event. """
+    """ Retrieves a UserEventResults for a specific user and competition event, along with its solves. """
 
     return UserEventResults.query.\
+        options(joinedload(UserEventResults.solves)).\
         filter(UserEventResults.user_id == user.id).\
         filter(UserEventResults.comp_event_id == comp_event_id).\
         first()
@@ -135,18 +143,6 @@ def get_all_complete_event_results():
         all()
 
 
-def get_results_for_comp_event(comp_event_id):
-    """ Retrieves all UserEventResults for the specified comp event. """
-
-    # Get all complete, unblacklisted results for the specified comp_event_id
-    return DB.session.\
-        query(UserEventResults).\
-        join(CompetitionEvent).\
-        filter(CompetitionEvent.id == comp_event_id).\
-        filter(UserEventResults.is_complete).\
-        all()
-
-
 def get_pb_single_event_results_except_current_comp(user_id, event_id):
     """ Returns the UserEventResults which were a PB single for the specified user and event. """
 
@@ -207,8 +203,9 @@ def get_all_complete_user_results_for_comp(comp_id, omit_blacklisted=True):
     return results_query
 
 
-def get_all_complete_user_results_for_comp_event(comp_event_id, omit_blacklisted=True):
-    """ Gets all complete UserEventResults for the specified CompetitionEvent. """
+def get_all_complete_user_results_for_comp_event(comp_event_id, omit_blacklisted=True, include_solves=False):
+    """ Gets all complete UserEventResults for the specified CompetitionEvent. If `include_solves` is set, each
+    result's solves are loaded too, with each solve's scramble. """
 
     results_query = DB.session.\
         query(UserEventResults).\
@@ -225,7 +222,96 @@ def get_all_complete_user_results_for_comp_event(comp_event_id, omit_blacklisted
         options(joinedload(UserEventResults.User)).\
         options(joinedload(UserEventResults.CompetitionEvent).subqueryload(CompetitionEvent.Event))
 
-    return results_query.all()
+    if include_solves:
+        results_query = results_query.options(selectinload(UserEventResults.solves).joinedload(UserSolve.Scramble))
+
+    return results_query.\
+        order_by(UserEventResults.result_key, UserEventResults.single_key, UserEventResults.id).\
+        all()
+
+
+def get_ranked_results_for_comp_event(comp_event_id) -> List[Tuple[Optional[int], UserEventResults]]:
+    """ Returns every complete UserEventResults for the specified CompetitionEvent, best first, each with its rank
+    among the non-blacklisted results, or None if it's blacklisted. They're ranked by the database on their sort
+    keys if it can, so identical results get the same rank. """
+
+    is_blacklisted = func.coalesce(UserEventResults.is_blacklisted, false())
+    order = (is_blacklisted, UserEventResults.result_key, UserEventResults.single_key, UserEventResults.id)
+
+    if not database_supports_window_functions():
+        results = DB.session.\
+            query(UserEventResults).\
+            filter(UserEventResults.comp_event_id == comp_event_id).\
+            filter(UserEventResults.is_complete).\
+            order_by(*order).\
+            all()
+
+        # The blacklisted results come last, so they don't throw off the ranks of the rest
+        ranked_results = [(rank, results) for rank, _, results in
+                          rank_sorted(results, [(results.result_key, results.single_key) for results in results])]
+        return [(None if results.is_blacklisted else rank, results) for rank, results in ranked_results]
+
+    rank = func.rank().over(partition_by=is_blacklisted,
+                            order_by=(UserEventResults.result_key, UserEventResults.single_key))
+
+    ranked_results = DB.session.\
+        query(rank, UserEventResults).\
+        filter(UserEventResults.comp_event_id == comp_event_id).\
+        filter(UserEventResults.is_complete).\
+        order_by(*order).\
+        all()
+
+    return [(None if results.is_blacklisted else rank, results) for rank, results in ranked_results]
+
+
+def get_complete_results_and_solves_counts_for_comp(comp_id) -> List[Tuple[UserEventResults, str, int]]:
+    """ Returns every complete UserEventResults for the specified competition, blacklisted or not, ordered by event,
+    each along with the username of the user it belongs to and how many solves it has, all in one query. """
+
+    solves_counts = DB.session.\
+        query(UserSolve.user_event_results_id.label('results_id'), func.count(UserSolve.id).label('solves_count')).\
+        join(UserEventResults, UserEventResults.id == UserSolve.user_event_results_id).\
+        join(CompetitionEvent, CompetitionEvent.id == UserEventResults.comp_event_id).\
+        filter(CompetitionEvent.competition_id == comp_id).\
+        group_by(UserSolve.user_event_results_id).\
+        subquery()
+
+    return DB.session.\
+        query(UserEventResults, User.username, func.coalesce(solves_counts.c.solves_count, 0)).\
+        join(User, User.id == UserEventResults.user_id).\
+        join(CompetitionEvent, CompetitionEvent.id == UserEventResults.comp_event_id).\
+        outerjoin(solves_counts, solves_counts.c.results_id == UserEventResults.id).\
+        filter(CompetitionEvent.competition_id == comp_id).\
+        filter(UserEventResults.is_complete).\
+        order_by(UserEventResults.event_id, UserEventResults.id).\
+        all()
+
+
+def get_user_ranks_for_comp_event(comp_event_id) -> List[Tuple[int, int]]:
+    """ Returns the user ID and rank of every complete, non-blacklisted UserEventResults for the specified
+    CompetitionEvent, ranked by the database on their sort keys if it can, without loading the whole records.
+    Identical results get the same rank. """
+
+    if not database_supports_window_functions():
+        rows = DB.session.\
+            query(UserEventResults.user_id, UserEventResults.result_key, UserEventResults.single_key).\
+            filter(UserEventResults.comp_event_id == comp_event_id).\
+            filter(UserEventResults.is_complete).\
+            filter(UserEventResults.is_blacklisted.isnot(True)).\
+            order_by(UserEventResults.result_key, UserEventResults.single_key).\
+            all()
+
+        return [(row.user_id, rank) for rank, _, row in
+                rank_sorted(rows, [(row.result_key, row.single_key) for row in rows])]
+
+    rank = func.rank().over(order_by=(UserEventResults.result_key, UserEventResults.single_key))
+
+    return DB.session.\
+        query(UserEventResults.user_id, rank.label('rank')).\
+        filter(UserEventResults.comp_event_id == comp_event_id).\
+        filter(UserEventResults.is_complete).\
+        filter(UserEventResults.is_blacklisted.isnot(True)).\
+        all()
 
 
 def get_blacklisted_entries_for_comp(comp_id):
@@ -245,28 +331,25 @@ def get_blacklisted_entries_for_comp(comp_id):
     return [(result.user_id, result.CompetitionEvent.event_id) for result in results]
 
 
-def get_all_complete_user_results_for_comp_and_user(comp_id, user_id, include_blacklisted=True):
-    """ Gets all complete UserEventResults for the specified competition and user. Includes
+def get_all_complete_user_results_for_user(user_id, include_blacklisted=True) -> List[UserEventResults]:
+    """ Gets all complete UserEventResults for the specified user, across every competition, ordered from the most
+    recent competition to the oldest, and then by event. Each results' CompetitionEvent comes back with it. Includes
     blacklisted results by default, but can optionally exclude them. """
 
     results_query = DB.session.\
         query(UserEventResults).\
-        join(User).\
         join(CompetitionEvent).\
-        join(Competition).\
-        join(Event).\
-        filter(Competition.id == comp_id).\
-        filter(User.id == user_id).\
+        options(contains_eager(UserEventResults.CompetitionEvent)).\
+        filter(UserEventResults.user_id == user_id).\
         filter(UserEventResults.is_complete)
 
     # If we don't want blacklisted results, filter those out.
     if not include_blacklisted:
         results_query = results_query.filter(UserEventResults.is_blacklisted.isnot(True))
 
-    # Make sure the events get ordered in a predictable way
-    results_query = results_query.order_by(Event.id)
-
-    return results_query.all()
+    return results_query.\
+        order_by(CompetitionEvent.competition_id.desc(), CompetitionEvent.event_id).\
+        all()
 
 
 def get_all_user_results_for_comp_and_user(comp_id, user_id):
@@ -312,58 +395,74 @@ def get_all_user_results_for_user(user_id):
         all()
 
 
+def stream_all_complete_results_for_pbs() -> Iterator[Row]:
+    """ Streams the PB-related columns of every complete UserEventResults, along with the event it's for, ordered by
+    user, then event, then from earliest to latest. """
+
+    query = select(UserEventResults.id,
+                   UserEventResults.user_id,
+                   CompetitionEvent.event_id,
+                   UserEventResults.single,
+                   UserEventResults.average,
+                   UserEventResults.is_blacklisted,
+                   UserEventResults.was_pb_single,
+                   UserEventResults.was_pb_average,
+                   UserEventResults.is_latest_pb_single,
+                   UserEventResults.is_latest_pb_average).\
+        join(CompetitionEvent, CompetitionEvent.id == UserEventResults.comp_event_id).\
+        where(UserEventResults.is_complete).\
+        order_by(UserEventResults.user_id, CompetitionEvent.event_id, UserEventResults.id)
+
+    return DB.session.execute(query.execution_options(yield_per=PB_RECALCULATION_YIELD_PER))
+
+
+def bulk_update_pb_flags(flags_by_results_id: List[Dict]):
+    """ Updates the PB flags of a batch of UserEventResults at once, as dicts of the results ID and the flag values,
+    without committing. """
+
+    if flags_by_results_id:
+        DB.session.execute(update(UserEventResults), flags_by_results_id)
+
+
 def save_event_results(new_results: UserEventResults, event_id: int):
     """ Saves a UserEventResults record. """
 
-    DB.session.add(new_results)
+    __add_event_results(new_results, event_id)
     DB.session.commit()
 
-    # Make sure the latest PB flags are appropriately set for all UserEventResults for this user and event
-    calculate_latest_user_pbs_for_event(new_results.user_id, event_id)
-
-    # Need to do this! When posting the first solve for an event, a new UserEventResults is created. This record only
-    # has a comp_event_id, but the associated CompetitionEvent is not loaded with it. If we do not expunge the record
-    # then when we go refresh the timer page, query again for this record, it gets loaded from the session directly.
-    # The CompetitionEvent is not populated, the UserEventResults::init_on_load isn't run, and the `is_fmc` and other
-    # attributes aren't populated. This causes us not to be able to build the list of times (from the solves associated
-    # with the UserEventResults) because we can't check if it's for FMC, MBLD, etc.
-    #
-    # Expunging here makes the follow-up query reload from the database, so UserEventResults::init_on_load runs, and
-    # those helper attributes get populated.
-    DB.session.expunge(new_results)
-
     return new_results
 
 
-def calculate_latest_user_pbs_for_event(user_id, event_id):
-    """ Calculates latest PBs for the specified user and event. """
+def save_many_event_results(results_and_event_ids: List[Tuple[UserEventResults, int]]):
+    """ Saves several UserEventResults records, each along with the ID of the event they're for, in
+    one transaction. """
 
-    # Get the user's event results for this event. If they don't have any, we can just bail
-    results = get_all_complete_user_results_for_user_and_event(user_id, event_id)
-    if not results:
-        return
-
-    for result in results:
-        result.is_latest_pb_single = False
-        result.is_latest_pb_average = False
+    for new_results, event_id in results_and_event_ids:
+        __add_event_results(new_results, event_id)
+    DB.session.commit()
 
-    for result in reversed(results):
-        if result.was_pb_single:
-            result.is_latest_pb_single = True
-            break
 
-    for result in reversed(results):
-        if result.was_pb_average:
-            result.is_latest_pb_average = True
-            break
+def discard_unsaved_event_results():
+    """ Throws away any changes to results which haven't been saved yet, for when saving them has failed. """
 
-    bulk_save_event_results(results)
+    DB.session.rollback()
 
 
 def delete_event_results(comp_event_results):
     """ Deletes a UserEventResults record. """
 
+    user_id  = comp_event_results.user_id
+    event_id = comp_event_results.CompetitionEvent.event_id
+
+    if __is_or_was_pb(comp_event_results):
+        mark_site_rankings_dirty(user_id, event_id)
+    if comp_event_results.is_complete:
+        bump_cache_generation(comp_event_results_cache_key(comp_event_results.comp_event_id))
     DB.session.delete(comp_event_results)
+    DB.session.flush()
+
+    __update_latest_pb_flags(comp_event_results, event_id, is_removed=True)
+    update_user_event_pbs_for_results(comp_event_results, event_id, is_removed=True)
     DB.session.commit()
 
 
@@ -380,3 +479,100 @@ def bulk_save_event_results(results_list):
     for result in results_list:
         DB.session.add(result)
     DB.session.commit()
+
+
+def __update_latest_pb_flags(results: UserEventResults, event_id: int, is_removed: bool = False):
+    """ Brings the latest PB flags for the user and event up-to-date after just the specified results have changed, or
+    have been removed, without committing. If these results are now the latest PB, the previous latest PB is unflagged.
+    If they were the latest PB and aren't anymore, the latest PB before them is flagged instead. """
+
+    for pb_flag, latest_pb_flag in (('was_pb_single', 'is_latest_pb_single'),
+                                    ('was_pb_average', 'is_latest_pb_average')):
+        other_latest_pbs = [UserEventResults.user_id == results.user_id,
+                            UserEventResults.event_id == event_id,
+                            getattr(UserEventResults, latest_pb_flag),
+                            UserEventResults.id != results.id]
+
+        if not is_removed and results.is_complete and getattr(results, pb_flag):
+            # These results are the latest PB, unless there's a later one
+            later_latest_pb = DB.session.\
+                query(UserEventResults.id).\
+                filter(*other_latest_pbs).\
+                filter(UserEventResults.id > results.id).\
+                first()
+
+            if not later_latest_pb:
+                DB.session.\
+                    query(UserEventResults).\
+                    filter(*other_latest_pbs).\
+                    update({latest_pb_flag: False}, synchronize_session=False)
+            setattr(results, latest_pb_flag, not later_latest_pb)
+            continue
+
+        if not is_removed:
+            setattr(results, latest_pb_flag, False)
+
+        # If these results were the latest PB, the latest PB before them is now the latest
+        if not DB.session.query(UserEventResults.id).filter(*other_latest_pbs).first():
+            previous_pb = DB.session.\
+                query(UserEventResults.id).\
+                filter(UserEventResults.user_id == results.user_id).\
+                filter(UserEventResults.event_id == event_id).\
+                filter(getattr(UserEventResults, pb_flag)).\
+                filter(UserEventResults.is_complete).\
+                filter(UserEventResults.id != results.id).\
+                order_by(UserEventResults.id.desc()).\
+                first()
+
+            if previous_pb:
+                DB.session.\
+                    query(UserEventResults).\
+                    filter(UserEventResults.id == previous_pb.id).\
+                    update({latest_pb_flag: True}, synchronize_session=False)
+
+
+def __add_event_results(new_results: UserEventResults, event_id: int):
+    """ Adds a UserEventResults record to the session, along with everything else which needs to change with it,
+    without committing. """
+
+    new_results.event_id = event_id
+    DB.session.add(new_results)
+
+    # Only complete results are on the competition event's leaderboard, so it only needs preparing again if these
+    # results are complete, or were until now, and something shown for them changed. That's not the case for every
+    # solve but the last one in an event, so posting those doesn't queue up behind everybody else posting solves.
+    if new_results.is_leaderboard_changed:
+        bump_cache_generation(comp_event_results_cache_key(new_results.comp_event_id))
+
+    # Incomplete results are never PBs, so unless these results are complete, or were until now, there's nothing to
+    # do for the user's PBs. That's the case for every solve but the last one in an event.
+    affects_pbs = new_results.is_complete or new_results.was_complete
+
+    # Site rankings and the event's records only come from PBs, so they only need redoing if these results are a PB,
+    # or were until now. Checked before flushing, which forgets what the PB flags were.
+    if affects_pbs and __is_or_was_pb(new_results):
+        mark_site_rankings_dirty(new_results.user_id, event_id)
+
+    # Make sure the latest PB flags, and the user's current PBs, are appropriately set for this user and event along
+    # with the new results. Only these results and the previous latest PBs are touched, no matter how many results the
+    # user has for this event.
+    DB.session.flush()
+    if affects_pbs:
+        __update_latest_pb_flags(new_results, event_id)
+        update_user_event_pbs_for_results(new_results, event_id)
+
+
+def __is_or_was_pb(results: UserEventResults) -> bool:
+    """ Returns whether the results are flagged as a PB single or average, or were before being changed in the
+    session. Results which aren't and weren't either can't change anybody's current PBs. """
+
+    state = inspect(results)
+    return any(getattr(results, pb_flag) or True in state.attrs[pb_flag].history.deleted
+               for pb_flag in ('was_pb_single', 'was_pb_average'))
+
+
+def __update_user_event_pbs(user_id, event_id):
+    """ Updates the user's current PBs for the event from their results as they are in the session, without
+    committing. """
+
+    update_user_event_pbs(user_id, event_id, get_all_complete_user_results_for_user_and_event(user_id, event_id))
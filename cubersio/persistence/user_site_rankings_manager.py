@@ -1,12 +1,32 @@
 """ Utility module for persisting and retrieving UserSiteRankings. """
 
+from datetime import datetime
 import json
-from typing import List, Optional, Dict
+from typing import Iterable, List, Optional, Dict, Set, Tuple
 
-from sqlalchemy.sql import func
+from sqlalchemy import delete, insert
 
 from cubersio import DB
-from cubersio.persistence.models import UserSiteRankings, User
+from cubersio.persistence.cache_generations_manager import bump_cache_generation, event_results_cache_key
+from cubersio.persistence.models import UserSiteRankings, User, SiteRankingsDirtyEvent, UserEventSiteRankings
+from cubersio.persistence.dialect import dialect_insert
+
+# -------------------------------------------------------------------------------------------------
+
+# Roughly how many characters of serialized site rankings data to write per batch when bulk
+# updating UserSiteRankings. The data dominates the size of each row, so this keeps each batch's
+# statements to a reasonable size regardless of how many events people have competed in.
+UPSERT_BATCH_PAYLOAD_SIZE = 512 * 1024
+
+# How many SiteRankingsDirtyEvent records to delete per statement once they've been dealt with
+DIRTY_EVENTS_DELETE_BATCH_SIZE = 1000
+
+# The UserSiteRankings columns written when bulk updating
+__SITE_RANKINGS_UPSERT_COLUMNS = ['user_id', 'data', 'timestamp', 'sum_all_single', 'sum_all_average', 'sum_wca_single',
+                                  'sum_wca_average', 'sum_non_wca_single', 'sum_non_wca_average', 'all_kinchrank',
+                                  'wca_kinchrank', 'non_wca_kinchrank']
+
+# -------------------------------------------------------------------------------------------------
 
 
 def get_site_rankings_for_user(user_id) -> Optional[UserSiteRankings]:
@@ -18,203 +38,168 @@ def get_site_rankings_for_user(user_id) -> Optional[UserSiteRankings]:
         first()
 
 
-def get_site_rankings_for_users(user_ids) -> Dict[int, UserSiteRankings]:
-    """ Retrieves UserSiteRankings records for the specified user IDs. """
+def get_event_site_rankings_for_user(user_id) -> Dict[int, Tuple[str, int, str, int, str]]:
+    """ Retrieves a user's site rankings for each event, as a map of event ID to
+    (single, single_site_ranking, average, average_site_ranking, kinch), ordered by event ID. """
 
-    rankings = DB.session.\
-        query(UserSiteRankings).\
-        filter(UserSiteRankings.user_id.in_(user_ids)).\
+    event_rankings = DB.session.\
+        query(UserEventSiteRankings).\
+        filter(UserEventSiteRankings.user_id == user_id).\
+        order_by(UserEventSiteRankings.event_id).\
         all()
 
-    return {ranking.user_id: ranking for ranking in rankings}
-
+    return {rankings.event_id: rankings.as_site_rankings_tuple() for rankings in event_rankings}
 
-def get_user_site_rankings_all_sorted_single():
-    """ Retrieves all UserSiteRankings sorted by combined single sum of ranks, excluding records
-    with the maximum combined single sum of ranks. These indicate users who haven't participated
-    at all. """
 
-    max_combined_single = DB.session.\
-        query(func.max(UserSiteRankings.sum_all_single)).\
-        first()[0]
+def get_all_site_rankings() -> List[UserSiteRankings]:
+    """ Retrieves all UserSiteRankings records. """
 
     return DB.session.\
-        query(UserSiteRankings.sum_all_single, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_all_single != max_combined_single).\
-        order_by(UserSiteRankings.sum_all_single.asc()).\
+        query(UserSiteRankings).\
         all()
 
 
-def get_user_site_rankings_all_sorted_average():
-    """ Retrieves all UserSiteRankings sorted by combined average sum of ranks, excluding records
-    with the maximum combined average sum of ranks. These indicate users who haven't participated
-    at all. """
-
-    max_combined_average = DB.session.\
-        query(func.max(UserSiteRankings.sum_all_average)).\
-        first()[0]
+def get_all_sums_of_ranks_and_kinchranks():
+    """ Retrieves every user's username, sums of ranks, and Kinchranks, for building the Sum of Ranks and Kinchranks
+    leaderboards. """
 
     return DB.session.\
-        query(UserSiteRankings.sum_all_average, User.username).\
+        query(User.username,
+              UserSiteRankings.sum_all_single, UserSiteRankings.sum_all_average,
+              UserSiteRankings.sum_wca_single, UserSiteRankings.sum_wca_average,
+              UserSiteRankings.sum_non_wca_single, UserSiteRankings.sum_non_wca_average,
+              UserSiteRankings.all_kinchrank, UserSiteRankings.wca_kinchrank, UserSiteRankings.non_wca_kinchrank).\
         join(User).\
-        filter(UserSiteRankings.sum_all_average != max_combined_average).\
-        order_by(UserSiteRankings.sum_all_average.asc()).\
         all()
 
 
-def get_user_site_rankings_wca_sorted_single():
-    """ Retrieves all UserSiteRankings sorted by WCA single sum of ranks, excluding records
-    with the maximum WCA single sum of ranks. These indicate users who haven't participated
-    at all. """
+def bulk_update_site_rankings(site_rankings: Iterable[UserSiteRankings]) -> int:
+    """ Create or update UserSiteRankings records in bulk, along with each user's per-event
+    UserEventSiteRankings. The records are upserted in batches sized by how much data they hold,
+    committing after each batch. Returns the number of UserSiteRankings written. """
 
-    max_combined_single = DB.session.\
-        query(func.max(UserSiteRankings.sum_wca_single)).\
-        first()[0]
+    saved_count = 0
+    batch = list()
+    batch_payload_size = 0
 
-    return DB.session.\
-        query(UserSiteRankings.sum_wca_single, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_wca_single != max_combined_single).\
-        order_by(UserSiteRankings.sum_wca_single.asc()).\
-        all()
+    for user_site_rankings in site_rankings:
+        batch.append(user_site_rankings)
+        batch_payload_size += len(user_site_rankings.data)
 
+        if batch_payload_size >= UPSERT_BATCH_PAYLOAD_SIZE:
+            __upsert_site_rankings_batch(batch)
+            saved_count += len(batch)
+            batch = list()
+            batch_payload_size = 0
 
-def get_user_site_rankings_wca_sorted_average():
-    """ Retrieves all UserSiteRankings sorted by WCA average sum of ranks, excluding records
-    with the maximum WCA average sum of ranks. These indicate users who haven't participated
-    at all. """
+    if batch:
+        __upsert_site_rankings_batch(batch)
+        saved_count += len(batch)
 
-    max_combined_average = DB.session.\
-        query(func.max(UserSiteRankings.sum_wca_average)).\
-        first()[0]
+    return saved_count
 
-    return DB.session.\
-        query(UserSiteRankings.sum_wca_average, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_wca_average != max_combined_average).\
-        order_by(UserSiteRankings.sum_wca_average.asc()).\
-        all()
 
+def __upsert_site_rankings_batch(site_rankings: List[UserSiteRankings]):
+    """ Upserts a batch of UserSiteRankings, keyed on user ID, and replaces those users'
+    UserEventSiteRankings, in one transaction. """
 
-def get_user_site_rankings_non_wca_sorted_single():
-    """ Retrieves all UserSiteRankings sorted by non-WCA single sum of ranks, excluding records
-    with the maximum non-WCA single sum of ranks. These indicate users who haven't participated
-    at all. """
+    user_ids = [rankings.user_id for rankings in site_rankings]
 
-    max_combined_single = DB.session.\
-        query(func.max(UserSiteRankings.sum_non_wca_single)).\
-        first()[0]
+    site_rankings_rows = [{column: getattr(rankings, column) for column in __SITE_RANKINGS_UPSERT_COLUMNS}
+                          for rankings in site_rankings]
 
-    return DB.session.\
-        query(UserSiteRankings.sum_non_wca_single, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_non_wca_single != max_combined_single).\
-        order_by(UserSiteRankings.sum_non_wca_single.asc()).\
-        all()
+    upsert = dialect_insert(UserSiteRankings.__table__)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[UserSiteRankings.user_id],
+        set_={column: upsert.excluded[column] for column in __SITE_RANKINGS_UPSERT_COLUMNS if column != 'user_id'}
+    )
+    DB.session.execute(upsert, site_rankings_rows)
 
+    # Replace these users' per-event site rankings with the new ones
+    DB.session.execute(
+        delete(UserEventSiteRankings).\
+        where(UserEventSiteRankings.user_id.in_(user_ids)).\
+        execution_options(synchronize_session=False)
+    )
 
-def get_user_site_rankings_non_wca_sorted_average():
-    """ Retrieves all UserSiteRankings sorted by non-WCA average sum of ranks, excluding records
-    with the maximum non-WCA average sum of ranks. These indicate users who haven't participated
-    at all. """
+    event_rankings_rows = list()
+    for rankings in site_rankings:
+        for event_id, event_rankings in json.loads(rankings.data).items():
+            event_rankings_rows.append(__build_event_site_rankings_row(rankings.user_id, int(event_id),
+                                                                       event_rankings))
 
-    max_combined_average = DB.session.\
-        query(func.max(UserSiteRankings.sum_non_wca_average)).\
-        first()[0]
+    if event_rankings_rows:
+        DB.session.execute(insert(UserEventSiteRankings.__table__), event_rankings_rows)
 
-    return DB.session.\
-        query(UserSiteRankings.sum_non_wca_average, User.username).\
-        join(User).\
-        filter(UserSiteRankings.sum_non_wca_average != max_combined_average).\
-        order_by(UserSiteRankings.sum_non_wca_average.asc()).\
-        all()
+    DB.session.commit()
 
 
-def get_user_kinchranks_wca_sorted():
-    """ Retrieves all Kinchranks sorted by WCA Kinchrank, except those with a value of 0.
-    These indicate users who haven't participated at all. """
+def __build_event_site_rankings_row(user_id, event_id, event_rankings):
+    """ Builds a dict of UserEventSiteRankings column values from a user ID, event ID, and the
+    (single, single_site_ranking, average, average_site_ranking, kinch) tuple for that event. """
 
-    return DB.session.\
-        query(UserSiteRankings.wca_kinchrank, User.username).\
-        join(User).\
-        filter(UserSiteRankings.wca_kinchrank != 0).\
-        order_by(UserSiteRankings.wca_kinchrank.desc()).\
-        all()
+    single, single_rank, average, average_rank, kinch = event_rankings
+    return {
+        'user_id':      user_id,
+        'event_id':     event_id,
+        'single':       single,
+        'single_rank':  single_rank,
+        'average':      average,
+        'average_rank': average_rank,
+        'kinch':        float(kinch),
+    }
 
 
-def get_user_kinchranks_non_wca_sorted():
-    """ Retrieves all Kinchranks sorted by non-WCA Kinchrank, except those with a value of 0.
-    These indicate users who haven't participated at all. """
+def mark_site_rankings_dirty(user_id: int, event_id: int):
+    """ Records that the specified user's results for the specified event have changed, so the next incremental site
+    rankings calculation knows to re-rank that event, and anything cached from that event's results is known to be out
+    of date. Nothing is committed here, so this lands in the same transaction as the results changes which prompted it.
+    """
 
-    return DB.session.\
-        query(UserSiteRankings.non_wca_kinchrank, User.username).\
-        join(User).\
-        filter(UserSiteRankings.non_wca_kinchrank != 0).\
-        order_by(UserSiteRankings.non_wca_kinchrank.desc()).\
-        all()
+    dirty_event = SiteRankingsDirtyEvent()
+    dirty_event.user_id   = user_id
+    dirty_event.event_id  = event_id
+    dirty_event.timestamp = datetime.now()
 
+    DB.session.add(dirty_event)
+    bump_cache_generation(event_results_cache_key(event_id))
 
-def get_user_kinchranks_all_sorted():
-    """ Retrieves all Kinchranks sorted by combined Kinchrank, except those with a value of 0.
-    These indicate users who haven't participated at all. """
 
-    return DB.session.\
-        query(UserSiteRankings.all_kinchrank, User.username).\
-        join(User).\
-        filter(UserSiteRankings.all_kinchrank != 0).\
-        order_by(UserSiteRankings.all_kinchrank.desc()).\
-        all()
+def mark_many_site_rankings_dirty(users_and_events: Iterable[Tuple[int, int]]):
+    """ Does the same as `mark_site_rankings_dirty` for many (user ID, event ID) pairs at once, bumping each event's
+    cache generation just once. """
 
+    timestamp = datetime.now()
+    dirty_events = [dict(user_id=user_id, event_id=event_id, timestamp=timestamp)
+                    for user_id, event_id in users_and_events]
+    if not dirty_events:
+        return
 
-def bulk_update_site_rankings(site_rankings: List[UserSiteRankings]):
-    """ Create or update UserSiteRankings records in bulk """
+    DB.session.execute(insert(SiteRankingsDirtyEvent.__table__), dirty_events)
+    for event_id in {dirty_event['event_id'] for dirty_event in dirty_events}:
+        bump_cache_generation(event_results_cache_key(event_id))
 
-    user_ids = [rankings.user_id for rankings in site_rankings]
-    user_ids_rankings_map = get_site_rankings_for_users(user_ids)
-
-    for new_user_site_rankings in site_rankings:
-        existing_ranking = user_ids_rankings_map.get(new_user_site_rankings.user_id, None)
-
-        # If this user already has a site rankings record, just update it
-        if existing_ranking:
-            existing_ranking.data                = new_user_site_rankings.data
-            existing_ranking.timestamp           = new_user_site_rankings.timestamp
-            existing_ranking.sum_all_single      = new_user_site_rankings.sum_all_single
-            existing_ranking.sum_all_average     = new_user_site_rankings.sum_all_average
-            existing_ranking.sum_wca_single      = new_user_site_rankings.sum_wca_single
-            existing_ranking.sum_wca_average     = new_user_site_rankings.sum_wca_average
-            existing_ranking.sum_non_wca_single  = new_user_site_rankings.sum_non_wca_single
-            existing_ranking.sum_non_wca_average = new_user_site_rankings.sum_non_wca_average
-            existing_ranking.all_kinchrank       = new_user_site_rankings.all_kinchrank
-            existing_ranking.wca_kinchrank       = new_user_site_rankings.wca_kinchrank
-            existing_ranking.non_wca_kinchrank   = new_user_site_rankings.non_wca_kinchrank
-            DB.session.add(existing_ranking)
-
-        # If not, create a new one
-        else:
-            DB.session.add(new_user_site_rankings)
-
-    DB.session.commit()
 
+def get_site_rankings_dirty_events() -> Tuple[List[int], Set[int]]:
+    """ Returns a tuple of the IDs of every SiteRankingsDirtyEvent record, and the set of IDs of the events which have
+    been marked dirty by them. The record IDs are used later to clear exactly the records which were seen here, so that
+    anything marked dirty while site rankings are being calculated isn't lost. That includes records which aren't
+    committed yet, even if they come before some of these ones by ID. """
 
-def update_one_event_site_rankings_for_user(user_id, new_site_rankings, event):
-    """ Update just one event's info for a user's UserSiteRankings if the record already exists.
-    dict[event ID][(single, single_site_ranking, average, average_site_ranking)] """
+    dirty_events = DB.session.\
+        query(SiteRankingsDirtyEvent.id, SiteRankingsDirtyEvent.event_id).\
+        all()
 
-    rankings_record = get_site_rankings_for_user(user_id)
+    return [dirty_event.id for dirty_event in dirty_events], set(dirty_event.event_id for dirty_event in dirty_events)
 
-    # Rankings record doesn't yet exist for this user, no need to create a new one
-    if not rankings_record:
-        return
 
-    # Get dict representation of existing site rankings data, and then update the entry
-    # for the specified event with the new data for that event
-    existing_data = rankings_record.get_site_rankings_data_as_dict()
-    existing_data[event.id] = new_site_rankings[event.id]
+def clear_site_rankings_dirty_events(record_ids: List[int]):
+    """ Deletes the SiteRankingsDirtyEvent records with the specified IDs. """
 
-    # Serialize the modified rankings data back into the rankings record
-    rankings_record.data = json.dumps(existing_data)
+    for i in range(0, len(record_ids), DIRTY_EVENTS_DELETE_BATCH_SIZE):
+        DB.session.\
+            query(SiteRankingsDirtyEvent).\
+            filter(SiteRankingsDirtyEvent.id.in_(record_ids[i:i + DIRTY_EVENTS_DELETE_BATCH_SIZE])).\
+            delete(synchronize_session=False)
 
-    DB.session.add(rankings_record)
     DB.session.commit()
@@ -20,6 +20,8 @@ def api_login_required(func):
     return decorated_function
 
 
+from cubersio.routes.admin import *
+from cubersio.routes.admin.admin_routes import *
 from cubersio.routes.auth import *
 from cubersio.routes.auth.reddit import *
 from cubersio.routes.auth.wca import *
@@ -0,0 +1,3 @@
+# pylint: disable=missing-docstring
+
+from .admin_routes import *
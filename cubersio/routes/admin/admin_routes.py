@@ -0,0 +1,46 @@
+""" Routes for admins to keep an eye on how the site's background jobs are doing. """
+
+from http import HTTPStatus
+import json
+
+from flask import request
+from flask_login import current_user
+
+from cubersio import app
+from cubersio.persistence.pending_recalculations_manager import get_pending_recalculations
+from cubersio.persistence.rankings_runs_manager import get_recent_rankings_runs
+
+# -------------------------------------------------------------------------------------------------
+
+DEFAULT_RANKINGS_RUNS_COUNT = 10
+
+# -------------------------------------------------------------------------------------------------
+
+@app.route('/admin/api/rankings_runs/')
+def rankings_runs():
+    """ A route for retrieving the most recent site rankings runs, newest first, with the wall time, database time,
+    rows processed, and peak memory for each phase of the run. The number of runs can be specified with `count`. """
+
+    if not (current_user.is_authenticated and current_user.is_admin):
+        return ("Hey, you're not allowed to do that.", HTTPStatus.FORBIDDEN)
+
+    count = request.args.get('count', DEFAULT_RANKINGS_RUNS_COUNT, type=int)
+
+    return json.dumps([run.to_dict() for run in get_recent_rankings_runs(count)])
+
+
+@app.route('/admin/api/pending_recalculations/')
+def pending_recalculations():
+    """ A route for checking whether the data derived from users' results, like PBs and medals, is consistent with
+    those results again after moderating them. Lists the recalculations which are still queued or running, oldest first,
+    and is consistent once there aren't any. """
+
+    if not (current_user.is_authenticated and current_user.is_admin):
+        return ("Hey, you're not allowed to do that.", HTTPStatus.FORBIDDEN)
+
+    pending = get_pending_recalculations()
+
+    return json.dumps({
+        'is_consistent': not pending,
+        'pending':       [recalculation.to_dict() for recalculation in pending],
+    })
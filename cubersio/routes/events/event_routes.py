@@ -1,60 +1,92 @@
 """ Routes related to displaying event records. """
 
-from collections import namedtuple, OrderedDict
 from csv import writer as csv_writer
+from http import HTTPStatus
 from io import StringIO
+import json
 
-from flask import render_template, make_response
+from flask import render_template, request, Response, stream_with_context
 from flask_login import current_user
 
 from cubersio import app
-from cubersio.business.rankings import get_ordered_pb_averages_for_event,\
-    get_ordered_pb_singles_for_event
-from cubersio.persistence.comp_manager import get_event_by_name
+from cubersio.business.event_records import get_event_records_pages, PB_TYPE_SINGLE, PB_TYPE_AVERAGE
+from cubersio.business.rank_index import get_site_ranks, get_ranked_pbs_counts
+from cubersio.business.rankings import get_pb_pairs_for_event
+from cubersio.persistence.events_manager import get_event_metadata_by_name, get_event_id_for_name
 
 # -------------------------------------------------------------------------------------------------
 
-# Container for sum of ranks data
-UserPBPair = namedtuple('UserPBPair', ['username', 'single', 'average'])
-
 CSV_HEADERS           = ['Username', 'Single (seconds)', 'Average (seconds)']
 CSV_FILENAME_TEMPLATE = '{event_name}_results.csv'
-CSV_EMPTY             = ''
 
 # -------------------------------------------------------------------------------------------------
 
 @app.route('/event/<event_name>/')
 def event_results(event_name):
-    """ A route for showing the global top results for a specific event. """
+    """ A route for showing the global top results for a specific event. The `after` or `before` query parameter is a
+    cursor for the page to show of the records picked by the `by` query parameter, either single or average. The other
+    records show their first page. """
 
     event = __safe_get_event(event_name)
     if not event:
         return ("I don't know what {} is.".format(event_name), 404)
 
-    singles  = get_ordered_pb_singles_for_event(event.id)
-    averages = get_ordered_pb_averages_for_event(event.id) if event.name != 'MBLD' else list()
+    pb_type = PB_TYPE_AVERAGE if request.args.get('by') == PB_TYPE_AVERAGE else PB_TYPE_SINGLE
+    username = current_user.username if current_user.is_authenticated else None
+
+    singles, averages = get_event_records_pages(event.id, event.name != 'MBLD', pb_type,
+                                                after=request.args.get('after'), before=request.args.get('before'),
+                                                username=username)
 
     title = "{} Records".format(event.name)
 
     return render_template("records/event.html", event_id=event.id, event_name=event.name,
-                           singles=singles, averages=averages, alternative_title=title,
+                           singles=singles, averages=averages, pb_type=pb_type, alternative_title=title,
                            show_admin=current_user.is_admin)
 
 
 @app.route('/event/<event_name>/export/')
 def event_results_export(event_name):
-    """ A route for exporting events records in CSV format. """
+    """ A route for exporting events records in CSV format. The CSV is streamed as the PBs are read from the database,
+    rather than built all at once. """
 
     event = __safe_get_event(event_name)
     if not event:
         return ("I don't know what {} is.".format(event_name), 404)
 
-    singles  = get_ordered_pb_singles_for_event(event.id)
-    averages = get_ordered_pb_averages_for_event(event.id)
+    filename = CSV_FILENAME_TEMPLATE.format(event_name=event.name)
+    output = Response(stream_with_context(__generate_csv_output(event.id)))
+    output.headers['Content-Disposition'] = "attachment; filename={}".format(filename)
+    output.headers['Content-type'] = "text/csv"
 
-    user_pb_dict = __build_user_pb_pairs(singles, averages)
+    return output
 
-    return __build_csv_output(event.name, user_pb_dict)
+# -------------------------------------------------------------------------------------------------
+# API endpoints
+# -------------------------------------------------------------------------------------------------
+
+@app.route('/api/rank/<event_name>')
+def site_rank(event_name):
+    """ A route for looking up the site rank a single and/or average would have in an event, given as the `single`
+    and `average` query parameters, in the same form as they're stored in results (centiseconds, for most events).
+    Returns a JSON-serialized dictionary of the form:
+    { "single": {"rank": 37, "of": 512}, "average": {"rank": 41, "of": 480} }
+    where either is null if the corresponding parameter wasn't provided. """
+
+    event_id = get_event_id_for_name(event_name.replace('%2F', '/'))
+    if event_id is None:
+        return ("I don't know what {} is.".format(event_name), HTTPStatus.NOT_FOUND)
+
+    single  = request.args.get('single', type=int)
+    average = request.args.get('average', type=int)
+
+    single_rank, average_rank = get_site_ranks(event_id, single=single, average=average)
+    singles_count, averages_count = get_ranked_pbs_counts(event_id)
+
+    return json.dumps({
+        'single':  {'rank': single_rank, 'of': singles_count} if single_rank else None,
+        'average': {'rank': average_rank, 'of': averages_count} if average_rank else None,
+    })
 
 # -------------------------------------------------------------------------------------------------
 
@@ -64,7 +96,7 @@ def __safe_get_event(event_name):
     # For some reason the urlencode and urldecode isn't handling forward slash properly
     # and we named the mirror blocks event with a slash...
     event_name = event_name.replace('%2F', '/')
-    return get_event_by_name(event_name)
+    return get_event_metadata_by_name(event_name)
 
 
 def __scrub_pb_value(value):
@@ -73,48 +105,25 @@ def __scrub_pb_value(value):
     return int(value) / 100.00 if value and value != 'DNF' else ''
 
 
-def __build_user_pb_pairs(singles, averages):
-    """ Store user PB records per user in a UserPBPair container, so we can include both PB single
-    and average for each user in the same line easily. """
-
-    user_pb_dict = OrderedDict()
+def __generate_csv_output(event_id):
+    """ Generates the lines of a CSV containing the PB single and average for each user for the specified event, one
+    user at a time. """
 
-    # While this looks like it's O(N^2), in fact both of these lists are sorted by result value,
-    # and each user is likely to occupy a similar index in both lists. The inner loop across
-    # averages will break early as it encounters the matching user
-    for pb_single in singles:
-        username = pb_single.username
-        single  = __scrub_pb_value(pb_single.personal_best)
-        average = CSV_EMPTY
-
-        for pb_average in averages:
-            if username == pb_average.username:
-                average = __scrub_pb_value(pb_average.personal_best)
-                break
-
-        user_pb_dict[username] = UserPBPair(username=username, single=single, average=average)
-
-    return user_pb_dict
-
-
-def __build_csv_output(event_name, user_pb_dict):
-    """ Builds a Flask file output response for a CSV containing the PB single and averages for each
-    user for the specified event. """
-
-    # Build a StringIO object and use it as the file for the CSV writer
+    # Build a StringIO object and use it as the file for the CSV writer, emptying it out after each line
     string_io = StringIO()
     writer = csv_writer(string_io)
 
+    def pop_line():
+        line = string_io.getvalue()
+        string_io.seek(0)
+        string_io.truncate()
+        return line
+
     # Write the header
     writer.writerow(CSV_HEADERS)
+    yield pop_line()
 
     # Write the rows for each user's PB single and average
-    for username, pb_pair in user_pb_dict.items():
-        writer.writerow([username, pb_pair.single, pb_pair.average])
-
-    filename = CSV_FILENAME_TEMPLATE.format(event_name=event_name)
-    output = make_response(string_io.getvalue())
-    output.headers['Content-Disposition'] = "attachment; filename={}".format(filename)
-    output.headers['Content-type'] = "text/csv"
-
-    return output
+    for username, single, average in get_pb_pairs_for_event(event_id):
+        writer.writerow([username, __scrub_pb_value(single), __scrub_pb_value(average)])
+        yield pop_line()
@@ -2,11 +2,11 @@
 
 from http import HTTPStatus
 
-from flask import render_template
+from flask import render_template, request
+from flask_login import current_user
 
 from cubersio import app
-from cubersio.persistence.user_site_rankings_manager import get_user_kinchranks_all_sorted,\
-    get_user_kinchranks_wca_sorted, get_user_kinchranks_non_wca_sorted
+from cubersio.business.leaderboards import get_leaderboard_page, KINCHRANKS_ALL, KINCHRANKS_WCA, KINCHRANKS_NON_WCA
 
 # -------------------------------------------------------------------------------------------------
 
@@ -21,10 +21,10 @@ __TITLE_MAP = {
     __KINCH_TYPE_NON_WCA: 'Kinchranks – Non-WCA',
 }
 
-__RESULTS_RETRIEVER_MAP = {
-    __KINCH_TYPE_ALL:     get_user_kinchranks_all_sorted,
-    __KINCH_TYPE_WCA:     get_user_kinchranks_wca_sorted,
-    __KINCH_TYPE_NON_WCA: get_user_kinchranks_non_wca_sorted,
+__LEADERBOARD_MAP = {
+    __KINCH_TYPE_ALL:     KINCHRANKS_ALL,
+    __KINCH_TYPE_WCA:     KINCHRANKS_WCA,
+    __KINCH_TYPE_NON_WCA: KINCHRANKS_NON_WCA,
 }
 
 __INVALID_KINCH_TYPE = "\"{}\" isn't a valid Kinchranks type."
@@ -33,14 +33,15 @@ __INVALID_KINCH_TYPE = "\"{}\" isn't a valid Kinchranks type."
 
 @app.route('/kinchranks/<rank_type>/')
 def kinchranks(rank_type):
-    """ A route for showing Kinchranks. """
+    """ A route for showing Kinchranks, one page at a time, per the `page` query parameter. """
 
     if rank_type not in __VALID_KINCH_TYPES:
         err_msg = __INVALID_KINCH_TYPE.format(rank_type)
         return render_template('error.html', error_message=err_msg), HTTPStatus.NOT_FOUND
 
-    sorted_kinchranks = __RESULTS_RETRIEVER_MAP[rank_type]()
-    formatted_kinchranks = [(format(kr[0], '.3f'), kr[1]) for kr in sorted_kinchranks]
+    page = request.args.get('page', 1, type=int)
+    username = current_user.username if current_user.is_authenticated else None
+    kinchranks_page = get_leaderboard_page(__LEADERBOARD_MAP[rank_type], page, username)
 
     return render_template("records/kinchranks.html", alternative_title="Kinchranks",
-                            title=__TITLE_MAP[rank_type], sorted_kinchranks=formatted_kinchranks)
+                            title=__TITLE_MAP[rank_type], sorted_kinchranks=kinchranks_page)
@@ -1,12 +1,11 @@
 """ Routes related to displaying overall Sum Of Ranks results. """
 
-from flask import render_template
+from flask import render_template, request
+from flask_login import current_user
 
 from cubersio import app
-from cubersio.persistence.user_site_rankings_manager import get_user_site_rankings_all_sorted_single,\
-    get_user_site_rankings_all_sorted_average, get_user_site_rankings_wca_sorted_average,\
-    get_user_site_rankings_wca_sorted_single, get_user_site_rankings_non_wca_sorted_average,\
-    get_user_site_rankings_non_wca_sorted_single
+from cubersio.business.leaderboards import get_leaderboard_page, SUM_OF_RANKS_ALL_SINGLE, SUM_OF_RANKS_ALL_AVERAGE,\
+    SUM_OF_RANKS_WCA_SINGLE, SUM_OF_RANKS_WCA_AVERAGE, SUM_OF_RANKS_NON_WCA_SINGLE, SUM_OF_RANKS_NON_WCA_AVERAGE
 
 # -------------------------------------------------------------------------------------------------
 
@@ -14,11 +13,15 @@ SOR_TYPE_ALL     = 'all'
 SOR_TYPE_WCA     = 'wca'
 SOR_TYPE_NON_WCA = 'non_wca'
 
+SOR_BY_SINGLE  = 'single'
+SOR_BY_AVERAGE = 'average'
+
 # -------------------------------------------------------------------------------------------------
 
 @app.route('/sum_of_ranks/<sor_type>/')
 def sum_of_ranks(sor_type):
-    """ A route for showing sum of ranks. """
+    """ A route for showing sum of ranks. The `page` query parameter is the page to show of the leaderboard picked by
+    the `by` query parameter, either single or average. The other leaderboard shows its first page. """
 
     if sor_type not in (SOR_TYPE_ALL, SOR_TYPE_WCA, SOR_TYPE_NON_WCA):
         return ("I don't know what kind of Sum of Ranks this is.", 404)
@@ -26,21 +29,28 @@ def sum_of_ranks(sor_type):
     # If "all", get combined Sum of Ranks
     if sor_type == SOR_TYPE_ALL:
         title = "Sum of Ranks – Combined"
-        singles  = get_user_site_rankings_all_sorted_single()
-        averages = get_user_site_rankings_all_sorted_average()
+        single_leaderboard  = SUM_OF_RANKS_ALL_SINGLE
+        average_leaderboard = SUM_OF_RANKS_ALL_AVERAGE
 
     # If "wca", get WCA Sum of Ranks
     elif sor_type == SOR_TYPE_WCA:
         title = "Sum of Ranks – WCA"
-        singles  = get_user_site_rankings_wca_sorted_single()
-        averages = get_user_site_rankings_wca_sorted_average()
+        single_leaderboard  = SUM_OF_RANKS_WCA_SINGLE
+        average_leaderboard = SUM_OF_RANKS_WCA_AVERAGE
 
     # Otherwise must be "non_wca", so get non-WCA Sum of Ranks
     else:
         title = "Sum of Ranks – Non-WCA"
-        singles  = get_user_site_rankings_non_wca_sorted_single()
-        averages = get_user_site_rankings_non_wca_sorted_average()
+        single_leaderboard  = SUM_OF_RANKS_NON_WCA_SINGLE
+        average_leaderboard = SUM_OF_RANKS_NON_WCA_AVERAGE
+
+    sor_by = SOR_BY_AVERAGE if request.args.get('by') == SOR_BY_AVERAGE else SOR_BY_SINGLE
+    page = request.args.get('page', 1, type=int)
+    username = current_user.username if current_user.is_authenticated else None
+
+    singles  = get_leaderboard_page(single_leaderboard, page if sor_by == SOR_BY_SINGLE else 1, username)
+    averages = get_leaderboard_page(average_leaderboard, page if sor_by == SOR_BY_AVERAGE else 1, username)
 
     return render_template("records/sum_of_ranks.html", title=title,\
         alternative_title="Sum of Ranks", sor_sorted_by_single=singles,\
-        sor_sorted_by_average=averages)
+        sor_sorted_by_average=averages, sor_by=sor_by)
@@ -2,19 +2,21 @@
 
 import json
 
+from collections import OrderedDict
 from http import HTTPStatus
 
 from flask import request
 from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
 
 from cubersio import app
 from cubersio.business.user_results.creation import process_event_results
 from cubersio.persistence.models import UserSolve, UserEventResults
 from cubersio.persistence.comp_manager import get_comp_event_by_id
 from cubersio.persistence.user_results_manager import save_event_results, get_event_results_for_user,\
-    delete_user_solve, delete_event_results, get_user_solve_for_scramble_id
+    delete_user_solve, delete_event_results, discard_unsaved_event_results, save_many_event_results
 from cubersio.util.events.mbld import MbldSolve
-from cubersio.routes.timer import timer_page
+from cubersio.routes.timer import timer_page, get_timer_page_live_refresh_info
 from cubersio.routes import api_login_required
 
 # -------------------------------------------------------------------------------------------------
@@ -39,6 +41,14 @@ EXPECTED_FIELDS   = (IS_DNF, IS_PLUS_TWO, SCRAMBLE_ID, COMP_EVENT_ID, CENTISECON
 
 COMMENT = 'comment'
 
+# The most SQL statements posting a solve should take, including re-reading everything the timer page needs
+# afterwards. Completing an event takes the most, since that's when PBs are worked out. This is enforced by the tests,
+# so if it needs to go up, make sure it's for a good reason, since this is the busiest write on the site.
+MAX_STATEMENTS_PER_SOLVE_POST = 23
+
+# The most solves which can be posted at once, which is enough for every event in a competition
+MAX_SOLVES_PER_BATCH = 250
+
 ERR_MSG_MISSING_INFO           = 'Some required information is missing from your solve.'
 ERR_MSG_NO_SUCH_EVENT          = "Can't find a competition event with ID {}."
 ERR_MSG_INACTIVE_COMP          = 'This event belongs to a competition which has ended.'
@@ -47,6 +57,8 @@ ERR_MSG_NO_SOLVE               = "Can't find solve with ID {} that belongs to {}
 ERR_MSG_NOT_VALID_FOR_FMC      = 'This operation is not valid for FMC!'
 ERR_MSG_NON_POSITIVE_TIME      = 'Solve time cannot be zero or negative!'
 ERR_MSG_MBLD_TOO_FEW_ATTEMPTED = "You must attempt at least 2 cubes for MBLD!"
+ERR_MSG_TOO_MANY_SOLVES        = 'No more than {} solves can be submitted at once.'
+ERR_MSG_SOLVES_CONFLICT        = 'Some of these solves were just saved by another request. Please try again.'
 
 # -------------------------------------------------------------------------------------------------
 # Below are routes called during standard usage of the timer pages
@@ -56,7 +68,12 @@ ERR_MSG_MBLD_TOO_FEW_ATTEMPTED = "You must attempt at least 2 cubes for MBLD!"
 @api_login_required
 def post_solve():
     """ Saves a solve. Ensures the user has UserEventResults for this event, associated this solve
-    with those results, and processes the results to make sure all relevant data is up-to-date. """
+    with those results, and processes the results to make sure all relevant data is up-to-date.
+
+    Everything is saved in one transaction, and it takes no more than `MAX_STATEMENTS_PER_SOLVE_POST`
+    statements. Posting a solve twice is harmless: the second one is ignored, either because the
+    solve is already in the user's results, or because the unique constraints on results and solves
+    stop a racing request from saving it again. """
 
     # Extract JSON solve data, deserialize to dict, and verify that all expected fields are present
     solve_data = json.loads(request.data)
@@ -77,12 +94,6 @@ def post_solve():
     if centiseconds <= 0:
         return (ERR_MSG_NON_POSITIVE_TIME, HTTPStatus.BAD_REQUEST)
 
-    # If the submitted solve is for a scramble the user already has a solve for,
-    # don't take any further action to persist a solve, just return. User probably
-    # is user manual time entry and pressed enter twice accidentally in quick succession
-    if get_user_solve_for_scramble_id(current_user.id, scramble_id):
-        return timer_page(comp_event_id, gather_info_for_live_refresh=True)
-
     # Retrieve the specified competition event
     comp_event = get_comp_event_by_id(comp_event_id)
     if not comp_event:
@@ -104,6 +115,12 @@ def post_solve():
         user_event_results = UserEventResults(comp_event_id=comp_event_id, user_id=current_user.id,
                                               comment='')
 
+    # If the submitted solve is for a scramble the user already has a solve for,
+    # don't take any further action to persist a solve, just return. User probably
+    # is user manual time entry and pressed enter twice accidentally in quick succession
+    if any(solve.scramble_id == scramble_id for solve in user_event_results.solves):
+        return timer_page(comp_event_id, gather_info_for_live_refresh=True)
+
     # Create the record for this solve and associate it with the user's event results
     solve = UserSolve(time=centiseconds, is_dnf=is_dnf, is_plus_two=is_plus_two,
                       scramble_id=scramble_id, is_inspection_dnf=is_inspection_dnf,
@@ -112,12 +129,103 @@ def post_solve():
 
     # Process through the user's event results, ensuring PB flags, best single, average, overall
     # event result, etc are all up-to-date.
-    process_event_results(user_event_results, comp_event, current_user)
-    save_event_results(user_event_results, comp_event.Event.id)
+    try:
+        process_event_results(user_event_results, comp_event, current_user)
+        save_event_results(user_event_results, comp_event.Event.id)
+
+    # Another request saved this same solve, or created these results, first. Nothing from this
+    # one is saved, and the timer page shows what the other one saved.
+    except IntegrityError:
+        discard_unsaved_event_results()
 
     return timer_page(comp_event_id, gather_info_for_live_refresh=True)
 
 
+@app.route('/post_solves', methods=['POST'])
+@api_login_required
+def post_solves():
+    """ Saves a batch of solves for one or more competition events, such as times entered manually
+    all at once, or recorded by the timer while offline. Every solve is checked before any of them
+    are saved, and then they're all saved in one transaction, processing each competition event's
+    results just once. Solves for scrambles the user already has solves for are ignored, the same
+    as for `post_solve`. Returns the timer page info for each competition event, by ID. """
+
+    # Extract JSON solves data, deserialize to a list of dicts, and verify that all expected fields
+    # are present in every one
+    solves_data = json.loads(request.data)
+    if not isinstance(solves_data, list) or not solves_data:
+        return (ERR_MSG_MISSING_INFO, HTTPStatus.BAD_REQUEST)
+    if not all(isinstance(solve_data, dict) and all(key in solve_data for key in EXPECTED_FIELDS)
+               for solve_data in solves_data):
+        return (ERR_MSG_MISSING_INFO, HTTPStatus.BAD_REQUEST)
+
+    if len(solves_data) > MAX_SOLVES_PER_BATCH:
+        return (ERR_MSG_TOO_MANY_SOLVES.format(MAX_SOLVES_PER_BATCH), HTTPStatus.BAD_REQUEST)
+
+    # If any solve time isn't positive, don't save any of the solves
+    if any(solve_data[CENTISECONDS] <= 0 for solve_data in solves_data):
+        return (ERR_MSG_NON_POSITIVE_TIME, HTTPStatus.BAD_REQUEST)
+
+    # Group the solves by competition event, keeping them in the order they were submitted
+    solves_by_comp_event_id = OrderedDict()
+    for solve_data in solves_data:
+        solves_by_comp_event_id.setdefault(solve_data[COMP_EVENT_ID], list()).append(solve_data)
+
+    # Check every competition event and its solves, and retrieve the user's results for each
+    results_by_comp_event = OrderedDict()
+    for comp_event_id, comp_event_solves_data in solves_by_comp_event_id.items():
+        comp_event = get_comp_event_by_id(comp_event_id)
+        if not comp_event:
+            return (ERR_MSG_NO_SUCH_EVENT.format(comp_event_id), HTTPStatus.NOT_FOUND)
+
+        if not comp_event.Competition.active:
+            return (ERR_MSG_INACTIVE_COMP, HTTPStatus.BAD_REQUEST)
+
+        if comp_event.Event.name == "MBLD":
+            if any(MbldSolve(solve_data[CENTISECONDS]).attempted < 2 for solve_data in comp_event_solves_data):
+                return (ERR_MSG_MBLD_TOO_FEW_ATTEMPTED, HTTPStatus.BAD_REQUEST)
+
+        user_event_results = get_event_results_for_user(comp_event_id, current_user)
+        if not user_event_results:
+            user_event_results = UserEventResults(comp_event_id=comp_event_id, user_id=current_user.id,
+                                                  comment='')
+
+        results_by_comp_event[comp_event] = user_event_results
+
+    try:
+        # Attach the new solves to the user's results, and then process through each set of results
+        # just once. Skip any solves for scrambles the user already has solves for, whether they were
+        # saved before or appear earlier in this batch.
+        for comp_event, user_event_results in results_by_comp_event.items():
+            solved_scramble_ids = set(solve.scramble_id for solve in user_event_results.solves)
+            for solve_data in solves_by_comp_event_id[comp_event.id]:
+                if solve_data[SCRAMBLE_ID] in solved_scramble_ids:
+                    continue
+                solved_scramble_ids.add(solve_data[SCRAMBLE_ID])
+
+                user_event_results.solves.append(UserSolve(time=solve_data[CENTISECONDS],
+                                                           is_dnf=solve_data[IS_DNF],
+                                                           is_plus_two=solve_data[IS_PLUS_TWO],
+                                                           scramble_id=solve_data[SCRAMBLE_ID],
+                                                           is_inspection_dnf=solve_data.get(IS_INSPECTION_DNF, False),
+                                                           fmc_explanation=solve_data.get(FMC_COMMENT, '')))
+
+            process_event_results(user_event_results, comp_event, current_user)
+
+        save_many_event_results([(user_event_results, comp_event.Event.id)
+                                 for comp_event, user_event_results in results_by_comp_event.items()])
+
+    # Another request saved some of these solves, or created some of these results, first. Nothing
+    # from this batch is saved, so it's safe to send the whole batch again.
+    except IntegrityError:
+        discard_unsaved_event_results()
+        return (ERR_MSG_SOLVES_CONFLICT, HTTPStatus.CONFLICT)
+
+    # Everything was expired by saving, so retrieve each competition event again for the timer page info
+    return json.dumps({comp_event_id: get_timer_page_live_refresh_info(get_comp_event_by_id(comp_event_id))
+                       for comp_event_id in solves_by_comp_event_id})
+
+
 @app.route('/toggle_prev_penalty', methods=['POST'])
 @api_login_required
 def toggle_prev_penalty():
@@ -1,19 +1,21 @@
 """ Routes related to displaying competition results. """
 
+from http import HTTPStatus
+
 from arrow import now
 
 from flask import render_template, redirect
 from flask_login import current_user
 
 from cubersio import app
-from cubersio.business.user_results import set_medals_on_best_event_results
-from cubersio.business.user_results.personal_bests import recalculate_user_pbs_for_event
+from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard
+from cubersio.business.competition.snapshots import get_competition_events_info, get_frozen_overall_points
+from cubersio.business.overall_points import get_overall_points
 from cubersio.persistence.comp_manager import get_active_competition, get_complete_competitions,\
-    get_previous_competition, get_competition, get_all_comp_events_for_comp, get_comp_event_by_id
-from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event,\
-    blacklist_results, unblacklist_results, UserEventResultsDoesNotExistException
-from cubersio.util.sorting import sort_user_results_with_rankings
-from cubersio.util.events.resources import sort_comp_events_by_global_sort_order
+    get_previous_competition, get_competition, get_comp_event_by_id
+from cubersio.persistence.user_results_manager import blacklist_results, unblacklist_results,\
+    UserEventResultsDoesNotExistException
+from cubersio.tasks.recalculation import queue_user_pbs_recalculation, queue_comp_event_medals_recalculation
 
 # -------------------------------------------------------------------------------------------------
 
@@ -30,24 +32,12 @@ def comp_results(comp_id):
         msg = "Oops, that's not a real competition. Try again, ya clown."
         return render_template('error.html', error_message=msg)
 
-    comp_events = get_all_comp_events_for_comp(comp_id)
-    comp_events = sort_comp_events_by_global_sort_order(comp_events)
-
-    events_names_ids = list()
-    id_3x3 = None
-    for comp_event in comp_events:
-        if comp_event.Event.name == '3x3':
-            id_3x3 = comp_event.id
-        events_names_ids.append({
-            'name':          comp_event.Event.name,
-            'comp_event_id': comp_event.id,
-            'event_id':      comp_event.Event.id,
-        })
+    events_info = get_competition_events_info(comp_id)
 
     alternative_title = "{} leaderboards".format(competition.title)
 
     return render_template("results/results_comp.html", alternative_title=alternative_title,
-        events_names_ids=events_names_ids, id_3x3=id_3x3, comp_id=comp_id)
+        events_names_ids=events_info.events_names_ids, id_3x3=events_info.id_3x3, comp_id=comp_id)
 
 
 @app.route('/compevent/<comp_event_id>/')
@@ -66,68 +56,27 @@ def comp_event_results(comp_event_id):
     # and also apply additional styling on blacklisted results to make them easier to see
     show_admin = current_user.is_admin
 
-    # Store the scrambles so we can show those too
-    scrambles = [s.scramble for s in comp_event.scrambles]
-
-    results = get_all_complete_user_results_for_comp_event(comp_event_id, omit_blacklisted=False)
-    results = list(results)  # take out of the SQLAlchemy BaseQuery and put into a simple list
-
-    if not results:
+    leaderboard = get_comp_event_leaderboard(comp_event)
+    if not leaderboard.rows:
         return "Nobody has participated in this event yet. Maybe you'll be the first!"
 
-    results = filter_blacklisted_results(results, show_admin, current_user)
-
-    # Split the times string into components, add to a list called `"solves_helper` which
-    # is used in the UI to show individual solves, and make sure the length == 5, filled
-    # with empty strings if necessary
-    # TODO put this in business logic somewhere
-    for result in results:
-        if comp_event.Event.name == 'FMC':
-            solves_helper = list()
-            for i, solve in enumerate(result.solves):
-                scramble = solve.Scramble.scramble
-                solution = solve.fmc_explanation
-                moves    = solve.get_friendly_time()
-                solves_helper.append((scramble, solution, moves))
-            while len(solves_helper) < 5:
-                solves_helper.append((None, None, None))
-        else:
-            solves_helper = result.times_string.split(', ')
-            while len(solves_helper) < 5:
-                solves_helper.append('')
-        setattr(result, 'solves_helper', solves_helper)
-
-    # Sort the results
-    results_with_ranks = sort_user_results_with_rankings(results, comp_event.Event.eventFormat)
+    # Admins see all results, non-logged viewers see no blacklisted results, and logged-in viewers
+    # only see their own
+    username = current_user.username if current_user.is_authenticated else None
+    results_with_ranks = leaderboard.ranked_rows(show_blacklisted=show_admin, username=username)
 
     return render_template("results/comp_event_table.html", results=results_with_ranks,
-        comp_event=comp_event, show_admin=show_admin, scrambles=scrambles)
+        comp_event=comp_event, show_admin=show_admin, scrambles=leaderboard.scrambles)
 
 
 def get_overall_performance_data(comp_id):
-    """ TODO: comment """
-
-    user_points = dict()
-
-    for comp_event in get_all_comp_events_for_comp(comp_id):
-        results = list(get_all_complete_user_results_for_comp_event(comp_event.id))
-
-        # If nobody has participated in this particular comp event, skip performing the sorting
-        # and ranking. Ranking package doesn't like empty iterables.
-        if not results:
-            continue
-
-        results_with_ranks = sort_user_results_with_rankings(results, comp_event.Event.eventFormat)
+    """ Renders the overall points leaderboard for the specified competition, where each event
+    gives everybody who took part in it (number of participants - place) points. """
 
-        total_participants = len(results)
-        for i, _, result in results_with_ranks:
-            username = result.User.username
-            if username not in user_points.keys():
-                user_points[username] = 0
-            user_points[username] += (total_participants - i)
-
-    user_points = [(username, points) for username, points in user_points.items()]
-    user_points.sort(key=lambda x: x[1], reverse=True)
+    # Finished competitions have their overall points frozen, as long as none of their results have changed since
+    user_points = get_frozen_overall_points(comp_id)
+    if user_points is None:
+        user_points = get_overall_points(comp_id)
 
     if not user_points:
         return "Nobody has participated in anything yet this week?"
@@ -176,14 +125,8 @@ def blacklist(results_id):
         note = DEFAULT_BLACKLIST_NOTE.format(username=actor, date=timestamp)
         results = blacklist_results(results_id, note)
 
-        # Recalculate PBs just for the affected user and event
-        recalculate_user_pbs_for_event(results.user_id, results.CompetitionEvent.event_id)
-
-        # Recalculate podiums for this comp and event if the competition isn't active
-        if not results.CompetitionEvent.Competition.active:
-            set_medals_on_best_event_results([results.CompetitionEvent])
-
-        return ('', 204)
+        __queue_recalculations(results)
+        return ('', HTTPStatus.ACCEPTED)
 
     except UserEventResultsDoesNotExistException as ex:
         return (str(ex), 500)
@@ -203,14 +146,8 @@ def unblacklist(results_id):
     try:
         results = unblacklist_results(results_id)
 
-        # Recalculate PBs just for the affected user and event
-        recalculate_user_pbs_for_event(results.user_id, results.CompetitionEvent.event_id)
-
-        # Recalculate podiums for this comp and event if the competition isn't active
-        if not results.CompetitionEvent.Competition.active:
-            set_medals_on_best_event_results([results.CompetitionEvent])
-
-        return ('', 204)
+        __queue_recalculations(results)
+        return ('', HTTPStatus.ACCEPTED)
 
     except UserEventResultsDoesNotExistException as ex:
         return (str(ex), 500)
@@ -218,18 +155,13 @@ def unblacklist(results_id):
     except Exception as ex:
         return (str(ex), 500)
 
-# -------------------------------------------------------------------------------------------------
-
-def filter_blacklisted_results(results, show_admin, curr_user):
-    """ Filters out the appropriate blacklisted results depending on who is viewing the page.
-    Admins see all results, non-logged viewers see no blacklisted results, and logged-in viewers
-    only see their own. """
 
-    if show_admin:
-        return results
+def __queue_recalculations(results):
+    """ Queues recalculating the PBs for the affected user and event, and the podiums for the
+    competition event if the competition isn't active, rather than making the admin wait for them.
+    `/admin/api/pending_recalculations/` shows when they're done. """
 
-    if not curr_user.is_authenticated:
-        return [r for r in results if not r.is_blacklisted]
+    queue_user_pbs_recalculation(results.user_id, results.CompetitionEvent.event_id)
 
-    target_username = curr_user.username
-    return [r for r in results if (not r.is_blacklisted) or (r.User.username == target_username)]
+    if not results.CompetitionEvent.Competition.active:
+        queue_comp_event_medals_recalculation(results.comp_event_id)
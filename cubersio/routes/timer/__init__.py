@@ -1 +1 @@
-from .timer_routes import timer_page  # noqa
+from .timer_routes import timer_page, get_timer_page_live_refresh_info  # noqa
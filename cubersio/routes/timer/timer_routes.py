@@ -7,6 +7,7 @@ from flask import render_template, request
 from flask_login import current_user
 
 from cubersio import app
+from cubersio.business.rank_index import get_site_ranks
 from cubersio.persistence.models import EventFormat
 from cubersio.persistence.comp_manager import get_comp_event_by_id
 from cubersio.persistence.settings_manager import SettingCode, SettingType, TRUE_STR,\
@@ -83,6 +84,8 @@ MSG_RESULTS_COMPLETE_PB_SINGLE  = "{excl}!\nYou've finished {event_name} with a
 MSG_RESULTS_COMPLETE_PB_AVERAGE = "{excl}!\nYou've finished {event_name} with a PB average of {result}!"
 MSG_RESULTS_DNF                 = "You've finished {event_name} with a DNF result.\n{encouragement}"
 MSG_RESULTS_DNF_EMOJI           = "{emoji}"
+MSG_SITE_RANK                   = " That's #{rank} on the site."
+MSG_SITE_RANKS                  = " That's #{average_rank} on the site for average, and #{single_rank} for single."
 
 EVENT_FORMAT_RESULTS_TYPE_MAP = {
     EventFormat.Bo3: 'a best single',
@@ -112,6 +115,42 @@ def timer_page(comp_event_id, gather_info_for_live_refresh=False):
     if not comp.active:
         return (ERR_MSG_INACTIVE_COMP, 400)
 
+    if gather_info_for_live_refresh:
+        # Only a caller coming from one of the persistence routes should go through this path.
+        return json.dumps(get_timer_page_live_refresh_info(comp_event))
+
+    return render_template(TIMER_TEMPLATE_MOBILE_MAP[request.MOBILE], comp_event_id=comp_event_id,
+        **__gather_timer_page_info(comp_event))
+
+
+def get_timer_page_live_refresh_info(comp_event):
+    """ Builds up a dictionary of relevant information so the timer page for the specified competition
+    event can be re-rendered with up-to-date information about the state of the timer page, after the
+    user's results have changed. """
+
+    info = __gather_timer_page_info(comp_event)
+    return {
+        'button_state_info': info['button_states'],
+        'scramble_text':     info['scramble_text'],
+        'scramble_id':       info['scramble_id'],
+        'user_solves':       info['user_solves'],
+        'last_seconds':      info['last_seconds'],
+        'last_centis':       info['last_centis'],
+        'hide_timer_dot':    info['hide_timer_dot'],
+        'is_complete':       info['is_complete'],
+        'comment':           info['comment'],
+        'last_solve':        info['last_solve']
+    }
+
+# -------------------------------------------------------------------------------------------------
+
+def __gather_timer_page_info(comp_event):
+    """ Gathers up everything needed to render the timer page for the specified competition event,
+    for the current user. """
+
+    comp = comp_event.Competition
+    comp_event_id = comp_event.id
+
     event_name = comp_event.Event.name
     event_format = comp_event.Event.eventFormat
     event_description = comp_event.Event.description
@@ -153,7 +192,7 @@ def timer_page(comp_event_id, gather_info_for_live_refresh=False):
     # Determine the scramble ID, scramble text, and index for the next unsolved scramble.
     # If all solves are done, substitute in some sort of message in place of the scramble text
     scramble_info = __determine_scramble_id_text_index(user_results, user_solves,
-                                                       comp_event.scrambles, event_name,
+                                                       comp_event.scrambles, comp_event.Event.id, event_name,
                                                        event_format)
     scramble_id, scramble_text, scramble_index = scramble_info
 
@@ -178,34 +217,27 @@ def timer_page(comp_event_id, gather_info_for_live_refresh=False):
     # Determine the timer page subtype (timer, manual time entry, FMC manual entry, or MBLD)
     page_subtype = __determine_page_subtype(event_name, settings)
 
-    if gather_info_for_live_refresh:
-        # Only a caller coming from one of the persistence routes should go through this path.
-        # Build up a dictionary of relevant information so the timer page can be re-rendered
-        # with up-to-date information about the state of the timer page
-        timer_page_render_info = {
-            'button_state_info': button_state_info,
-            'scramble_text':     scramble_text,
-            'scramble_id':       scramble_id,
-            'user_solves':       user_solves,
-            'last_seconds':      last_seconds,
-            'last_centis':       last_centis,
-            'hide_timer_dot':    hide_timer_dot,
-            'is_complete':       is_complete,
-            'comment':           comment,
-            'last_solve':        last_solve
-        }
-        return json.dumps(timer_page_render_info)
-
-    return render_template(TIMER_TEMPLATE_MOBILE_MAP[request.MOBILE], scramble_text=scramble_text,
-        scramble_id=scramble_id, comp_event_id=comp_event_id, event_name=event_name,
-        alternative_title=alternative_title, user_solves=user_solves, button_states=button_state_info,
-        show_scramble_preview=show_scramble_preview, last_solve=last_solve, last_seconds=last_seconds,
-        last_centis=last_centis, hide_timer_dot=hide_timer_dot, comment=comment,
-        is_complete=is_complete, settings=settings, page_subtype=page_subtype,
-        hide_scramble_preview=hide_scramble_preview, show_shapes_background=show_shapes_background,
-        event_description=event_description)
+    return {
+        'scramble_text':          scramble_text,
+        'scramble_id':            scramble_id,
+        'event_name':             event_name,
+        'alternative_title':      alternative_title,
+        'user_solves':            user_solves,
+        'button_states':          button_state_info,
+        'show_scramble_preview':  show_scramble_preview,
+        'last_solve':             last_solve,
+        'last_seconds':           last_seconds,
+        'last_centis':            last_centis,
+        'hide_timer_dot':         hide_timer_dot,
+        'comment':                comment,
+        'is_complete':            is_complete,
+        'settings':               settings,
+        'page_subtype':           page_subtype,
+        'hide_scramble_preview':  hide_scramble_preview,
+        'show_shapes_background': show_shapes_background,
+        'event_description':      event_description,
+    }
 
-# -------------------------------------------------------------------------------------------------
 
 def __build_user_solves_list(user_results, event_total_solves, scrambles):
     """ Returns a list in user-readable form of the user's current solves as a list of
@@ -243,7 +275,7 @@ def __determine_is_complete(is_complete_flag, event_format, num_solves_completed
     return is_complete_flag
 
 
-def __determine_scramble_id_text_index(user_results, user_solves_list, scrambles, event_name,
+def __determine_scramble_id_text_index(user_results, user_solves_list, scrambles, event_id, event_name,
                                        event_format):
     """ Based on the user's current results, and the list of scrambles for this competition event,
     determine the "active" scramble ID and its text. """
@@ -267,7 +299,7 @@ def __determine_scramble_id_text_index(user_results, user_solves_list, scrambles
     # Instead of scramble text, return a message indicating they're done, possibly
     # with some additional info about PBs or whatever.
     if first_unsolved_idx == -1:
-        scramble_text = __build_done_message(user_results, event_name, event_format)
+        scramble_text = __build_done_message(user_results, event_id, event_name, event_format)
         scramble_id = -1
 
     # Otherwise grab the scramble ID and text of the next unsolved scramble
@@ -359,31 +391,45 @@ def __determine_page_subtype(event_name, settings):
     return SUBTYPE_MANUAL if settings[SettingCode.DEFAULT_TO_MANUAL_TIME] else SUBTYPE_TIMER
 
 
-def __build_done_message(user_results, event_name, event_format):
+def __build_done_message(user_results, event_id, event_name, event_format):
     """ Builds a message to display to the user about their complete results.
-    Mention PBs if any. """
+    Mention PBs if any, and where they rank on the site. """
+
+    if user_results.was_pb_single or user_results.was_pb_average:
+        single_rank, average_rank = get_site_ranks(event_id,
+            single=user_results.single if user_results.was_pb_single else None,
+            average=user_results.average if user_results.was_pb_average else None)
 
     if user_results.was_pb_single and user_results.was_pb_average:
-        return MSG_RESULTS_COMPLETE_TWO_PBS.format(
+        message = MSG_RESULTS_COMPLETE_TWO_PBS.format(
             excl=random_choice(EXCLAMATIONS),
             event_name=event_name,
             average=user_results.friendly_average(),
             single=user_results.friendly_single()
         )
+        if single_rank and average_rank:
+            message += MSG_SITE_RANKS.format(average_rank=average_rank, single_rank=single_rank)
+        return message
 
     if user_results.was_pb_single:
-        return MSG_RESULTS_COMPLETE_PB_SINGLE.format(
+        message = MSG_RESULTS_COMPLETE_PB_SINGLE.format(
             excl=random_choice(EXCLAMATIONS),
             event_name=event_name,
             result=user_results.friendly_single()
         )
+        if single_rank:
+            message += MSG_SITE_RANK.format(rank=single_rank)
+        return message
 
     if user_results.was_pb_average:
-        return MSG_RESULTS_COMPLETE_PB_AVERAGE.format(
+        message = MSG_RESULTS_COMPLETE_PB_AVERAGE.format(
             excl=random_choice(EXCLAMATIONS),
             event_name=event_name,
             result=user_results.friendly_average()
         )
+        if average_rank:
+            message += MSG_SITE_RANK.format(rank=average_rank)
+        return message
 
     if user_results.friendly_result() == 'DNF':
         if random_choice(range(100)) < 20:
@@ -8,10 +8,10 @@ from flask import render_template, redirect, url_for
 from flask_login import current_user
 
 from cubersio import app
-from cubersio.util.events.resources import sort_events_by_global_sort_order
-from cubersio.persistence.events_manager import get_all_events
+from cubersio.persistence.events_manager import get_all_event_metadata_in_sort_order
 from cubersio.persistence.user_manager import get_user_by_username, get_all_active_usernames
-from cubersio.persistence.user_site_rankings_manager import get_site_rankings_for_user
+from cubersio.persistence.user_site_rankings_manager import get_site_rankings_for_user,\
+    get_event_site_rankings_for_user
 from cubersio.persistence.user_results_manager import get_user_completed_solves_count, get_user_medals_count
 from cubersio.persistence.comp_manager import get_user_participated_competitions_count
 
@@ -63,7 +63,7 @@ def __render_versus_page_for_users(user1, user2, errors):
 
     # Get a map of event ID to event name, to facilitate rendering the template.
     # Sort it by the global sort order so the event records table has the same ordering as everywhere else.
-    all_sorted_events = sort_events_by_global_sort_order(get_all_events())
+    all_sorted_events = get_all_event_metadata_in_sort_order()
     event_id_name_map = {e.id: e.name for e in all_sorted_events}
 
     # Get site rankings info for both users.
@@ -136,7 +136,7 @@ def __get_user_site_rankings(user_id):
 
     # Get a map of event ID to event name, to facilitate rendering the template.
     # Sort it by the global sort order so the event records table has the same ordering as everywhere else.
-    all_sorted_events = sort_events_by_global_sort_order(get_all_events())
+    all_sorted_events = get_all_event_metadata_in_sort_order()
     event_id_name_map = {e.id: e.name for e in all_sorted_events}
 
     site_rankings = dict()
@@ -146,7 +146,7 @@ def __get_user_site_rankings(user_id):
     site_rankings_record = get_site_rankings_for_user(user_id)
     if site_rankings_record:
         # TODO -- get the raw site rankings record back, sort those, then convert to dict for front-end
-        site_rankings = site_rankings_record.get_site_rankings_and_pbs()
+        site_rankings = get_event_site_rankings_for_user(user_id)
 
     # Iterate over all events, making sure there's an entry in the user site rankings for everything,
     # even events they haven't participated in, in case the other user has done that event.
@@ -1,5 +1,6 @@
 """ Core task setup. """
 
 from .competition_management import *
+from .recalculation import *
 from .reddit import *
 from .scramble_generation import *
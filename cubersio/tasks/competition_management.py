@@ -1,16 +1,17 @@
 """ Tasks related to creating and scoring competitions. """
 
 from huey import crontab
+from huey.exceptions import TaskLockedException
 
 from cubersio import app
 from cubersio.business.rankings import calculate_user_site_rankings
-from cubersio.business.user_results import set_medals_on_best_event_results
-from cubersio.persistence.comp_manager import get_active_competition, get_all_comp_events_for_comp
-from cubersio.persistence.events_manager import get_all_events
-from cubersio.persistence.user_manager import get_all_users
-from cubersio.persistence.user_results_manager import calculate_latest_user_pbs_for_event
+from cubersio.business.user_results.personal_bests import recalculate_all_pbs
+from cubersio.persistence.comp_manager import get_active_competition
 from cubersio.business.competition.generation import generate_new_competition
+from cubersio.business.competition.results_digest import build_results_digest
 from cubersio.business.competition.scoring import post_results_thread
+from cubersio.business.competition.snapshots import freeze_competition
+from cubersio.business.overall_points import refresh_overall_points
 from cubersio.tasks.reddit import prepare_new_competition_notification,\
     prepare_end_of_competition_info_notifications
 
@@ -22,12 +23,21 @@ if app.config['IS_DEVO']:
     # don't run as periodic in devo
     WRAP_WEEKLY_COMP_SCHEDULE = lambda _ : False
     RUN_RANKINGS_SCHEDULE = lambda _ : False
+    RUN_INCREMENTAL_RANKINGS_SCHEDULE = lambda _ : False
 
 else:
     # Run the rankings task several hours after the comp stuff. I think we're having memory issues.
     WRAP_WEEKLY_COMP_SCHEDULE = crontab(day_of_week='1', hour='2', minute='0')
     RUN_RANKINGS_SCHEDULE = crontab(day_of_week='1', hour='6', minute='0')
 
+    # Incremental rankings only re-rank events with changed results, so they're cheap enough to keep fresh hourly. The
+    # weekly full run above stays as a safety net.
+    RUN_INCREMENTAL_RANKINGS_SCHEDULE = crontab(minute='30')
+
+# Only the events whose results have changed since the last refresh are ranked again, so the current competition's
+# overall points are cheap enough to keep fresh every minute, rather than working them out whenever they're read
+REFRESH_OVERALL_POINTS_SCHEDULE = crontab(minute='*/1')
+
 # -------------------------------------------------------------------------------------------------
 
 @huey.periodic_task(crontab(minute="*/5"))
@@ -42,15 +52,40 @@ def run_weekly_site_rankings():
         run_user_site_rankings()
 
 
+@huey.periodic_task(RUN_INCREMENTAL_RANKINGS_SCHEDULE)
+def run_hourly_incremental_site_rankings():
+    """ A periodic task to re-rank just the events with changed results every hour. """
+    with app.app_context():
+        run_user_site_rankings(incremental=True)
+
+
+@huey.periodic_task(REFRESH_OVERALL_POINTS_SCHEDULE)
+def refresh_current_competition_overall_points():
+    """ A periodic task to keep the current competition's overall points up to date with its results. """
+    with app.app_context():
+        competition = get_active_competition()
+        if competition:
+            refresh_overall_points(competition.id)
+
+
 @huey.task()
-def run_user_site_rankings():
+def run_user_site_rankings(incremental=False):
     """ A task to run the calculations to update user site rankings based on the latest data. """
     with app.app_context():
-        # Let's keep the timing stuff handy, I want to probably send this via Reddit PM later
-        # start = utcnow()
-        # user_count = get_user_count()
-        calculate_user_site_rankings()
-        # end = utcnow()
+        # Don't let a full run and an incremental run step on each other's toes. If one's already running, just skip
+        # this one, anything it would've picked up will be picked up by the next. The lock never expires, so the
+        # consumer has to be started with -f to flush it, in case a run was killed part way through while holding it.
+        try:
+            with huey.lock_task('site_rankings'):
+                # Let's keep the timing stuff handy, I want to probably send this via Reddit PM later
+                # start = utcnow()
+                # user_count = get_user_count()
+                calculate_user_site_rankings(incremental=incremental)
+                # end = utcnow()
+        except TaskLockedException:
+            run_type = 'incremental' if incremental else 'full'
+            print(f"[RANKINGS] Site rankings are already being calculated, skipping this {run_type} run. If no run " +
+                  "is in progress, the consumer was stopped during one, and needs restarting with -f to release it.")
 
 
 @huey.periodic_task(WRAP_WEEKLY_COMP_SCHEDULE)
@@ -61,12 +96,14 @@ def wrap_weekly_competition():
     with app.app_context():
         current_comp = get_active_competition()
 
-        comp_events_in_comp = get_all_comp_events_for_comp(current_comp.id)
-        set_medals_on_best_event_results(comp_events_in_comp)
+        # Rank the competition's results just once, awarding the medals, into a digest which the tasks
+        # below all work from
+        build_results_digest(current_comp.id)
 
         post_results_thread_task(current_comp.id)
         prepare_end_of_competition_info_notifications(current_comp.id)
         generate_new_competition_task()
+        freeze_competition_task(current_comp.id)
 
 
 @huey.task()
@@ -85,14 +122,15 @@ def generate_new_competition_task():
 
 
 @huey.task()
-def update_pbs():
+def freeze_competition_task(comp_id):
+    """ A task to freeze a finished competition's leaderboards into snapshots. """
     with app.app_context():
-        all_users = get_all_users()
-        user_count = len(all_users)
+        freeze_competition(comp_id)
 
-        all_events = get_all_events()
 
-        for i, user in enumerate(all_users):
-            print("Calculating latest PBs for {} ({}/{})".format(user.username, i + 1, user_count))
-            for event in all_events:
-                calculate_latest_user_pbs_for_event(user.id, event.id)
+@huey.task()
+def update_pbs():
+    """ A task to work out the latest PB averages and singles for every user and every event type. """
+    with app.app_context():
+        changed_count = recalculate_all_pbs(latest_only=True)
+        print("Calculated latest PBs, flags changed on {} results".format(changed_count))
@@ -0,0 +1,83 @@
+""" Tasks related to recalculating data derived from users' results, like PBs and medals, after
+those results have been moderated. """
+
+from cubersio import app, DB
+from cubersio.business.competition.snapshots import refreeze_comp_event
+from cubersio.business.user_results import set_medals_on_best_event_results
+from cubersio.business.user_results.personal_bests import recalculate_user_pbs_for_event
+from cubersio.persistence.comp_manager import get_comp_event_by_id
+from cubersio.persistence.pending_recalculations_manager import request_recalculation,\
+    get_pending_recalculation_generation, finish_recalculation, user_event_pbs_recalculation_key,\
+    comp_event_medals_recalculation_key
+
+from queue_config import huey
+
+# -------------------------------------------------------------------------------------------------
+
+def queue_user_pbs_recalculation(user_id, event_id):
+    """ Queues a task to recalculate the user's PBs for the event, unless one is already queued, in
+    which case that task picks up this request too. """
+
+    if __request_recalculation(user_event_pbs_recalculation_key(user_id, event_id)):
+        recalculate_user_pbs_task(user_id, event_id)
+
+
+def queue_comp_event_medals_recalculation(comp_event_id):
+    """ Queues a task to recalculate the medals for the competition event, unless one is already
+    queued, in which case that task picks up this request too. """
+
+    if __request_recalculation(comp_event_medals_recalculation_key(comp_event_id)):
+        recalculate_comp_event_medals_task(comp_event_id)
+
+
+@huey.task()
+def recalculate_user_pbs_task(user_id, event_id):
+    """ A task to recalculate the user's PBs for the event, until nothing's asked for them to be
+    recalculated again in the meantime. """
+    with app.app_context():
+        __recalculate_until_consistent(user_event_pbs_recalculation_key(user_id, event_id),
+                                       lambda: recalculate_user_pbs_for_event(user_id, event_id))
+
+
+@huey.task()
+def recalculate_comp_event_medals_task(comp_event_id):
+    """ A task to recalculate the medals for the competition event, until nothing's asked for them
+    to be recalculated again in the meantime. """
+    with app.app_context():
+        __recalculate_until_consistent(comp_event_medals_recalculation_key(comp_event_id),
+                                       lambda: __recalculate_medals(comp_event_id))
+
+
+def __recalculate_medals(comp_event_id):
+    """ Recalculates the medals for the competition event, and since its competition is over,
+    freezes its leaderboard again now its results have changed. """
+
+    comp_event = get_comp_event_by_id(comp_event_id)
+    set_medals_on_best_event_results([comp_event])
+    refreeze_comp_event(comp_event)
+
+
+def __request_recalculation(key):
+    """ Records that the data for the specified key needs recalculating, and returns whether a task
+    needs to be queued to do it. This is committed before the task is queued, so the task is sure
+    to see it. """
+
+    needs_task = request_recalculation(key)
+    DB.session.commit()
+
+    return needs_task
+
+
+def __recalculate_until_consistent(key, recalculate):
+    """ Recalculates the data for the specified key, and then marks it as no longer pending. If it
+    was requested again while recalculating, whatever prompted that might have been missed, so it's
+    recalculated again until it wasn't. """
+
+    while True:
+        generation = get_pending_recalculation_generation(key)
+        if generation is None:
+            return
+
+        recalculate()
+        if finish_recalculation(key, generation):
+            return
@@ -1,7 +1,7 @@
 """ Tasks related to interacting with Reddit. """
 
 from cubersio import app
-from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_and_user
+from cubersio.business.competition.results_digest import get_results_digest
 from cubersio.persistence.comp_manager import get_competition, get_all_comp_events_for_comp,\
     get_reddit_participants_in_competition
 from cubersio.persistence.user_manager import get_user_by_id
@@ -121,37 +121,19 @@ def prepare_end_of_competition_info_notifications(comp_id):
         user_ids_to_notify = list(set(users_in_comp) & set(opted_in))
 
         comp_title = get_competition(comp_id).title
+        digest = get_results_digest(comp_id)
 
         for user_id in user_ids_to_notify:
-            send_end_of_competition_message(user_id, comp_id, comp_title)
+            send_end_of_competition_message(comp_title, digest.users[user_id])
 
 
 @huey.task()
-def send_end_of_competition_message(user_id, comp_id, comp_title):
-    """ Sends a report to the specified user with info about their participation in the
-    competition. """
+def send_end_of_competition_message(comp_title, user_digest):
+    """ Sends a report to the user with info about their participation in the competition, from
+    their summary in the competition's results digest. """
     with app.app_context():
-        user = get_user_by_id(user_id)
-        all_results = get_all_complete_user_results_for_comp_and_user(comp_id, user_id, include_blacklisted=False)
-
-        total_solves = 0
-        events_with_pbs = list()
-        events_with_podium = list()
-        total_events_participated_in = len(all_results)
-
-        for event_results in all_results:
-            if event_results.was_bronze_medal:
-                medal_desc = "{} (bronze)".format(event_results.CompetitionEvent.Event.name)
-                events_with_podium.append(medal_desc)
-            if event_results.was_silver_medal:
-                medal_desc = "{} (silver)".format(event_results.CompetitionEvent.Event.name)
-                events_with_podium.append(medal_desc)
-            if event_results.was_gold_medal:
-                medal_desc = "{} (gold)".format(event_results.CompetitionEvent.Event.name)
-                events_with_podium.append(medal_desc)
-            if event_results.was_pb_average or event_results.was_pb_single:
-                events_with_pbs.append(event_results.CompetitionEvent.Event.name)
-            total_solves += len(event_results.solves)
+        events_with_podium = ["{} ({})".format(event_name, medal) for event_name, medal in user_digest.podiums]
+        events_with_pbs = user_digest.pb_events
 
         podium_info = ''
         if events_with_podium:
@@ -165,10 +147,10 @@ def send_end_of_competition_message(user_id, comp_id, comp_title):
             pb_info = PB_INFO_TEMPLATE.format(pb_events_list=pb_events_list, maybe_pluralized_pbs=maybe_pluralized_pbs)
 
         message_body = END_OF_COMP_BODY_TEMPLATE.format(
-            username=user.username,
+            username=user_digest.username,
             comp_title=comp_title,
-            event_count=total_events_participated_in,
-            solves_count=total_solves,
+            event_count=user_digest.events_count,
+            solves_count=user_digest.solves_count,
             pb_info=pb_info,
             podium_info=podium_info,
             opt_out_info=OPT_OUT_INFO
@@ -176,4 +158,4 @@ def send_end_of_competition_message(user_id, comp_id, comp_title):
 
         message_title = END_OF_COMP_TITLE_TEMPLATE.format(comp_title=comp_title)
 
-        send_pm_to_user(user.username, message_title, message_body)
+        send_pm_to_user(user_digest.username, message_title, message_body)
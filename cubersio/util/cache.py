@@ -0,0 +1,76 @@
+""" Utilities for caching data in-process. """
+
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Any, Callable, Hashable
+
+# -------------------------------------------------------------------------------------------------
+
+class GenerationalCache:
+    """ An in-process cache where each value is only good for the generation of the data it was built from. Looking a
+    value up with any other generation rebuilds it, so as long as the generation is bumped whenever the data changes,
+    every process picks up the change on its next lookup without having to be told.
+
+    Only one thread at a time builds the value for a key and generation. Any others looking it up in the meantime wait
+    for that value rather than building it again themselves.
+
+    Holds at most `max_entries` values, evicting the least recently used ones. """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._loads = dict()
+        self._lock = Lock()
+
+
+    def get(self, key: Hashable, generation: int, loader: Callable[[], Any]) -> Any:
+        """ Returns the value cached for the key at the specified generation, or else calls `loader` to build it and
+        caches that instead. If another thread is already building it, waits for that instead. """
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == generation:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+
+                load = self._loads.get((key, generation))
+                is_loading_here = load is None
+                if is_loading_here:
+                    load = self._loads[(key, generation)] = _Load()
+
+            if is_loading_here:
+                return self._load(key, generation, loader, load)
+
+            # If the thread building it failed, go around again and try building it here instead
+            load.done.wait()
+            if load.succeeded:
+                return load.value
+
+
+    def _load(self, key: Hashable, generation: int, loader: Callable[[], Any], load: '_Load') -> Any:
+        """ Builds the value for the key and generation, caches it, and hands it to any threads waiting on it. """
+
+        try:
+            load.value = loader()
+            load.succeeded = True
+        finally:
+            with self._lock:
+                del self._loads[(key, generation)]
+                if load.succeeded:
+                    self._entries[key] = (generation, load.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self._max_entries:
+                        self._entries.popitem(last=False)
+            load.done.set()
+
+        return load.value
+
+
+class _Load:
+    """ A value being built for a GenerationalCache, which other threads wanting it can wait on. """
+
+    def __init__(self):
+        self.done = Event()
+        self.succeeded = False
+        self.value = None
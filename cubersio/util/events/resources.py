@@ -264,6 +264,17 @@ def sort_events_by_global_sort_order(events: List[Event]) -> List[Event]:
     return ordered_events
 
 
+def get_global_sort_position(event_name: str) -> Optional[int]:
+    """ Returns the position of the specified event in the global event order defined above, or None if it's not in
+    there. """
+
+    for i, event in enumerate(__GLOBAL_SORT_ORDER):
+        if event.name == event_name:
+            return i
+
+    return None
+
+
 def get_bonus_events_rotation_starting_at(starting_index: int, count: int = 5) -> List[BonusEventDefinition]:
     """ Gets a list of `count` bonus events starting at the specified index. Use a doubled list
     of bonus events as a 'trick' to wrap around to the beginning if the starting index and count
@@ -0,0 +1,175 @@
+""" Utilities for instrumenting long-running jobs, phase by phase. """
+
+from contextlib import contextmanager
+import threading
+from timeit import default_timer
+import tracemalloc
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import event
+
+from cubersio import DB
+
+# -------------------------------------------------------------------------------------------------
+
+class PhaseStats:
+    """ The instrumentation data for one phase of a job: the wall time spent in it, how much of that was spent executing
+    database statements, how many rows it processed, and the peak memory allocated while it ran, as traced by
+    tracemalloc, if memory is being traced. A phase that's entered more than once accumulates.
+
+    Database time only counts executing statements, not fetching rows from the results, so for a query that streams its
+    results, the time spent fetching rows only counts toward the wall time. """
+
+    def __init__(self, name: str):
+        self.name           = name
+        self.wall_seconds   = 0.0
+        self.db_seconds     = 0.0
+        self.rows           = 0
+        self.peak_memory_kb: Optional[int] = None
+
+
+    def to_dict(self):
+        """ Returns a dictionary representation of this object, for serializing to JSON. """
+
+        return {
+            'name':           self.name,
+            'wall_seconds':   round(self.wall_seconds, 3),
+            'db_seconds':     round(self.db_seconds, 3),
+            'rows':           self.rows,
+            'peak_memory_kb': self.peak_memory_kb,
+        }
+
+
+class JobProfiler:
+    """ Breaks a job down into named phases and records PhaseStats for each of them. Use it as a context manager around
+    the whole job, and `phase` as a context manager around each phase.
+
+    Phases can be nested, in which case the time spent in the inner phase only counts toward the inner phase. Only
+    database statements executed on the thread that started the profiler are counted, so other work going on in the same
+    process doesn't get mixed in. Memory is only traced if `trace_memory` is True, since tracing every allocation makes
+    everything else several times slower. """
+
+    def __init__(self, trace_memory: bool = True):
+        self.phases: Dict[str, PhaseStats] = dict()
+        self.trace_memory = trace_memory
+
+        self._stack = list()
+        self._thread_id = None
+        self._engine = None
+        self._started_tracing = False
+        self._statement_started = None
+
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+
+        self._engine = DB.engine
+        event.listen(self._engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(self._engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        return self
+
+
+    def __exit__(self, *_):
+        event.remove(self._engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.remove(self._engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseStats]:
+        """ Records everything within the `with` block as a phase with the specified name. The PhaseStats yielded are
+        for just this time through the phase. Its rows can be counted, and it can be renamed if what the phase was about
+        isn't known until partway through. Either way it's added to the phase by the same name once the block exits. """
+
+        stats = PhaseStats(name)
+
+        now = default_timer()
+        if self._stack:
+            self._pause(self._stack[-1], now)
+        self._reset_peak_memory()
+        self._stack.append([stats, now])
+
+        try:
+            yield stats
+        finally:
+            now = default_timer()
+            self._pause(self._stack.pop(), now)
+            if self._stack:
+                parent = self._stack[-1]
+                parent[0].peak_memory_kb = _max_memory(parent[0].peak_memory_kb, stats.peak_memory_kb)
+                parent[1] = now
+            self._reset_peak_memory()
+            self._accumulate(stats)
+
+
+    def iterate(self, iterable, name: str):
+        """ Yields the items of the iterable, recording the time spent getting each one as the named phase, with one row
+        per item. This is for attributing the work of a generator to its own phase, when it's being consumed by some
+        other phase. """
+
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name) as stats:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                stats.rows += 1
+            yield item
+
+
+    def _pause(self, entry, now):
+        """ Adds the time since this stack entry was last started to its phase, along with the peak memory so far. """
+
+        stats, started = entry
+        stats.wall_seconds += now - started
+        if self.trace_memory:
+            stats.peak_memory_kb = _max_memory(stats.peak_memory_kb, tracemalloc.get_traced_memory()[1] // 1024)
+
+
+    def _reset_peak_memory(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+
+    def _accumulate(self, stats: PhaseStats):
+        """ Adds this time through a phase to the totals for the phase with the same name. """
+
+        total = self.phases.setdefault(stats.name, PhaseStats(stats.name))
+        total.wall_seconds   += stats.wall_seconds
+        total.db_seconds     += stats.db_seconds
+        total.rows           += stats.rows
+        total.peak_memory_kb = _max_memory(total.peak_memory_kb, stats.peak_memory_kb)
+
+
+    def _before_cursor_execute(self, *_):
+        if threading.get_ident() == self._thread_id:
+            self._statement_started = default_timer()
+
+
+    def _after_cursor_execute(self, *_):
+        if threading.get_ident() != self._thread_id or self._statement_started is None:
+            return
+
+        if self._stack:
+            self._stack[-1][0].db_seconds += default_timer() - self._statement_started
+        self._statement_started = None
+
+
+def _max_memory(memory_kb: Optional[int], other_memory_kb: Optional[int]) -> Optional[int]:
+    """ Returns the larger of two peak memory values, either of which may be None if memory wasn't traced. """
+
+    if memory_kb is None:
+        return other_memory_kb
+    if other_memory_kb is None:
+        return memory_kb
+
+    return max(memory_kb, other_memory_kb)
@@ -1,11 +1,11 @@
 """ Utilities for sorting collections of various types of objects. """
 
 from functools import cmp_to_key
-from typing import List, Tuple
-
-from ranking import Ranking
+from operator import itemgetter
+from typing import Any, List, Tuple
 
 from cubersio.persistence.models import EventFormat, PersonalBestRecord, UserEventResults
+from cubersio.util.times import convert_time_to_sort_key
 
 
 @cmp_to_key
@@ -26,42 +26,6 @@ def sort_personal_best_records(pb1: PersonalBestRecord, pb2: PersonalBestRecord)
     return int(val1) - int(val2)
 
 
-@cmp_to_key
-def __sort_user_event_results_by_result(result1: UserEventResults, result2: UserEventResults) -> int:
-    """ Compares two UserEventResults based on their `result` field. Lack of a result to be sorted to the end,
-    DNFs right before that, then compare time values directly. """
-
-    val1 = result1.result
-    val2 = result2.result
-    if not val1:
-        val1 = 100000000
-    if not val2:
-        val2 = 100000000
-    if val1 == 'DNF':
-        val1 = 99999999
-    if val2 == 'DNF':
-        val2 = 99999999
-    return int(val1) - int(val2)
-
-
-@cmp_to_key
-def __sort_user_event_results_by_single(result1: UserEventResults, result2: UserEventResults) -> int:
-    """ Compares two UserEventResults based on their `single` field. Lack of a single to be sorted to the end,
-    DNFs right before that, then compare time values directly. """
-
-    val1 = result1.single
-    val2 = result2.single if result2 else 100000000
-    if not val1:
-        val1 = 100000000
-    if not val2:
-        val2 = 100000000
-    if val1 == 'DNF':
-        val1 = 99999999
-    if val2 == 'DNF':
-        val2 = 99999999
-    return int(val1) - int(val2)
-
-
 def sort_user_results_with_rankings(results: List[UserEventResults],
                                     event_format: EventFormat) -> List[Tuple[int, str, UserEventResults]]:
     """ Sorts a list of UserEventResults based on the event format (for tie-breaking), and then applies rankings
@@ -69,40 +33,27 @@ def sort_user_results_with_rankings(results: List[UserEventResults],
     userEventResult), where ranking is the raw numerical rank and visible_ranking is the same as ranking except
     duplicate ranks show as an empty string. """
 
-    # Best-of-N results are only ranked by singles
-    if event_format in [EventFormat.Bo1, EventFormat.Bo3]:
-        results.sort(key=__sort_user_event_results_by_result)
-
-    # Average/mean results are sorted by single first, to ensure any ties by overall result (average/mean) are broken
-    # by the singles.
-    else:
-        results.sort(key=__sort_user_event_results_by_single)
-        results.sort(key=__sort_user_event_results_by_result)
-
-    # Build a list of tuples (average/mean, single), to be fed into the ranking mechanism.
-    # If the time value cannot be interpreted as an int, it's a "DNF" or None, so just assign it some humongous value
-    # which would sorted at the end.
-    times_values = list()
+    # Work out each result's keys just once, as a tuple of (result, result is missing, single, single is missing).
+    # DNFs and missing times have the same value so they're ranked as tied, but DNFs are sorted before missing times.
+    # Reading the fields of a UserEventResults isn't free, so each is only read once.
+    keyed_results = list()
     for result in results:
-        try:
-            average = int(result.result)
-        except (ValueError, TypeError):
-            average = 9999999999999
-        try:
-            single = int(result.single)
-        except (ValueError, TypeError):
-            single = 9999999999999
-        times_values.append((average, single))
-
-    # Ensure sort is valid after building the tuples with DNF/None reprs, and sort again.
+        result_value, single_value = result.result, result.single
+        keyed_results.append((convert_time_to_sort_key(result_value), not result_value,
+                              convert_time_to_sort_key(single_value), not single_value, result))
+
+    # Best-of-N results are only sorted by singles, which are their results. Average/mean results are sorted by single
+    # after the result, to ensure any ties by overall result (average/mean) are broken by the singles.
     if event_format in [EventFormat.Bo1, EventFormat.Bo3]:
-        times_values.sort(key=lambda x: x[1])
+        keyed_results.sort(key=itemgetter(0, 1))
     else:
-        times_values.sort(key=lambda x: x[1])
-        times_values.sort(key=lambda x: x[0])
+        keyed_results.sort(key=itemgetter(0, 1, 2, 3))
 
-    # Rank the list of times tuples. Legitimately tied results will have the same rank, so we also send back a
-    # "visible rank" which facilitates showing the results nicely. Ranks with ties will look something like this:
+    # The results are sorted in place, as they always have been
+    results[:] = [keyed_result[-1] for keyed_result in keyed_results]
+
+    # Rank the results by their (result, single). Legitimately tied results will have the same rank, so we also send
+    # back a "visible rank" which facilitates showing the results nicely. Ranks with ties will look something like this:
     #
     #   Place     Result
     #   -----     ------
@@ -111,16 +62,25 @@ def sort_user_results_with_rankings(results: List[UserEventResults],
     #              15
     #     4        17.84
 
-    ranks_seen = set()
-    ranked_results = list()
+    return rank_sorted(results, [(keyed_result[0], keyed_result[2]) for keyed_result in keyed_results])
+
+
+def rank_sorted(items: List[Any], rank_keys: List[Any]) -> List[Tuple[int, str, Any]]:
+    """ Ranks a list of items which is already sorted from best to worst, where `rank_keys` are the keys they're
+    ranked by, in the same order. Items with identical keys get identical rankings, and the next ranking skips as many
+    places as were tied. Returns a list of tuples of the form (ranking, visible_ranking, item), where visible_ranking
+    is the same as ranking except duplicate ranks show as an empty string. """
+
+    ranked_items = list()
+    rank = 0
+    previous_rank_key = None
 
-    for i, r in enumerate(Ranking(times_values, start=1, reverse=True)):
-        rank = r[0]
-        if rank not in ranks_seen:
-            ranks_seen.add(rank)
-            visible_rank = str(rank)
+    for i, (rank_key, item) in enumerate(zip(rank_keys, items)):
+        if i == 0 or rank_key != previous_rank_key:
+            rank = i + 1
+            previous_rank_key = rank_key
+            ranked_items.append((rank, str(rank), item))
         else:
-            visible_rank = ''
-        ranked_results.append((rank, visible_rank, results[i]))
+            ranked_items.append((rank, '', item))
 
-    return ranked_results
+    return ranked_items
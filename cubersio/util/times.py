@@ -25,3 +25,22 @@ def convert_centiseconds_to_friendly_time(centiseconds):
     seconds = '{0:.2f}'.format(secs % 60).zfill(5)
 
     return '{}:{}'.format(minutes, seconds)
+
+
+# The sort key for anything which isn't a time, like a DNF or a missing result, so it's sorted after every real time.
+# It's bigger than anything which fits in the 10 characters a single or result is stored in. PBs are ranked by the
+# database with the same key, so they're ordered the same way there.
+NO_TIME_SORT_KEY = 10**10
+
+
+def convert_time_to_sort_key(value):
+    """ Converts a single, average, or result as stored in UserEventResults to an integer which sorts the same way
+    they're ranked, best first. Times and FMC move counts sort by their value, and so do coded MBLD results, which are
+    lower for more points, and then for less time used. DNFs and missing results are tied, after everything else.
+    Ex: "2345" --> 2345
+    Ex: "DNF" --> 10000000000 """
+
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return NO_TIME_SORT_KEY
@@ -0,0 +1,129 @@
+"""Make user event results unique per user and competition event.
+
+Revision ID: a3d95f7e2c61
+Revises: f2a6d9e04b17
+Create Date: 2026-10-19 09:14:07.530212
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d95f7e2c61'
+down_revision = 'f2a6d9e04b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nothing but a check before saving stopped two requests racing to create a user's results for the same
+    # competition event before now, so there may be more than one for some of them, which need to be merged down to one
+    # before they can be made unique.
+    results = sa.table('user_event_results',
+                       sa.column('id', sa.Integer),
+                       sa.column('user_id', sa.Integer),
+                       sa.column('comp_event_id', sa.Integer),
+                       sa.column('event_id', sa.Integer),
+                       sa.column('single', sa.String),
+                       sa.column('average', sa.String),
+                       sa.column('is_complete', sa.Boolean),
+                       sa.column('is_blacklisted', sa.Boolean),
+                       sa.column('was_pb_single', sa.Boolean),
+                       sa.column('was_pb_average', sa.Boolean))
+    solves = sa.table('user_solves',
+                      sa.column('user_event_results_id', sa.Integer))
+    user_event_pbs = sa.table('user_event_pbs',
+                              sa.column('user_id', sa.Integer),
+                              sa.column('event_id', sa.Integer),
+                              sa.column('single', sa.String),
+                              sa.column('single_results_id', sa.Integer),
+                              sa.column('average', sa.String),
+                              sa.column('average_results_id', sa.Integer))
+    dirty_events = sa.table('site_rankings_dirty_events',
+                            sa.column('user_id', sa.Integer),
+                            sa.column('event_id', sa.Integer),
+                            sa.column('timestamp', sa.DateTime))
+
+    duplicated = sa.select(results.c.user_id, results.c.comp_event_id).\
+        group_by(results.c.user_id, results.c.comp_event_id).\
+        having(sa.func.count() > 1).\
+        subquery()
+    solves_counts = sa.select(solves.c.user_event_results_id, sa.func.count().label('solves_count')).\
+        group_by(solves.c.user_event_results_id).\
+        subquery()
+    duplicates = op.get_bind().execute(
+        sa.select(results.c.id, results.c.user_id, results.c.comp_event_id, results.c.event_id,
+                  results.c.is_complete, sa.func.coalesce(solves_counts.c.solves_count, 0).label('solves_count')).\
+        join(duplicated, sa.and_(duplicated.c.user_id == results.c.user_id,
+                                 duplicated.c.comp_event_id == results.c.comp_event_id)).\
+        outerjoin(solves_counts, solves_counts.c.user_event_results_id == results.c.id)
+    ).all()
+
+    groups = dict()
+    for row in duplicates:
+        groups.setdefault((row.user_id, row.comp_event_id), list()).append(row)
+
+    # More than one complete results for the same competition event can't be merged without picking one of the user's
+    # results to throw away, along with any PBs or medals from it, so that's left to somebody to sort out by hand
+    conflicts = {key: [row.id for row in rows] for key, rows in groups.items()
+                 if sum(1 for row in rows if row.is_complete) > 1}
+    if conflicts:
+        raise RuntimeError('Some users have more than one complete results for the same competition event, as '
+                           '(user ID, competition event ID): [results IDs]. Remove all but one of each before '
+                           'upgrading. {}'.format(conflicts))
+
+    # Keep whichever results are complete, or otherwise have the most solves, or otherwise are the latest. Everything
+    # else is incomplete, so none of it is a PB, or has a medal or points.
+    discarded_ids = list()
+    affected_users_events = set()
+    for rows in groups.values():
+        kept = max(rows, key=lambda row: (bool(row.is_complete), row.solves_count, row.id))
+        discarded_ids.extend(row.id for row in rows if row.id != kept.id)
+        affected_users_events.add((kept.user_id, kept.event_id))
+
+    if discarded_ids:
+        op.execute(solves.delete().where(solves.c.user_event_results_id.in_(discarded_ids)))
+        op.execute(results.delete().where(results.c.id.in_(discarded_ids)))
+
+        # Anybody's current PBs which somehow still point at the removed results are worked out again from the PB flags
+        # on what's left, and the site rankings for those events are redone next time they're calculated
+        pb_results = results.alias('pb_results')
+        for pb_flag, value, results_id in (('was_pb_single', 'single', 'single_results_id'),
+                                           ('was_pb_average', 'average', 'average_results_id')):
+            latest_pb_results_id = sa.select(sa.func.max(pb_results.c.id)).\
+                where(pb_results.c.user_id == user_event_pbs.c.user_id).\
+                where(pb_results.c.event_id == user_event_pbs.c.event_id).\
+                where(getattr(pb_results.c, pb_flag)).\
+                where(pb_results.c.is_complete).\
+                where(pb_results.c.is_blacklisted.isnot(True)).\
+                scalar_subquery()
+            pb_value = sa.select(getattr(results.c, value)).\
+                where(results.c.id == latest_pb_results_id).\
+                scalar_subquery()
+            op.execute(user_event_pbs.update().
+                       where(getattr(user_event_pbs.c, results_id).in_(discarded_ids)).
+                       values({results_id: latest_pb_results_id, value: pb_value}))
+
+        op.execute(user_event_pbs.delete().where(user_event_pbs.c.single_results_id.is_(None)).
+                   where(user_event_pbs.c.average_results_id.is_(None)))
+
+        timestamp = datetime.now()
+        op.bulk_insert(dirty_events, [dict(user_id=user_id, event_id=event_id, timestamp=timestamp)
+                                      for user_id, event_id in sorted(affected_users_events)])
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('user_event_results', schema=None) as batch_op:
+        batch_op.create_unique_constraint('unique_user_comp_event_results', ['user_id', 'comp_event_id'])
+
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('user_event_results', schema=None) as batch_op:
+        batch_op.drop_constraint('unique_user_comp_event_results', type_='unique')
+
+    # ### end Alembic commands ###
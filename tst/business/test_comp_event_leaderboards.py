@@ -0,0 +1,68 @@
+""" Tests for serving competition event leaderboards. """
+
+import pytest
+
+from cubersio import DB
+from cubersio.business import comp_event_leaderboards
+from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard
+from cubersio.persistence.comp_manager import get_comp_event_by_id
+from cubersio.persistence.models import EventFormat, UserEventResults
+from cubersio.persistence.user_results_manager import save_event_results, blacklist_results
+from cubersio.util.cache import GenerationalCache
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(mocker):
+    """ Every test gets its own database, so make sure nothing cached from another test's is used. """
+
+    mocker.patch.object(comp_event_leaderboards, '__LEADERBOARDS_CACHE', GenerationalCache(max_entries=4))
+
+
+def __seed_comp_event(seed_results, users_count=8):
+    """ Seeds one competition event with results for several users, with some tied, a DNF, and a couple blacklisted.
+    Returns the users and the competition event. """
+
+    users = seed_results(event_names=('3x3',), users_count=users_count)
+    results = UserEventResults.query.order_by(UserEventResults.id).all()
+    for i, result in enumerate(results):
+        result.result = result.average = 'DNF' if i == 3 else str(1000 + (i // 2) * 100)
+        result.single = str(900 + (i % 2) * 50)
+        result.is_blacklisted = i in (0, 5)
+    DB.session.commit()
+
+    return users, get_comp_event_by_id(results[0].comp_event_id)
+
+
+def test_views_are_ranked_as_if_sorted_separately(seed_results):
+    users, comp_event = __seed_comp_event(seed_results)
+    leaderboard = get_comp_event_leaderboard(comp_event)
+
+    all_results = UserEventResults.query.all()
+    for show_blacklisted, username in ((True, None), (False, None), (False, users[0].username)):
+        expected = [result for result in all_results
+                    if show_blacklisted or not result.is_blacklisted or result.User.username == username]
+        expected = sort_user_results_with_rankings(expected, EventFormat.Ao5)
+
+        ranked_rows = leaderboard.ranked_rows(show_blacklisted, username)
+
+        assert [(rank, visible_rank, row.id) for rank, visible_rank, row in ranked_rows] ==\
+            [(rank, visible_rank, result.id) for rank, visible_rank, result in expected]
+
+
+def test_leaderboard_is_prepared_again_only_when_results_change(seed_results, mocker):
+    _, comp_event = __seed_comp_event(seed_results)
+    prepare_spy = mocker.spy(comp_event_leaderboards, 'get_all_complete_user_results_for_comp_event')
+
+    get_comp_event_leaderboard(comp_event)
+    get_comp_event_leaderboard(comp_event)
+    assert prepare_spy.call_count == 1
+
+    result = UserEventResults.query.filter(UserEventResults.result != 'DNF').first()
+    result.comment = 'nice'
+    save_event_results(result, comp_event.event_id)
+    assert [row.comment for row in get_comp_event_leaderboard(comp_event).rows if row.id == result.id] == ['nice']
+
+    blacklist_results(result.id, 'hidden')
+    assert [row.is_blacklisted for row in get_comp_event_leaderboard(comp_event).rows if row.id == result.id] == [True]
+    assert prepare_spy.call_count == 3
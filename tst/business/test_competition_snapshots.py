@@ -0,0 +1,68 @@
+""" Tests for freezing finished competitions into snapshots. """
+
+import pytest
+
+from cubersio import DB
+from cubersio.business import comp_event_leaderboards
+from cubersio.business.comp_event_leaderboards import get_comp_event_leaderboard
+from cubersio.business.competition.snapshots import freeze_competition, get_frozen_overall_points,\
+    get_competition_events_info, refreeze_comp_event
+from cubersio.business.overall_points import get_overall_points
+from cubersio.persistence.models import Competition, CompetitionEvent, UserEventResults
+from cubersio.persistence.user_results_manager import blacklist_results
+from cubersio.util.cache import GenerationalCache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(mocker):
+    """ Every test gets its own database, so make sure nothing cached from another test's is used. """
+
+    mocker.patch.object(comp_event_leaderboards, '__LEADERBOARDS_CACHE', GenerationalCache(max_entries=4))
+
+
+def __seed_finished_comp(seed_results):
+    """ Seeds a finished competition, and the active one after it, and returns the finished one's events. """
+
+    seed_results(event_names=('3x3', '4x4'), comps_count=2, users_count=4)
+    for i, result in enumerate(UserEventResults.query.order_by(UserEventResults.id)):
+        result.result = result.average = str(1000 + (i * 3 % 4) * 100)
+    DB.session.commit()
+
+    comp = Competition.query.filter(Competition.active.is_(False)).one()
+    return CompetitionEvent.query.filter_by(competition_id=comp.id).order_by(CompetitionEvent.id).all()
+
+
+def test_frozen_leaderboards_are_served_until_results_change(seed_results, mocker):
+    comp_events = __seed_finished_comp(seed_results)
+    prepared = [get_comp_event_leaderboard(comp_event) for comp_event in comp_events]
+    freeze_competition(comp_events[0].competition_id)
+
+    mocker.patch.object(comp_event_leaderboards, '__LEADERBOARDS_CACHE', GenerationalCache(max_entries=4))
+    prepare_spy = mocker.spy(comp_event_leaderboards, '__prepare_leaderboard')
+
+    for comp_event, leaderboard in zip(comp_events, prepared):
+        frozen = get_comp_event_leaderboard(comp_event)
+        assert frozen.rows == leaderboard.rows
+        assert frozen.ranked_rows(False, None) == leaderboard.ranked_rows(False, None)
+    assert prepare_spy.call_count == 0
+
+    blacklist_results(comp_events[0].user_results[0].id, 'hidden')
+    rows = get_comp_event_leaderboard(comp_events[0]).rows
+    assert prepare_spy.call_count == 1
+    assert [row.is_blacklisted for row in rows].count(True) == 1
+
+
+def test_frozen_overall_points_are_only_used_until_results_change(seed_results):
+    comp_events = __seed_finished_comp(seed_results)
+    comp_id = comp_events[0].competition_id
+    assert get_frozen_overall_points(comp_id) is None
+
+    freeze_competition(comp_id)
+    assert get_frozen_overall_points(comp_id) == get_overall_points(comp_id)
+    assert get_competition_events_info(comp_id).id_3x3 == comp_events[0].id
+
+    blacklist_results(comp_events[1].user_results[0].id, 'hidden')
+    assert get_frozen_overall_points(comp_id) is None
+
+    refreeze_comp_event(comp_events[1])
+    assert get_frozen_overall_points(comp_id) == get_overall_points(comp_id)
@@ -0,0 +1,55 @@
+""" Tests for paging through an event's records. """
+
+import pytest
+
+from cubersio.business.event_records import RankedRecords, EVENT_RECORDS_PAGE_SIZE, encode_cursor, decode_cursor
+from cubersio.persistence.models import PersonalBestRecord
+
+
+@pytest.fixture
+def ranked_records():
+    # Two and a half pages of records, with lots of ties so pages start and end in the middle of them
+    records = [PersonalBestRecord(username=f'user{i}', personal_best=str(1000 + i // 3), sort_key=(1000 + i // 3, 0, i))
+               for i in range(EVENT_RECORDS_PAGE_SIZE * 5 // 2)]
+    return RankedRecords(records)
+
+
+def test_paging_forward_and_back_covers_every_record_once(ranked_records):
+    pages = [ranked_records.page()]
+    while pages[-1].after:
+        pages.append(ranked_records.page(after=decode_cursor(pages[-1].after)))
+
+    assert [len(page.records) for page in pages] == [100, 100, 50]
+    assert [r for page in pages for r in page.records] == ranked_records.records
+    assert pages[0].before is None
+
+    previous_page = ranked_records.page(before=decode_cursor(pages[2].before))
+    assert previous_page.records == pages[1].records
+
+
+def test_pages_are_anchored_on_sort_keys_not_offsets(ranked_records):
+    first_page = ranked_records.page()
+
+    # Somebody new takes the top spot, which shouldn't push anybody from the first page onto the next one
+    ranked_records = RankedRecords([PersonalBestRecord(username='speedy', sort_key=(1, 0, 9999))] +
+                                   ranked_records.records)
+    second_page = ranked_records.page(after=decode_cursor(first_page.after))
+
+    assert second_page.records[0] is ranked_records.records[EVENT_RECORDS_PAGE_SIZE + 1]
+
+
+def test_user_page_args(ranked_records):
+    assert ranked_records.page(username='nobody').user_page_args is None
+    assert ranked_records.page(username='user42').user_page_args == dict()
+    assert ranked_records.page(username='user42').user_on_page
+
+    page = ranked_records.page(username='user142')
+    assert not page.user_on_page
+    assert ranked_records.page(after=decode_cursor(page.user_page_args['after'])).records[0].username == 'user142'
+
+
+def test_cursors():
+    assert decode_cursor(encode_cursor((9999999999999, 1, 42))) == (9999999999999, 1, 42)
+    assert decode_cursor('') is None
+    assert decode_cursor('abc') is None
+    assert decode_cursor('1.2') is None
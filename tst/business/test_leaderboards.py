@@ -0,0 +1,44 @@
+""" Tests for building the Sum of Ranks and Kinchranks leaderboards. """
+
+from collections import namedtuple
+
+from cubersio.business.leaderboards import build_leaderboard_rows, SUM_OF_RANKS_ALL_SINGLE, KINCHRANKS_WCA
+
+
+_SiteRankingsRow = namedtuple('_SiteRankingsRow', ['username', 'sum_all_single', 'wca_kinchrank'])
+
+_SITE_RANKINGS = [
+    _SiteRankingsRow('dave',  40, 0.0),
+    _SiteRankingsRow('carol', 25, 55.1238),
+    _SiteRankingsRow('alice', 25, 55.1241),
+    _SiteRankingsRow('bob',   10, 80.5),
+    _SiteRankingsRow('erin',  25, 12.0),
+    _SiteRankingsRow('frank', 40, 0.0),
+    _SiteRankingsRow('gina',  None, None),
+]
+
+
+def test_sum_of_ranks_ties_share_a_rank_and_non_participants_are_left_off():
+    rows = build_leaderboard_rows(_SITE_RANKINGS, SUM_OF_RANKS_ALL_SINGLE)
+
+    assert rows == [
+        (1, 'bob', '10'),
+        (2, 'alice', '25'),
+        (2, 'carol', '25'),
+        (2, 'erin', '25'),
+    ]
+
+
+def test_kinchranks_are_descending_and_tie_on_displayed_value():
+    rows = build_leaderboard_rows(_SITE_RANKINGS, KINCHRANKS_WCA)
+
+    assert rows == [
+        (1, 'bob', '80.500'),
+        (2, 'alice', '55.124'),
+        (2, 'carol', '55.124'),
+        (4, 'erin', '12.000'),
+    ]
+
+
+def test_empty_leaderboard():
+    assert build_leaderboard_rows([], SUM_OF_RANKS_ALL_SINGLE) == list()
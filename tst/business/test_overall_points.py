@@ -0,0 +1,85 @@
+""" Tests for keeping track of everybody's overall points for a competition. """
+
+from cubersio import DB
+from cubersio.business import overall_points
+from cubersio.business.overall_points import get_overall_points, refresh_overall_points
+from cubersio.persistence.comp_points_manager import replace_user_comp_event_points
+from cubersio.persistence.models import CompetitionEvent, EventFormat, UserCompPoints, UserEventResults
+from cubersio.persistence.user_results_manager import save_event_results, blacklist_results, delete_event_results
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+
+def __seed_comp(seed_results):
+    """ Seeds a competition with two events, with everybody's results in each in a different order, and returns its
+    ID. """
+
+    seed_results(event_names=('3x3', '4x4'), users_count=6)
+    for i, result in enumerate(UserEventResults.query.order_by(UserEventResults.id)):
+        result.result = result.average = str(1000 + (i * 7 % 5) * 100)
+    DB.session.commit()
+
+    return CompetitionEvent.query.first().competition_id
+
+
+def __expected_overall_points(comp_id):
+    """ Works out everybody's overall points from scratch, ranking every event's results. """
+
+    points = dict()
+    for comp_event in CompetitionEvent.query.filter_by(competition_id=comp_id):
+        results = [result for result in comp_event.user_results if result.is_complete and not result.is_blacklisted]
+        if not results:
+            continue
+        for rank, _, result in sort_user_results_with_rankings(results, EventFormat.Ao5):
+            points[result.User.username] = points.get(result.User.username, 0) + len(results) - rank
+
+    return sorted(points.items(), key=lambda username_and_points: (-username_and_points[1], username_and_points[0]))
+
+
+def test_only_changed_events_are_ranked_again(seed_results, mocker):
+    comp_id = __seed_comp(seed_results)
+    ranking_spy = mocker.spy(overall_points, 'get_user_ranks_for_comp_event')
+
+    refresh_overall_points(comp_id)
+    assert get_overall_points(comp_id) == __expected_overall_points(comp_id)
+    assert ranking_spy.call_count == 2
+
+    refresh_overall_points(comp_id)
+    assert get_overall_points(comp_id) == __expected_overall_points(comp_id)
+    assert ranking_spy.call_count == 2
+
+    results = UserEventResults.query.order_by(UserEventResults.id).all()
+    results[0].result = '500'
+    save_event_results(results[0], results[0].event_id)
+    refresh_overall_points(comp_id)
+    assert get_overall_points(comp_id) == __expected_overall_points(comp_id)
+
+    blacklist_results(results[2].id, 'hidden')
+    refresh_overall_points(comp_id)
+    assert get_overall_points(comp_id) == __expected_overall_points(comp_id)
+
+    delete_event_results(results[-1])
+    refresh_overall_points(comp_id)
+    assert get_overall_points(comp_id) == __expected_overall_points(comp_id)
+    assert ranking_spy.call_count == 5
+
+
+def test_reading_overall_points_never_ranks_results(seed_results, mocker):
+    comp_id = __seed_comp(seed_results)
+    ranking_spy = mocker.spy(overall_points, 'get_user_ranks_for_comp_event')
+
+    assert get_overall_points(comp_id) == []
+    assert ranking_spy.call_count == 0
+    assert all(comp_event.points_generation is None for comp_event in CompetitionEvent.query)
+
+
+def test_points_already_replaced_by_somebody_else_are_left_alone(seed_results):
+    comp_id = __seed_comp(seed_results)
+    refresh_overall_points(comp_id)
+    comp_event = CompetitionEvent.query.first()
+    totals = [(points.user_id, points.points) for points in UserCompPoints.query.order_by(UserCompPoints.user_id)]
+
+    replace_user_comp_event_points(comp_id, comp_event.id, None, comp_event.points_generation + 1, dict(),
+                                   {user_id: 100 for user_id, _ in totals})
+
+    assert [(points.user_id, points.points) for points in UserCompPoints.query.order_by(UserCompPoints.user_id)] ==\
+        totals
@@ -0,0 +1,93 @@
+""" Tests for the in-process PB rank index. """
+
+import random
+
+from cubersio import app, DB
+from cubersio.business import rank_index
+from cubersio.business.rank_index import PersonalBestRankIndex, rank_key, get_site_ranks, get_ranked_pbs_counts,\
+    record_personal_best
+from cubersio.persistence.models import Event, RankedPersonalBest
+
+
+def __seed_event(seed_results):
+    """ Seeds an event with everybody's results in it, and forgets any indexes loaded for earlier tests' databases.
+    Returns the event's ID. """
+
+    seed_results(event_names=('3x3',), users_count=3)
+    getattr(rank_index, '__INDEXES').clear()
+
+    return Event.query.one().id
+
+
+def test_ranks_match_ordered_pb_ranks():
+    times = [random.randint(500, 1500) for _ in range(300)]
+    ranked_pbs = [RankedPersonalBest(user_id, str(time), None) for user_id, time in enumerate(times)]
+    index = PersonalBestRankIndex(ranked_pbs + [RankedPersonalBest(1000, 'DNF', None)])
+
+    # Each PB's rank is one more than the number of PBs strictly faster, so ties share a rank
+    for time in times:
+        assert index.rank(time) == sum(1 for other_time in times if other_time < time) + 1
+
+    assert len(index) == len(times)
+
+
+def test_new_pb_replaces_previous_pb():
+    index = PersonalBestRankIndex([RankedPersonalBest(1, '1000', 1),
+                                   RankedPersonalBest(2, '1200', 2),
+                                   RankedPersonalBest(3, '1200', 2)])
+
+    assert index.rank(1100) == 2
+
+    index.update(2, 900)
+    assert index.rank(900) == 1
+    assert index.rank(1100) == 3
+    assert len(index) == 3
+
+    index.update(4, 1100)
+    assert index.rank(1100) == 3
+    assert index.rank(1200) == 4
+    assert len(index) == 4
+
+
+def test_rank_key():
+    assert rank_key('1234') == 1234
+    assert rank_key(1234) == 1234
+    assert rank_key('DNF') is None
+    assert rank_key('') is None
+    assert rank_key(None) is None
+
+
+def test_new_pb_is_only_recorded_once_committed(seed_results):
+    event_id = __seed_event(seed_results)
+    singles_count, _ = get_ranked_pbs_counts(event_id)
+
+    record_personal_best(1000, event_id, single='100')
+    DB.session.rollback()
+    DB.session.commit()
+    assert get_ranked_pbs_counts(event_id)[0] == singles_count
+
+    record_personal_best(1000, event_id, single='100')
+    assert get_ranked_pbs_counts(event_id)[0] == singles_count
+    DB.session.commit()
+    assert get_ranked_pbs_counts(event_id)[0] == singles_count + 1
+    assert get_site_ranks(event_id, single='100') == (1, None)
+
+
+def test_index_is_loaded_in_the_background(seed_results, mocker):
+    event_id = __seed_event(seed_results)
+    mocker.patch.dict(app.config, {'RANK_INDEX_LOAD_IN_BACKGROUND': True})
+    thread = mocker.patch.object(rank_index, 'Thread')
+
+    # Nothing's ranked until the index is loaded, rather than the lookup waiting for it
+    assert get_site_ranks(event_id, single='100') == (None, None)
+    assert get_ranked_pbs_counts(event_id) == (0, 0)
+    thread.assert_called_once()
+    assert thread.call_args.kwargs['args'] == (event_id,)
+
+    # A PB committed while it's loading is recorded in the index once it's loaded
+    record_personal_best(1000, event_id, single='100')
+    DB.session.commit()
+
+    mocker.patch.dict(app.config, {'RANK_INDEX_LOAD_IN_BACKGROUND': False})
+    thread.call_args.kwargs['target'](event_id)
+    assert get_site_ranks(event_id, single='100') == (1, None)
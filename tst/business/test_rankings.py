@@ -0,0 +1,77 @@
+""" Tests for calculating everybody's site rankings from their PBs. """
+
+import sqlite3
+
+from cubersio import app, DB
+from cubersio.business.rankings import calculate_user_site_rankings
+from cubersio.business.user_results.personal_bests import recalculate_all_pbs, recalculate_user_pbs_for_event
+from cubersio.persistence.models import UserEventResults, UserSiteRankings, UserEventSiteRankings
+
+
+def __seed_pbs(seed_results):
+    """ Seeds a few competitions' worth of results with a spread of times, ties, and DNFs, along with everybody's
+    PBs. """
+
+    seed_results(event_names=('3x3', '2x2', 'FMC'), comps_count=3, users_count=6)
+    for i, results in enumerate(UserEventResults.query.order_by(UserEventResults.id)):
+        results.single = 'DNF' if i % 7 == 3 else str(800 + (i * 37 % 11) * 50)
+        results.average = results.result = 'DNF' if i % 5 == 2 else str(1000 + (i * 13 % 7) * 50)
+    DB.session.commit()
+    recalculate_all_pbs()
+
+
+def __saved_site_rankings():
+    """ Returns everybody's saved site rankings, leaving out when they were calculated. """
+
+    site_rankings = {rankings.user_id: (rankings.get_site_rankings_and_pbs(), rankings.sum_all_single,
+                                        rankings.sum_all_average, rankings.sum_wca_single, rankings.sum_wca_average,
+                                        rankings.sum_non_wca_single, rankings.sum_non_wca_average,
+                                        rankings.all_kinchrank, rankings.wca_kinchrank, rankings.non_wca_kinchrank)
+                     for rankings in UserSiteRankings.query}
+    event_site_rankings = {(rankings.user_id, rankings.event_id): rankings.as_site_rankings_tuple()
+                           for rankings in UserEventSiteRankings.query}
+    DB.session.expire_all()
+
+    return site_rankings, event_site_rankings
+
+
+def test_incremental_site_rankings_match_full_site_rankings(seed_results):
+    __seed_pbs(seed_results)
+    calculate_user_site_rankings()
+    before = __saved_site_rankings()
+
+    # Somebody sets a new PB single in 2x2, and somebody else's 3x3 average PB is blacklisted
+    new_pb = UserEventResults.query.filter_by(event_id=2, user_id=4).order_by(UserEventResults.id.desc()).first()
+    new_pb.single = '100'
+    blacklisted = UserEventResults.query.filter_by(event_id=1, user_id=2, is_latest_pb_average=True).one()
+    blacklisted.is_blacklisted = True
+    DB.session.commit()
+    recalculate_user_pbs_for_event(4, 2)
+    recalculate_user_pbs_for_event(2, 1)
+
+    calculate_user_site_rankings(incremental=True)
+    incremental = __saved_site_rankings()
+    assert incremental != before
+
+    calculate_user_site_rankings()
+    assert __saved_site_rankings() == incremental
+
+
+def test_site_rankings_ranked_by_a_pool_of_workers_match_ranking_serially(seed_results, tmp_path, monkeypatch, mocker):
+    __seed_pbs(seed_results)
+    calculate_user_site_rankings()
+    serial = __saved_site_rankings()
+
+    # The worker processes can't see this process's in-memory database, so give them a copy of it
+    database_path = tmp_path / 'rankings.sqlite'
+    with sqlite3.connect(database_path) as database_copy:
+        DB.engine.raw_connection().driver_connection.backup(database_copy)
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{database_path}')
+    mocker.patch.dict(app.config, RANKINGS_WORKERS=2)
+
+    UserSiteRankings.query.delete()
+    UserEventSiteRankings.query.delete()
+    DB.session.commit()
+
+    calculate_user_site_rankings()
+    assert __saved_site_rankings() == serial
@@ -0,0 +1,215 @@
+""" Tests for the vectorized site rankings engine. """
+
+from collections import OrderedDict
+import json
+import pickle
+import random
+
+import pytest
+
+from cubersio.business.rankings_matrix import calculate_site_rankings_matrix, calculate_event_kinch
+from cubersio.persistence.models import Event, EventFormat, RankedPersonalBest, UserSiteRankings
+from cubersio.util.events.mbld import MbldSolve
+
+
+_EVENTS = [
+    Event(id=1, name='3x3', eventFormat=EventFormat.Ao5),
+    Event(id=2, name='2x2', eventFormat=EventFormat.Ao5),
+    Event(id=3, name='FMC', eventFormat=EventFormat.Mo3),
+    Event(id=4, name='3BLD', eventFormat=EventFormat.Bo3),
+    Event(id=5, name='MBLD', eventFormat=EventFormat.Bo3),
+    Event(id=6, name='6x6', eventFormat=EventFormat.Mo3),
+    Event(id=7, name='Kilominx', eventFormat=EventFormat.Ao5),
+    Event(id=8, name='2-3-4 Relay', eventFormat=EventFormat.Bo1),
+]
+
+_WCA_EVENT_IDS = {1, 2, 3, 4, 5, 6}
+
+_SORT_KEY_NO_TIME = 9999999999999
+
+
+def _random_time(rng, event):
+    """ Returns a random PB value for the event, sometimes a DNF. """
+
+    if rng.random() < 0.1:
+        return 'DNF'
+    if event.name == 'MBLD':
+        return str(int('{:02d}{:05d}{:02d}'.format(99 - rng.randint(1, 10), rng.randint(600, 3600), rng.randint(0, 3))))
+    return str(rng.choice([rng.randint(500, 6000), 1000, 1200]))
+
+
+def _ordered_pbs(rng, event, user_ids):
+    """ Builds an ordered and ranked list of RankedPersonalBests, like the ordered PB queries return. """
+
+    personal_bests = [RankedPersonalBest(user_id, _random_time(rng, event), None) for user_id in user_ids]
+
+    def rank_key(pb):
+        return _SORT_KEY_NO_TIME if pb.personal_best == 'DNF' else int(pb.personal_best)
+
+    personal_bests.sort(key=rank_key)
+    for i, pb in enumerate(personal_bests):
+        if i and rank_key(pb) == rank_key(personal_bests[i - 1]):
+            pb.numerical_rank = personal_bests[i - 1].numerical_rank
+        else:
+            pb.numerical_rank = i + 1
+
+    return personal_bests
+
+
+def _build_rankings_inputs(seed):
+    """ Builds random ordered PBs for a bunch of users across all the test events. A couple of events have nobody
+    competing in them, and Bo1 events have no averages. """
+
+    rng = random.Random(seed)
+    user_ids = list(range(1, 41))
+
+    event_singles_map = dict()
+    event_averages_map = dict()
+    for event in _EVENTS:
+        if rng.random() < 0.2:
+            continue
+        competitors = rng.sample(user_ids, rng.randint(1, len(user_ids)))
+        event_singles_map[event] = _ordered_pbs(rng, event, competitors)
+        if event.eventFormat == EventFormat.Bo1 or event.name == 'MBLD':
+            event_averages_map[event] = list()
+        else:
+            event_averages_map[event] = _ordered_pbs(rng, event, rng.sample(competitors, len(competitors) // 2))
+
+    return user_ids, event_singles_map, event_averages_map
+
+
+def _calculate_matrix(user_ids, ranked_events, event_singles_map, event_averages_map):
+    """ Calculates site rankings with the matrix engine. """
+
+    event_kinch_map = {event: calculate_event_kinch(event.name, event.eventFormat, event_singles_map[event],
+                                                    event_averages_map[event]) for event in ranked_events}
+
+    return calculate_site_rankings_matrix(user_ids, ranked_events, event_singles_map, event_averages_map,
+                                          event_kinch_map, _WCA_EVENT_IDS)
+
+
+def _calculate_user_by_user(user_ids, ranked_events, event_singles_map, event_averages_map):
+    """ Calculates site rankings one user and one event at a time, the straightforward way, to compare against. """
+
+    for user_id in user_ids:
+        user_rankings_data = OrderedDict()
+        for event in ranked_events:
+            singles = {pb.user_id: pb for pb in event_singles_map[event]}
+            averages = {pb.user_id: pb for pb in event_averages_map[event]}
+            single = singles.get(user_id, RankedPersonalBest(user_id, '', len(singles) + 1))
+            average = averages.get(user_id, RankedPersonalBest(user_id, '', len(averages) + 1))
+            event_kinch = _expected_kinch(event, event_singles_map[event], event_averages_map[event], single, average)
+            user_rankings_data[event.id] = (single.personal_best, single.numerical_rank, average.personal_best,
+                                            average.numerical_rank, format(event_kinch, '.3f'))
+
+        yield _expected_site_rankings(user_id, user_rankings_data)
+
+
+def _expected_kinch(event, singles, averages, single, average):
+    """ Returns the user's Kinch score for the event, from their single and average PBs. """
+
+    def time_kinch(pb, best_pbs):
+        if not pb.personal_best or pb.personal_best == 'DNF':
+            return 0
+        return round(int(best_pbs[0].personal_best) / int(pb.personal_best) * 100, 3)
+
+    if event.name == 'MBLD':
+        if not single.personal_best or single.personal_best == 'DNF':
+            return 0
+        baseline = MbldSolve(int(singles[0].personal_best)).sort_value
+        return round(MbldSolve(int(single.personal_best)).sort_value / baseline * 100, 3)
+    if event.name in ('FMC', '3BLD'):
+        return max(time_kinch(single, singles), time_kinch(average, averages))
+    if event.eventFormat in (EventFormat.Bo1, EventFormat.Bo3):
+        return time_kinch(single, singles)
+    return time_kinch(average, averages)
+
+
+def _expected_site_rankings(user_id, user_rankings_data):
+    """ Sums up the user's ranks, and averages their Kinch scores, one event at a time. """
+
+    rankings = UserSiteRankings(user_id=user_id, data=json.dumps(user_rankings_data))
+    sums = {'all': [0, 0], 'wca': [0, 0], 'non_wca': [0, 0]}
+    kinch = {'all': [], 'wca': [], 'non_wca': []}
+    for event_id, (_, single_rank, _, average_rank, event_kinch) in user_rankings_data.items():
+        for group in ('all', 'wca' if event_id in _WCA_EVENT_IDS else 'non_wca'):
+            sums[group][0] += single_rank
+            sums[group][1] += average_rank
+            kinch[group].append(float(event_kinch))
+
+    for group in ('all', 'wca', 'non_wca'):
+        setattr(rankings, f'sum_{group}_single', sums[group][0])
+        setattr(rankings, f'sum_{group}_average', sums[group][1])
+        setattr(rankings, f'{group}_kinchrank', round(sum(kinch[group]) / len(kinch[group]), 3) if kinch[group] else 0)
+
+    return rankings
+
+
+_COMPARED_ATTRIBUTES = ['user_id', 'data', 'sum_all_single', 'sum_all_average', 'sum_wca_single', 'sum_wca_average',
+                        'sum_non_wca_single', 'sum_non_wca_average', 'all_kinchrank', 'wca_kinchrank',
+                        'non_wca_kinchrank']
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matrix_matches_user_by_user_calculation(seed):
+    user_ids, event_singles_map, event_averages_map = _build_rankings_inputs(seed)
+    ranked_events = [event for event in _EVENTS if event in event_singles_map]
+
+    expected = _calculate_user_by_user(user_ids, ranked_events, event_singles_map, event_averages_map)
+    actual = _calculate_matrix(user_ids, ranked_events, event_singles_map, event_averages_map)
+
+    for expected_rankings, actual_rankings in zip(expected, actual):
+        for attribute in _COMPARED_ATTRIBUTES:
+            assert getattr(actual_rankings, attribute) == getattr(expected_rankings, attribute)
+
+
+def test_matrix_data_lists_events_in_order():
+    user_ids, event_singles_map, event_averages_map = _build_rankings_inputs(0)
+    ranked_events = [event for event in _EVENTS if event in event_singles_map]
+
+    rankings = next(_calculate_matrix(user_ids, ranked_events, event_singles_map, event_averages_map))
+
+    assert list(json.loads(rankings.data).keys()) == [str(event.id) for event in ranked_events]
+
+
+def test_matrix_with_no_events():
+    rankings = list(_calculate_matrix([1, 2], list(), dict(), dict()))
+
+    assert [r.data for r in rankings] == ['{}', '{}']
+    assert [r.sum_all_single for r in rankings] == [0, 0]
+    assert [r.all_kinchrank for r in rankings] == [0, 0]
+
+
+def test_ranked_personal_bests_survive_pickling():
+    # The rankings worker processes send these back to the main process pickled
+    pb = RankedPersonalBest(7, '1234', 3)
+
+    unpickled = pickle.loads(pickle.dumps(pb))
+
+    assert (unpickled.user_id, unpickled.personal_best, unpickled.numerical_rank) == (7, '1234', 3)
+    assert not hasattr(unpickled, '__dict__')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matrix_keeping_some_events_matches_ranking_them_all(seed):
+    user_ids, event_singles_map, event_averages_map = _build_rankings_inputs(seed)
+    ranked_events = [event for event in _EVENTS if event in event_singles_map]
+    expected = list(_calculate_matrix(user_ids, ranked_events, event_singles_map, event_averages_map))
+
+    # Only re-rank every other event, and keep everybody's existing rankings for the rest
+    kept_events = ranked_events[::2]
+    kept_rankings_data = {rankings.user_id: json.loads(rankings.data) for rankings in expected}
+    kept_pb_counts = {event.id: (len(event_singles_map[event]), len(event_averages_map[event]))
+                      for event in kept_events}
+    reranked_events = [event for event in ranked_events if event not in kept_events]
+    event_kinch_map = {event: calculate_event_kinch(event.name, event.eventFormat, event_singles_map[event],
+                                                    event_averages_map[event]) for event in reranked_events}
+
+    actual = calculate_site_rankings_matrix(user_ids, ranked_events,
+                                            {event: event_singles_map[event] for event in reranked_events},
+                                            {event: event_averages_map[event] for event in reranked_events},
+                                            event_kinch_map, _WCA_EVENT_IDS, kept_rankings_data, kept_pb_counts)
+
+    for expected_rankings, actual_rankings in zip(expected, actual):
+        for attribute in _COMPARED_ATTRIBUTES:
+            assert getattr(actual_rankings, attribute) == getattr(expected_rankings, attribute)
@@ -0,0 +1,118 @@
+""" Tests for the digest of a finished competition's results. """
+
+from cubersio import DB
+from cubersio.business.competition import results_digest, scoring
+from cubersio.business.competition.results_digest import build_results_digest, get_results_digest, GOLD, SILVER,\
+    BRONZE
+from cubersio.business.competition.scoring import post_results_thread
+from cubersio.business.user_results import set_medals_on_best_event_results
+from cubersio.persistence.models import Competition, CompetitionEvent, CompetitionSnapshot, EventFormat, User,\
+    UserEventResults
+from cubersio.persistence.user_results_manager import blacklist_results
+from cubersio.tasks import huey, reddit
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+# Put Huey in immediate mode so the tasks execute synchronously
+huey.immediate = True
+
+
+def __seed_finished_comp(seed_results):
+    """ Seeds a finished competition with two events, with ties, a DNF, and a blacklisted result, and the active one
+    after it. Returns the finished competition's ID. """
+
+    seed_results(event_names=('3x3', '4x4'), comps_count=2, users_count=6)
+    for i, result in enumerate(UserEventResults.query.order_by(UserEventResults.id)):
+        result.result = result.average = 'DNF' if i % 6 == 5 else str(1000 + (i * 5 % 4) * 100)
+        result.is_blacklisted = i == 2
+        result.was_pb_single = i % 4 == 0
+    for user in User.query:
+        user.reddit_id = f'reddit_{user.id}'
+    DB.session.commit()
+
+    return Competition.query.filter(Competition.active.is_(False)).one().id
+
+
+def __expected_medals_and_points(comp_id):
+    """ Works out the medals and everybody's points from scratch, ranking every event's results. """
+
+    medals = dict()
+    points = dict()
+    for comp_event in CompetitionEvent.query.filter_by(competition_id=comp_id).order_by(CompetitionEvent.id):
+        results = [result for result in comp_event.user_results if result.is_complete and not result.is_blacklisted]
+        ranked = sort_user_results_with_rankings(results, EventFormat.Ao5)
+        podium_ranks = sorted(set(rank for rank, _, _ in ranked))[:3]
+        for rank, _, result in ranked:
+            points[result.User.username] = points.get(result.User.username, 0) + len(ranked) - rank
+            if rank in podium_ranks and result.result != 'DNF':
+                medals[result.id] = (GOLD, SILVER, BRONZE)[podium_ranks.index(rank)]
+
+    return medals, points
+
+
+def test_digest_matches_ranking_from_scratch(seed_results):
+    comp_id = __seed_finished_comp(seed_results)
+    expected_medals, expected_points = __expected_medals_and_points(comp_id)
+
+    digest = build_results_digest(comp_id)
+    assert digest.medals == expected_medals
+    assert dict(digest.user_points) == expected_points
+    assert get_results_digest(comp_id) == digest
+
+    # The medals were awarded, just the same as they would've been otherwise
+    def medal_flags():
+        return [(bool(r.was_gold_medal), bool(r.was_silver_medal), bool(r.was_bronze_medal))
+                for r in UserEventResults.query.order_by(UserEventResults.id)]
+
+    flags = medal_flags()
+    set_medals_on_best_event_results(CompetitionEvent.query.filter_by(competition_id=comp_id).all())
+    assert medal_flags() == flags
+
+    for user_id, user in digest.users.items():
+        results = UserEventResults.query.join(CompetitionEvent).\
+            filter(CompetitionEvent.competition_id == comp_id, UserEventResults.user_id == user_id,
+                   UserEventResults.is_blacklisted.isnot(True)).all()
+        assert user.events_count == len(results)
+        assert len(user.podiums) == len([result for result in results if result.id in expected_medals])
+
+
+def test_wrap_up_ranks_each_event_once(seed_results, mocker):
+    comp_id = __seed_finished_comp(seed_results)
+    posts = list()
+    messages = list()
+    mocker.patch.object(scoring, 'submit_post', lambda title, body: posts.append(body) or 'thread_id')
+    mocker.patch.object(reddit, 'send_pm_to_user', lambda username, title, body: messages.append(username))
+    mocker.patch.object(reddit, 'get_all_user_ids_with_setting_value', lambda *_: [user.id for user in User.query])
+    ranking_spy = mocker.spy(results_digest, 'sort_user_results_with_rankings')
+
+    build_results_digest(comp_id)
+    post_results_thread(comp_id)
+    reddit.prepare_end_of_competition_info_notifications(comp_id)
+
+    assert ranking_spy.call_count == 2
+    assert len(posts) == 1
+    assert len(messages) == 6
+
+
+def test_digest_is_built_again_once_results_change(seed_results, mocker):
+    comp_id = __seed_finished_comp(seed_results)
+    build_results_digest(comp_id)
+    ranking_spy = mocker.spy(results_digest, 'sort_user_results_with_rankings')
+
+    gold_results_id = next(results_id for results_id, medal in get_results_digest(comp_id).medals.items()
+                           if medal == GOLD)
+    assert ranking_spy.call_count == 0
+
+    blacklist_results(gold_results_id, 'hidden')
+    assert gold_results_id not in get_results_digest(comp_id).medals
+    assert ranking_spy.call_count == 2
+
+    # Reading the digest never awards medals, so the blacklisted result keeps its medal until they're recalculated
+    assert DB.session.get(UserEventResults, gold_results_id).was_gold_medal
+
+
+def test_reading_a_digest_never_awards_medals(seed_results):
+    comp_id = __seed_finished_comp(seed_results)
+
+    assert get_results_digest(comp_id).medals
+    assert not UserEventResults.query.filter(UserEventResults.was_gold_medal.is_(True)).count()
+    assert not CompetitionSnapshot.query.count()
@@ -0,0 +1,19 @@
+""" Tests for aggregating a user's history across the competitions. """
+
+from cubersio.business.user_history import get_user_competition_history
+
+
+def test_history_queries_dont_grow_with_competitions(seed_results, select_counter):
+    user, = seed_results(event_names=('3x3', '3BLD', 'MBLD'), comps_count=10)
+
+    with select_counter:
+        history = get_user_competition_history(user)
+        friendly_results = [(results.friendly_single(), results.friendly_average(), results.is_blind)
+                            for comps in history.values() for results in comps.values()]
+
+    assert [event.name for event in history] == ['3x3', '3BLD', 'MBLD']
+    assert [comp.title for comp in history[next(iter(history))]][:2] == ['Competition 9', 'Competition 8']
+    assert len(friendly_results) == 30
+
+    # The user's events, their competitions, and all their results, and nothing per results
+    assert select_counter.count == 3
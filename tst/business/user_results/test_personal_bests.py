@@ -0,0 +1,83 @@
+""" Tests for flagging PBs on results, against a user's current PBs or from scratch. """
+
+import pytest
+
+from cubersio.business.user_results.personal_bests import set_pb_flags, calculate_pb_flags, calculate_latest_pb_flags,\
+    PBFlags
+from cubersio.persistence.models import EventFormat, UserEventPBs, UserEventResults
+
+MODULE = 'cubersio.business.user_results.personal_bests'
+
+
+@pytest.fixture
+def mocked_queries(mocker):
+    """ Patches out everything set_pb_flags looks up, other than the user's current PBs. """
+
+    mocker.patch(MODULE + '.get_event_id_for_name', return_value=99)
+    mocker.patch(MODULE + '.record_personal_best')
+    return (mocker.patch(MODULE + '.get_pb_single_event_results_except_current_comp', return_value=[]),
+            mocker.patch(MODULE + '.get_pb_average_event_results_except_current_comp', return_value=[]))
+
+
+def test_new_results_checked_against_current_pbs(mocker, mocked_queries):
+    pbs = UserEventPBs(single='1000', single_results_id=1, average='1200', average_results_id=2)
+    mocker.patch(MODULE + '.get_user_event_pbs', return_value=pbs)
+
+    results = set_pb_flags(1, UserEventResults(single='1000', average='1300'), 1, EventFormat.Ao5)
+
+    assert results.was_pb_single
+    assert not results.was_pb_average
+    for query in mocked_queries:
+        query.assert_not_called()
+
+
+def test_updated_pb_results_checked_against_previous_pbs(mocker, mocked_queries):
+    pbs = UserEventPBs(single='900', single_results_id=5, average='1200', average_results_id=2)
+    mocker.patch(MODULE + '.get_user_event_pbs', return_value=pbs)
+    mocked_queries[0].return_value = [UserEventResults(single='1000'), UserEventResults(single='950')]
+
+    # These results set the current PB single, and now they're slower, but still faster than the PB before that
+    results = set_pb_flags(1, UserEventResults(id=5, single='940', average='1250'), 1, EventFormat.Ao5)
+
+    assert results.was_pb_single
+    assert not results.was_pb_average
+    mocked_queries[0].assert_called_once_with(1, 1)
+    mocked_queries[1].assert_not_called()
+
+
+def test_first_results_are_pbs(mocker, mocked_queries):
+    mocker.patch(MODULE + '.get_user_event_pbs', return_value=None)
+
+    results = set_pb_flags(1, UserEventResults(single='DNF', average='DNF'), 1, EventFormat.Ao5)
+
+    assert results.was_pb_single
+    assert results.was_pb_average
+
+
+def test_pb_flags_follow_dnf_and_tie_rules():
+    results = [UserEventResults(single='DNF', average='DNF', is_blacklisted=False),
+               UserEventResults(single='DNF', average='DNF', is_blacklisted=False),
+               UserEventResults(single='1000', average='1200', is_blacklisted=False),
+               UserEventResults(single='900', average='1100', is_blacklisted=True),
+               UserEventResults(single='1000', average='1300', is_blacklisted=False)]
+
+    flags = calculate_pb_flags(results, EventFormat.Ao5)
+
+    # Only the first DNF counts, blacklisted results never count, and ties with the current PB count
+    assert [f.was_pb_single for f in flags] == [True, False, True, False, True]
+    assert [f.was_pb_average for f in flags] == [True, False, True, False, False]
+    assert [f.is_latest_pb_single for f in flags] == [False, False, False, False, True]
+    assert [f.is_latest_pb_average for f in flags] == [False, False, True, False, False]
+
+    bo1_flags = calculate_pb_flags(results, EventFormat.Bo1)
+    assert not any(f.was_pb_average or f.is_latest_pb_average for f in bo1_flags)
+
+
+def test_latest_pb_flags_keep_existing_pb_flags():
+    results = [UserEventResults(was_pb_single=True, was_pb_average=True),
+               UserEventResults(was_pb_single=False, was_pb_average=True),
+               UserEventResults(was_pb_single=True, was_pb_average=None)]
+
+    assert calculate_latest_pb_flags(results) == [PBFlags(True, True, False, False),
+                                                  PBFlags(False, True, False, True),
+                                                  PBFlags(True, False, True, False)]
@@ -0,0 +1,95 @@
+""" Shared fixtures for tests which need a database. """
+
+import os
+
+# Point the app at an in-memory SQLite database before anything imports it, so tests never touch a real database, give
+# it a secret key so tests can log in, and load PB rank indexes right away rather than in threads the test can't see
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('FLASK_SECRET_KEY', 'tests')
+os.environ['RANK_INDEX_LOAD_IN_BACKGROUND'] = 'false'
+
+import pytest
+from sqlalchemy import event
+
+from cubersio import app, DB
+from cubersio.persistence.events_manager import reload_event_metadata
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, EventFormat, User, UserEventResults
+
+
+class StatementCounter:
+    """ Counts the SQL statements run against the database while it's active, for keeping an eye on how many each
+    operation takes. """
+
+    def __init__(self, statement_types=None):
+        self.statement_types = statement_types
+        self.count = 0
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(DB.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(DB.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.statement_types or statement.split(None, 1)[0].upper() in self.statement_types:
+            self.count += 1
+
+
+@pytest.fixture
+def db():
+    """ An empty database with all the tables created, for the duration of one test. """
+
+    with app.app_context():
+        DB.create_all()
+        reload_event_metadata()
+        yield DB
+        DB.session.remove()
+        DB.drop_all()
+
+
+@pytest.fixture
+def select_counter(db):
+    """ Counts SELECTs, for catching N+1 queries. """
+
+    return StatementCounter(statement_types={'SELECT'})
+
+
+@pytest.fixture
+def statement_counter(db):
+    """ Counts every statement, reads and writes. """
+
+    return StatementCounter()
+
+
+@pytest.fixture
+def seed_results(db):
+    """ Returns a function which seeds the database with competitions of the specified events, with complete results
+    in every event of every competition for each user, and returns the users. The session is cleared afterwards, so
+    nothing seeded is already loaded. """
+
+    def seed(event_names=('3x3', 'FMC', 'MBLD'), comps_count=1, users_count=1):
+        events = [Event(name=name, totalSolves=5, eventFormat=EventFormat.Ao5) for name in event_names]
+        users  = [User(username=f'user{i}') for i in range(users_count)]
+        DB.session.add_all(events + users)
+
+        for i in range(comps_count):
+            comp = Competition(title=f'Competition {i}', active=i == comps_count - 1)
+            DB.session.add(comp)
+            for event in events:
+                comp_event = CompetitionEvent(Competition=comp, Event=event)
+                DB.session.add(comp_event)
+                DB.session.flush()
+                for user in users:
+                    DB.session.add(UserEventResults(user_id=user.id, comp_event_id=comp_event.id, event_id=event.id,
+                                                    single='1000', average='1200', result='1200', is_complete=True,
+                                                    times_string='10.00, 12.00, 12.00, 12.00, 14.00'))
+
+        DB.session.commit()
+        user_ids = [user.id for user in users]
+        DB.session.expunge_all()
+
+        return [DB.session.get(User, user_id) for user_id in user_ids]
+
+    return seed
@@ -0,0 +1,53 @@
+""" Tests for retrieving Events and their metadata. """
+
+from cubersio import DB
+from cubersio.persistence.events_manager import get_all_bonus_events, get_all_event_metadata_in_sort_order,\
+    get_all_WCA_events, get_event_format_for_event, get_event_id_for_name, get_event_metadata_by_name,\
+    get_events_name_id_mapping, reload_event_metadata
+from cubersio.persistence.models import Event, EventFormat
+
+
+def __add_events(*names):
+    DB.session.add_all([Event(name=name, totalSolves=5, eventFormat=EventFormat.Ao5) for name in names])
+    DB.session.commit()
+
+
+def test_event_metadata_is_only_queried_once(db, select_counter):
+    __add_events('3x3', 'FMC', 'F2L')
+
+    with select_counter:
+        for _ in range(3):
+            get_all_bonus_events()
+            get_all_WCA_events()
+            get_events_name_id_mapping()
+            get_event_id_for_name('FMC')
+            get_event_format_for_event(1)
+
+    assert select_counter.count == 1
+
+
+def test_event_metadata_combines_records_and_definitions(db):
+    __add_events('F2L', '3x3', 'FTO', 'FMC')
+
+    fmc = get_event_metadata_by_name('FMC')
+    assert (fmc.id, fmc.totalSolves, fmc.eventFormat) == (4, 5, EventFormat.Ao5)
+    assert (fmc.is_wca, fmc.is_weekly, fmc.is_bonus) == (True, True, False)
+
+    f2l = get_event_metadata_by_name('F2L')
+    assert (f2l.is_wca, f2l.is_weekly, f2l.is_bonus) == (False, False, True)
+
+    assert [e.name for e in get_all_WCA_events()] == ['3x3', 'FMC']
+    assert [e.name for e in get_all_bonus_events()] == ['F2L']
+    assert list(get_events_name_id_mapping().items()) == [('F2L', 1), ('3x3', 2), ('FTO', 3), ('FMC', 4)]
+    assert [e.name for e in get_all_event_metadata_in_sort_order()] == ['3x3', 'FMC', 'FTO', 'F2L']
+
+
+def test_reloading_event_metadata_picks_up_new_events(db):
+    __add_events('3x3')
+    assert get_event_id_for_name('2x2') is None
+
+    __add_events('2x2')
+    assert get_event_id_for_name('2x2') is None
+
+    reload_event_metadata()
+    assert get_event_id_for_name('2x2') == 2
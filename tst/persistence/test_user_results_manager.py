@@ -0,0 +1,166 @@
+""" Tests for persisting and retrieving UserEventResults. """
+
+import pytest
+
+from cubersio import DB
+from cubersio.business.user_results.personal_bests import recalculate_all_pbs, set_pb_flags
+from cubersio.persistence import user_results_manager
+from cubersio.persistence.models import EventFormat, UserEventPBs, UserEventResults
+from cubersio.persistence.user_results_manager import get_all_complete_user_results_for_comp_event,\
+    get_ranked_results_for_comp_event, get_user_ranks_for_comp_event, save_event_results, blacklist_results,\
+    delete_event_results
+from cubersio.util.sorting import sort_user_results_with_rankings
+
+
+def test_loading_results_doesnt_load_their_events(seed_results, select_counter):
+    seed_results(event_names=('3x3', 'FMC'), comps_count=3, users_count=3)
+
+    with select_counter:
+        results = UserEventResults.query.all()
+
+    assert len(results) == 18
+    assert select_counter.count == 1
+
+
+def test_comp_event_leaderboard_queries_dont_grow_with_users(seed_results, select_counter):
+    seed_results(event_names=('3x3', 'FMC'), users_count=25)
+
+    with select_counter:
+        results = get_all_complete_user_results_for_comp_event(2)
+        rows = [(results.User.username, results.friendly_single(), results.friendly_average(), results.is_fmc)
+                for results in results]
+
+    assert len(rows) == 25
+    assert all(row[1:] == (10, 12, True) for row in rows)
+
+    # The results along with their users and competition event, and then the event, and nothing per results
+    assert select_counter.count == 2
+
+
+def test_results_ranked_by_the_database_match_sorting_them(seed_results):
+    seed_results(event_names=('3x3',), users_count=10)
+    for i, results in enumerate(UserEventResults.query.order_by(UserEventResults.id)):
+        results.result = results.average = 'DNF' if i in (2, 7) else str(1000 + (i % 4) * 100)
+        results.single = str(900 - (i % 3) * 50)
+        results.is_blacklisted = i == 4
+    DB.session.commit()
+
+    ranked_results = get_ranked_results_for_comp_event(1)
+    unblacklisted = [results for _, results in ranked_results if not results.is_blacklisted]
+    expected = [(rank, results.result, results.single) for rank, _, results in
+                sort_user_results_with_rankings(list(unblacklisted), EventFormat.Ao5)]
+
+    assert [(rank, results.result, results.single) for rank, results in ranked_results if rank] == expected
+    assert [rank for rank, results in ranked_results if results.is_blacklisted] == [None]
+
+
+def test_results_ranked_without_window_functions_match_ranking_them_in_the_database(seed_results, mocker):
+    seed_results(event_names=('3x3',), users_count=10)
+    for i, results in enumerate(UserEventResults.query.order_by(UserEventResults.id)):
+        results.result = results.average = 'DNF' if i in (2, 7) else str(1000 + (i % 4) * 100)
+        results.single = str(900 - (i % 3) * 50)
+        results.is_blacklisted = i in (0, 4)
+    DB.session.commit()
+
+    ranked_results = [(rank, results.id) for rank, results in get_ranked_results_for_comp_event(1)]
+    user_ranks = sorted(tuple(row) for row in get_user_ranks_for_comp_event(1))
+
+    mocker.patch.object(user_results_manager, 'database_supports_window_functions', return_value=False)
+    assert [(rank, results.id) for rank, results in get_ranked_results_for_comp_event(1)] == ranked_results
+    assert sorted(get_user_ranks_for_comp_event(1)) == user_ranks
+
+
+def test_results_longer_than_32_bits_are_ranked_before_dnfs(seed_results):
+    seed_results(event_names=('3x3',), users_count=3)
+    for results, result in zip(UserEventResults.query.order_by(UserEventResults.id), ('DNF', '9999999999', '1000')):
+        results.result = results.average = results.single = result
+    DB.session.commit()
+
+    assert DB.session.get(UserEventResults, 2).result_key == 9999999999
+    assert [results.result for _, results in get_ranked_results_for_comp_event(1)] == ['1000', '9999999999', 'DNF']
+
+
+def __seed_pb_history(seed_results):
+    """ Seeds one user's 3x3 results across a few competitions, with everybody's PB flags and current PBs worked out
+    from scratch. Returns the results in the active competition, which are the latest. """
+
+    seed_results(event_names=('3x3',), comps_count=4)
+    for results, (single, average) in zip(UserEventResults.query.order_by(UserEventResults.id),
+                                          (('1000', '1200'), ('900', '1100'), ('950', '1150'), ('1000', '1200'))):
+        results.single, results.average, results.result = single, average, average
+    DB.session.commit()
+    recalculate_all_pbs()
+    DB.session.expire_all()
+
+    return UserEventResults.query.order_by(UserEventResults.id.desc()).first()
+
+
+def __pb_flags_and_pbs():
+    """ Returns the PB flags of every results, and the current PBs, as they are in the database. """
+
+    DB.session.expire_all()
+    flags = [(results.was_pb_single, results.was_pb_average, results.is_latest_pb_single, results.is_latest_pb_average)
+             for results in UserEventResults.query.order_by(UserEventResults.id)]
+    pbs = [(pbs.single, pbs.single_results_id, pbs.average, pbs.average_results_id) for pbs in UserEventPBs.query]
+
+    return flags, pbs
+
+
+def __assert_matches_recalculating_from_scratch():
+    incremental = __pb_flags_and_pbs()
+    recalculate_all_pbs()
+    assert incremental == __pb_flags_and_pbs()
+
+
+@pytest.mark.parametrize('single, average', [
+    ('800', '1000'),   # New PBs
+    ('900', '1100'),   # Equal to the PBs, which counts as PBs
+    ('1000', '1200'),  # Not PBs
+    ('800', '1300'),   # Just a new PB single
+    ('DNF', 'DNF'),
+])
+def test_pb_flags_kept_up_to_date_match_recalculating_them(seed_results, single, average):
+    results = __seed_pb_history(seed_results)
+
+    results.single, results.average, results.result = single, average, average
+    save_event_results(set_pb_flags(results.user_id, results, results.event_id, EventFormat.Ao5), results.event_id)
+
+    __assert_matches_recalculating_from_scratch()
+
+
+def test_pb_flags_kept_up_to_date_when_pb_results_become_incomplete(seed_results):
+    results = __seed_pb_history(seed_results)
+    results.single, results.average, results.result = '800', '1000', '1000'
+    save_event_results(set_pb_flags(results.user_id, results, results.event_id, EventFormat.Ao5), results.event_id)
+
+    # Like when a solve is deleted, which leaves the PB flags as they were. The results are loaded first, just like
+    # they are when a solve is deleted.
+    DB.session.refresh(results)
+    results.is_complete = False
+    save_event_results(results, results.event_id)
+
+    __assert_matches_recalculating_from_scratch()
+
+
+def test_pb_flags_kept_up_to_date_when_pb_results_are_deleted(seed_results):
+    results = __seed_pb_history(seed_results)
+    results.single, results.average, results.result = '800', '1000', '1000'
+    save_event_results(set_pb_flags(results.user_id, results, results.event_id, EventFormat.Ao5), results.event_id)
+
+    delete_event_results(results)
+
+    __assert_matches_recalculating_from_scratch()
+
+
+def test_current_pbs_kept_up_to_date_when_pb_results_are_blacklisted(seed_results):
+    results = __seed_pb_history(seed_results)
+    previous_pb_id = UserEventResults.query.filter_by(is_latest_pb_single=True).one().id
+
+    blacklist_results(previous_pb_id, 'hidden')
+
+    # Blacklisting queues a recalculation of the PB flags themselves, but the current PBs are up to date with the flags
+    # as they are right away
+    pbs = __pb_flags_and_pbs()[1]
+    recalculate_all_pbs(latest_only=True)
+    assert pbs == __pb_flags_and_pbs()[1]
+    assert pbs[0][1] != previous_pb_id
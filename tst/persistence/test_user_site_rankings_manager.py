@@ -0,0 +1,77 @@
+""" Tests for persisting and retrieving UserSiteRankings and UserEventSiteRankings. """
+
+import json
+
+from cubersio import DB
+from cubersio.persistence.models import Event, EventFormat, SiteRankingsDirtyEvent, User, UserEventSiteRankings,\
+    UserSiteRankings
+from cubersio.persistence.user_site_rankings_manager import bulk_update_site_rankings,\
+    clear_site_rankings_dirty_events, get_event_site_rankings_for_user, get_site_rankings_dirty_events,\
+    get_site_rankings_for_user
+
+
+def __site_rankings(user_id, rankings_data):
+    site_rankings = UserSiteRankings(user_id=user_id, sum_all_single=0, sum_all_average=0, sum_wca_single=0,
+                                     sum_wca_average=0, sum_non_wca_single=0, sum_non_wca_average=0,
+                                     all_kinchrank=0, wca_kinchrank=0, non_wca_kinchrank=0)
+    site_rankings.data = json.dumps(rankings_data)
+    return site_rankings
+
+
+def __add_users_and_events(users_count, events_count):
+    DB.session.add_all([User(username=f'user{i}') for i in range(users_count)] +
+                       [Event(name=f'event{i}', totalSolves=5, eventFormat=EventFormat.Ao5) for i in range(events_count)])
+    DB.session.commit()
+
+
+def test_event_site_rankings_are_saved_alongside_site_rankings(db):
+    __add_users_and_events(2, 3)
+    saved_count = bulk_update_site_rankings([
+        __site_rankings(1, {3: ('1000', 1, '1200', 1, '100.000'), 1: ('', 3, '', 2, '0.000')}),
+        __site_rankings(2, {1: ('900', 1, 'DNF', 1, '50.500')}),
+    ])
+
+    assert saved_count == 2
+    assert get_event_site_rankings_for_user(1) == {1: ('', 3, '', 2, '0.000'), 3: ('1000', 1, '1200', 1, '100.000')}
+    assert get_event_site_rankings_for_user(2) == {1: ('900', 1, 'DNF', 1, '50.500')}
+    assert DB.session.get(UserEventSiteRankings, (2, 1)).kinch == 50.5
+
+
+def test_saving_site_rankings_again_replaces_event_site_rankings(db):
+    __add_users_and_events(1, 3)
+    bulk_update_site_rankings([__site_rankings(1, {1: ('1000', 1, '1200', 1, '100.000'),
+                                                   2: ('1000', 2, '1200', 2, '90.000')})])
+    bulk_update_site_rankings([__site_rankings(1, {2: ('900', 1, '1100', 1, '100.000'),
+                                                   3: ('800', 1, '', 1, '100.000')})])
+
+    assert get_event_site_rankings_for_user(1) == {2: ('900', 1, '1100', 1, '100.000'),
+                                                   3: ('800', 1, '', 1, '100.000')}
+    assert UserSiteRankings.query.count() == 1
+
+
+def test_site_rankings_for_lots_of_events_are_saved(db):
+    __add_users_and_events(1, 150)
+    rankings_data = {event_id: ('123456789', 1000, '123456789', 1000, '99.999') for event_id in range(1, 151)}
+    bulk_update_site_rankings([__site_rankings(1, rankings_data)])
+
+    # SQLite doesn't enforce column lengths, so make sure there isn't one for any other database to enforce
+    assert UserSiteRankings.__table__.c.data.type.length is None
+    assert len(get_site_rankings_for_user(1).data) > 2048
+    assert len(get_event_site_rankings_for_user(1)) == 150
+
+
+def test_clearing_dirty_events_only_clears_the_ones_seen(db):
+    __add_users_and_events(1, 3)
+    DB.session.add_all([SiteRankingsDirtyEvent(id=1, user_id=1, event_id=1),
+                        SiteRankingsDirtyEvent(id=3, user_id=1, event_id=2)])
+    DB.session.commit()
+
+    record_ids, event_ids = get_site_rankings_dirty_events()
+    assert event_ids == {1, 2}
+
+    # As if a transaction which got an earlier ID committed after the dirty events were read
+    DB.session.add(SiteRankingsDirtyEvent(id=2, user_id=1, event_id=3))
+    DB.session.commit()
+
+    clear_site_rankings_dirty_events(record_ids)
+    assert get_site_rankings_dirty_events() == ([2], {3})
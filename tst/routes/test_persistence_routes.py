@@ -0,0 +1,165 @@
+""" Tests for the routes which save results. """
+
+import json
+
+import pytest
+
+from cubersio import app, DB
+from cubersio.persistence.cache_generations_manager import get_cache_generation, comp_event_results_cache_key,\
+    event_results_cache_key
+from cubersio.persistence.models import Competition, CompetitionEvent, Event, EventFormat, Scramble, User,\
+    UserEventResults, UserSolve, SiteRankingsDirtyEvent
+from cubersio.persistence.settings_manager import get_bulk_settings_for_user_as_dict
+from cubersio.routes.persistence import persistence_routes
+from cubersio.routes.persistence.persistence_routes import MAX_STATEMENTS_PER_SOLVE_POST
+from cubersio.routes.timer.timer_routes import SETTINGS_TO_POPULATE
+
+
+@pytest.fixture
+def comp_event_and_client(db):
+    """ An Ao5 competition event in the active competition, and a test client logged in as a user whose timer page
+    settings have already been set up. """
+
+    event = Event(name='3x3', totalSolves=5, eventFormat=EventFormat.Ao5)
+    comp_event = CompetitionEvent(Competition=Competition(title='Competition', active=True), Event=event,
+                                  scrambles=[Scramble(scramble=f'R U{i}') for i in range(5)])
+    user = User(username='user')
+    DB.session.add_all([comp_event, user])
+    DB.session.commit()
+    comp_event_id, scramble_ids, user_id = comp_event.id, [s.id for s in comp_event.scrambles], user.id
+    get_bulk_settings_for_user_as_dict(user_id, SETTINGS_TO_POPULATE)
+    DB.session.remove()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+    return comp_event_id, scramble_ids, client
+
+
+def __post_solve(client, comp_event_id, scramble_id, centiseconds):
+    solve = dict(is_dnf=False, is_plus_two=False, scramble_id=scramble_id, comp_event_id=comp_event_id,
+                 elapsed_centiseconds=centiseconds)
+    return client.post('/post_solve', data=json.dumps(solve))
+
+
+def test_posting_solves_stays_within_statement_budget(comp_event_and_client, statement_counter):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+
+    counts = list()
+    for i, scramble_id in enumerate(scramble_ids):
+        with statement_counter:
+            response = __post_solve(client, comp_event_id, scramble_id, 1000 + i * 100)
+        assert response.status_code == 200
+        counts.append(statement_counter.count)
+
+    assert json.loads(response.data)['is_complete']
+    assert max(counts) <= MAX_STATEMENTS_PER_SOLVE_POST
+
+    # Nothing about the user's PBs is worked out until the event is complete
+    assert len(set(counts[1:-1])) == 1
+    assert counts[-1] > counts[-2]
+
+
+def test_only_posting_a_pb_marks_site_rankings_dirty(comp_event_and_client):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+    event_id = CompetitionEvent.query.one().event_id
+
+    for i, scramble_id in enumerate(scramble_ids[:-1]):
+        __post_solve(client, comp_event_id, scramble_id, 1000 + i * 100)
+
+    # Incomplete results can't be a PB, so nothing cached from the event's PBs is out of date
+    assert SiteRankingsDirtyEvent.query.count() == 0
+    assert get_cache_generation(event_results_cache_key(event_id)) == 0
+
+    __post_solve(client, comp_event_id, scramble_ids[-1], 1400)
+    assert SiteRankingsDirtyEvent.query.count() == 1
+    assert get_cache_generation(event_results_cache_key(event_id)) == 1
+
+
+def test_posting_a_solve_twice_only_saves_it_once(comp_event_and_client):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+
+    __post_solve(client, comp_event_id, scramble_ids[0], 1000)
+    response = __post_solve(client, comp_event_id, scramble_ids[0], 2000)
+
+    assert response.status_code == 200
+    assert [solve.time for solve in UserSolve.query.all()] == [1000]
+
+
+def test_racing_requests_only_create_results_once(comp_event_and_client, mocker):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+    __post_solve(client, comp_event_id, scramble_ids[0], 1000)
+
+    # As if another request created the results between this one looking for them and saving them
+    mocker.patch('cubersio.routes.persistence.persistence_routes.get_event_results_for_user', return_value=None)
+    response = __post_solve(client, comp_event_id, scramble_ids[1], 2000)
+
+    assert response.status_code == 200
+    assert UserEventResults.query.count() == 1
+    assert [solve.time for solve in UserSolve.query.all()] == [1000]
+
+
+def __post_solves(client, comp_event_id, scramble_ids, first_centiseconds=1000):
+    solves = [dict(is_dnf=False, is_plus_two=False, scramble_id=scramble_id, comp_event_id=comp_event_id,
+                   elapsed_centiseconds=first_centiseconds + i * 100) for i, scramble_id in enumerate(scramble_ids)]
+    return client.post('/post_solves', data=json.dumps(solves))
+
+
+def test_posting_a_batch_of_solves_processes_results_once(comp_event_and_client, statement_counter, mocker):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+    __post_solve(client, comp_event_id, scramble_ids[0], 1000)
+
+    process_spy = mocker.spy(persistence_routes, 'process_event_results')
+    with statement_counter:
+        response = __post_solves(client, comp_event_id, scramble_ids[1:] + scramble_ids[:1], first_centiseconds=1100)
+
+    assert response.status_code == 200
+    assert json.loads(response.data)[str(comp_event_id)]['is_complete']
+    assert [solve.time for solve in UserSolve.query.order_by(UserSolve.id)] == [1000, 1100, 1200, 1300, 1400]
+    assert UserEventResults.query.one().average == '1200'
+
+    # Completing the event in one go costs no more than completing it with the last solve, plus inserting the others
+    batch_size = len(scramble_ids) - 1
+    assert process_spy.call_count == 1
+    assert statement_counter.count <= MAX_STATEMENTS_PER_SOLVE_POST + batch_size - 1
+
+
+def test_invalid_batch_of_solves_saves_nothing(comp_event_and_client):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+    solves = [dict(is_dnf=False, is_plus_two=False, scramble_id=scramble_ids[0], comp_event_id=comp_event_id,
+                   elapsed_centiseconds=1000),
+              dict(is_dnf=False, is_plus_two=False, scramble_id=scramble_ids[1], comp_event_id=comp_event_id + 1,
+                   elapsed_centiseconds=1000)]
+
+    response = client.post('/post_solves', data=json.dumps(solves))
+
+    assert response.status_code == 404
+    assert UserSolve.query.count() == 0
+
+
+def test_only_leaderboard_changes_prepare_the_leaderboard_again(comp_event_and_client):
+    comp_event_id, scramble_ids, client = comp_event_and_client
+    leaderboard_key = comp_event_results_cache_key(comp_event_id)
+
+    # Incomplete results aren't on the leaderboard
+    for i, scramble_id in enumerate(scramble_ids[:-1]):
+        __post_solve(client, comp_event_id, scramble_id, 1000 + i * 100)
+    assert get_cache_generation(leaderboard_key) == 0
+
+    __post_solve(client, comp_event_id, scramble_ids[-1], 1400)
+    assert get_cache_generation(leaderboard_key) == 1
+
+    client.post('/apply_comment', data=json.dumps(dict(comp_event_id=comp_event_id, comment='Nice')))
+    assert get_cache_generation(leaderboard_key) == 2
+
+    # Applying the same comment again doesn't change anything shown
+    client.post('/apply_comment', data=json.dumps(dict(comp_event_id=comp_event_id, comment='Nice')))
+    assert get_cache_generation(leaderboard_key) == 2
+
+    # Taking the results off the leaderboard changes it, but changing them while they're off it doesn't
+    client.post('/delete_prev_solve', data=json.dumps(dict(comp_event_id=comp_event_id)))
+    assert get_cache_generation(leaderboard_key) == 3
+
+    client.post('/delete_prev_solve', data=json.dumps(dict(comp_event_id=comp_event_id)))
+    assert get_cache_generation(leaderboard_key) == 3
@@ -0,0 +1,29 @@
+""" Tests for the tasks related to creating and scoring competitions. """
+
+from cubersio.persistence.models import Competition
+from cubersio.tasks import huey, competition_management
+from cubersio.tasks.competition_management import run_user_site_rankings, refresh_current_competition_overall_points
+
+# Put Huey in immediate mode so the tasks execute synchronously
+huey.immediate = True
+
+
+def test_site_rankings_run_is_skipped_while_another_is_running(mocker, capsys):
+    calculate = mocker.patch.object(competition_management, 'calculate_user_site_rankings')
+
+    # Run it directly, since Huey would swallow anything it raised
+    with huey.lock_task('site_rankings'):
+        run_user_site_rankings.call_local(incremental=True)
+    assert calculate.call_count == 0
+    assert 'skipping this incremental run' in capsys.readouterr().out
+
+    run_user_site_rankings.call_local(incremental=True)
+    calculate.assert_called_once_with(incremental=True)
+
+
+def test_only_the_current_competitions_overall_points_are_refreshed(seed_results, mocker):
+    seed_results(comps_count=2)
+    refresh = mocker.patch.object(competition_management, 'refresh_overall_points')
+
+    refresh_current_competition_overall_points.call_local()
+    refresh.assert_called_once_with(Competition.query.filter(Competition.active).one().id)
@@ -0,0 +1,108 @@
+""" Tests for the tasks which recalculate data derived from users' results after moderating them. """
+
+from datetime import datetime
+import json
+
+import pytest
+
+from cubersio import app, DB
+from cubersio.persistence.models import PendingRecalculation, UserEventResults, UserEventPBs
+from cubersio.persistence.pending_recalculations_manager import get_pending_recalculation_generation,\
+    user_event_pbs_recalculation_key, STALE_RECALCULATION_AGE
+from cubersio.tasks import huey, recalculation
+from cubersio.tasks.recalculation import queue_user_pbs_recalculation
+
+# Put Huey in immediate mode so the tasks execute synchronously
+huey.immediate = True
+
+
+@pytest.fixture
+def admin_client_and_results(seed_results):
+    """ A finished competition with 3x3 results for two users, the second of whom won, and a test client logged in as
+    the first, who is an admin. Returns the client, and the IDs of the loser's and winner's results. """
+
+    users = seed_results(event_names=('3x3',), comps_count=2, users_count=2)
+    users[0].is_admin = True
+
+    # The first competition seeded is the finished one
+    loser, winner = [UserEventResults.query.filter_by(user_id=user.id).order_by(UserEventResults.id).first()
+                     for user in users]
+    winner.single, winner.average, winner.result = '900', '1000', '1000'
+    winner.was_gold_medal = True
+    DB.session.commit()
+
+    admin_id, results_ids = users[0].id, (loser.id, winner.id)
+    DB.session.remove()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+
+    return client, results_ids
+
+
+def test_requests_for_pending_recalculation_are_coalesced(db, mocker):
+    task = mocker.patch.object(recalculation, 'recalculate_user_pbs_task')
+
+    for _ in range(3):
+        queue_user_pbs_recalculation(1, 2)
+    queue_user_pbs_recalculation(1, 3)
+
+    assert task.call_count == 2
+    assert get_pending_recalculation_generation(user_event_pbs_recalculation_key(1, 2)) == 3
+
+
+def test_requests_are_coalesced_again_after_replacing_a_lost_task(db, mocker):
+    task = mocker.patch.object(recalculation, 'recalculate_user_pbs_task')
+    queue_user_pbs_recalculation(1, 2)
+
+    # As if the task queued for it was lost a while ago
+    pending = DB.session.get(PendingRecalculation, user_event_pbs_recalculation_key(1, 2))
+    pending.timestamp = datetime.now() - 2 * STALE_RECALCULATION_AGE
+    DB.session.commit()
+
+    for _ in range(3):
+        queue_user_pbs_recalculation(1, 2)
+
+    assert task.call_count == 2
+
+
+def test_recalculation_runs_again_when_requested_while_running(db, mocker):
+    def request_again_the_first_time(user_id, event_id):
+        if recalculate.call_count == 1:
+            queue_user_pbs_recalculation(user_id, event_id)
+
+    recalculate = mocker.patch.object(recalculation, 'recalculate_user_pbs_for_event',
+                                      side_effect=request_again_the_first_time)
+
+    queue_user_pbs_recalculation(1, 2)
+
+    assert recalculate.call_count == 2
+    assert get_pending_recalculation_generation(user_event_pbs_recalculation_key(1, 2)) is None
+
+
+def test_blacklisting_reports_recalculations_pending_until_they_run(admin_client_and_results, mocker):
+    client, (_, winner_id) = admin_client_and_results
+    mocker.patch.object(recalculation, 'recalculate_user_pbs_task')
+    mocker.patch.object(recalculation, 'recalculate_comp_event_medals_task')
+
+    assert client.get(f'/results/blacklist/{winner_id}/').status_code == 202
+
+    status = json.loads(client.get('/admin/api/pending_recalculations/').data)
+    assert not status['is_consistent']
+    assert len(status['pending']) == 2
+
+
+def test_blacklisting_recalculates_pbs_and_medals(admin_client_and_results):
+    client, (loser_id, winner_id) = admin_client_and_results
+
+    assert client.get(f'/results/blacklist/{winner_id}/').status_code == 202
+
+    assert json.loads(client.get('/admin/api/pending_recalculations/').data)['is_consistent']
+    DB.session.remove()
+    assert DB.session.get(UserEventResults, loser_id).was_gold_medal
+    assert not DB.session.get(UserEventResults, winner_id).was_gold_medal
+
+    # The winner's PBs now come from their other results
+    pbs = UserEventPBs.query.one()
+    assert pbs.average == '1200' and pbs.average_results_id != winner_id
@@ -0,0 +1,72 @@
+""" Tests for the in-process caching utilities. """
+
+from threading import Event, Thread
+
+import pytest
+
+from cubersio.util.cache import GenerationalCache
+
+
+def test_value_is_reused_until_generation_changes():
+    cache = GenerationalCache(max_entries=4)
+    loads = list()
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get('a', 0, loader) == 1
+    assert cache.get('a', 0, loader) == 1
+    assert cache.get('a', 1, loader) == 2
+    assert cache.get('a', 1, loader) == 2
+    assert len(loads) == 2
+
+
+def test_least_recently_used_value_is_evicted():
+    cache = GenerationalCache(max_entries=2)
+
+    cache.get('a', 0, lambda: 'a')
+    cache.get('b', 0, lambda: 'b')
+    cache.get('a', 0, lambda: 'reloaded a')
+    cache.get('c', 0, lambda: 'c')
+
+    assert cache.get('a', 0, lambda: 'reloaded a') == 'a'
+    assert cache.get('b', 0, lambda: 'reloaded b') == 'reloaded b'
+
+
+def test_concurrent_lookups_build_the_value_once():
+    cache = GenerationalCache(max_entries=4)
+    loading = Event()
+    finish_loading = Event()
+    loads = list()
+
+    def slow_loader():
+        loads.append(1)
+        loading.set()
+        finish_loading.wait()
+        return 'value'
+
+    values = list()
+    threads = [Thread(target=lambda: values.append(cache.get('a', 0, slow_loader))) for _ in range(8)]
+    threads[0].start()
+    loading.wait()
+    for thread in threads[1:]:
+        thread.start()
+    finish_loading.set()
+    for thread in threads:
+        thread.join()
+
+    assert values == ['value'] * 8
+    assert len(loads) == 1
+
+
+def test_failed_load_is_not_cached():
+    cache = GenerationalCache(max_entries=4)
+
+    def failing_loader():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        cache.get('a', 0, failing_loader)
+
+    assert cache.get('a', 0, lambda: 'a') == 'a'
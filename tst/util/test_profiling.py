@@ -0,0 +1,58 @@
+""" Tests for the job instrumentation utilities. """
+
+from time import sleep
+
+import pytest
+
+from cubersio import app
+from cubersio.util.profiling import JobProfiler
+
+
+@pytest.fixture
+def profiler():
+    with app.app_context():
+        with JobProfiler(trace_memory=False) as job_profiler:
+            yield job_profiler
+
+
+def test_nested_phase_time_only_counts_toward_inner_phase(profiler):
+    with profiler.phase('outer'):
+        with profiler.phase('inner'):
+            sleep(0.05)
+
+    assert profiler.phases['inner'].wall_seconds >= 0.05
+    assert profiler.phases['outer'].wall_seconds < 0.05
+
+
+def test_phases_accumulate_and_can_be_renamed(profiler):
+    for name in ('a', 'b', 'a'):
+        with profiler.phase('fetch') as phase:
+            phase.name = f'fetch:{name}'
+            phase.rows = 2
+
+    assert list(profiler.phases.keys()) == ['fetch:a', 'fetch:b']
+    assert profiler.phases['fetch:a'].rows == 4
+    assert profiler.phases['fetch:b'].rows == 2
+
+
+def test_iterate_counts_a_row_per_item(profiler):
+    with profiler.phase('consumer'):
+        items = list(profiler.iterate(range(5), 'producer'))
+
+    assert items == list(range(5))
+    assert profiler.phases['producer'].rows == 5
+    assert profiler.phases['consumer'].rows == 0
+
+
+def test_memory_is_only_recorded_when_traced(profiler):
+    with profiler.phase('untraced'):
+        pass
+
+    with app.app_context():
+        with JobProfiler(trace_memory=True) as tracing_profiler:
+            with tracing_profiler.phase('traced'):
+                junk = [str(i) for i in range(10000)]
+
+    assert profiler.phases['untraced'].peak_memory_kb is None
+    assert tracing_profiler.phases['traced'].peak_memory_kb > 0
+    assert junk
@@ -1,12 +1,17 @@
 """ Tests for custom sorting functions for sorting cubers.io domain objects. """
 
 import pytest
+from functools import cmp_to_key
 from itertools import permutations
+import os
+import random
+import timeit
+
+from ranking import Ranking
 
 from cubersio.business.rankings import PersonalBestRecord
 from cubersio.persistence.models import UserEventResults, EventFormat
-from cubersio.util.sorting import sort_personal_best_records, __sort_user_event_results_by_result, \
-    __sort_user_event_results_by_single, sort_user_results_with_rankings
+from cubersio.util.sorting import sort_personal_best_records, sort_user_results_with_rankings, rank_sorted
 
 
 _PB1 = PersonalBestRecord(personal_best=500)
@@ -32,14 +37,22 @@ _UNSORTED_RESULTS = [_RESULT1, _RESULT2, _RESULT3, _RESULT4]
 _CORRECTLY_SORTED_RESULTS = [_RESULT2, _RESULT1, _RESULT4, _RESULT3]
 
 
+@pytest.mark.parametrize('event_format', [EventFormat.Bo1, EventFormat.Mo3, EventFormat.Ao5])
 @pytest.mark.parametrize('unsorted_results', permutations(_UNSORTED_RESULTS))
-def test_sort_user_event_results_by_result(unsorted_results):
-    assert sorted(unsorted_results, key=__sort_user_event_results_by_result) == _CORRECTLY_SORTED_RESULTS
-
-
-@pytest.mark.parametrize('unsorted_results', permutations(_UNSORTED_RESULTS))
-def test_sort_user_event_results_by_single(unsorted_results):
-    assert sorted(unsorted_results, key=__sort_user_event_results_by_single) == _CORRECTLY_SORTED_RESULTS
+def test_sort_user_results_with_rankings_sorts_dnfs_before_missing_results(event_format, unsorted_results):
+    assert [result for _, _, result in sort_user_results_with_rankings(list(unsorted_results), event_format)] ==\
+        _CORRECTLY_SORTED_RESULTS
+
+
+def test_rank_sorted():
+    assert rank_sorted(['a', 'b', 'c', 'd', 'e'], [1, 2, 2, 2, 5]) == [
+        (1, '1', 'a'),
+        (2, '2', 'b'),
+        (2, '', 'c'),
+        (2, '', 'd'),
+        (5, '5', 'e'),
+    ]
+    assert rank_sorted([], []) == []
 
 
 @pytest.mark.parametrize('event_format', [EventFormat.Bo1, EventFormat.Bo3])
@@ -76,3 +89,91 @@ def test_sort_user_results_with_rankings_mean_average_formats(event_format):
         (5, '5', r5),
         (6, '6', r6),
     ]
+
+
+# -------------------------------------------------------------------------------------------------
+# How results were sorted and ranked before the sort keys were worked out up front, to check the two
+# agree and compare how long they take.
+# -------------------------------------------------------------------------------------------------
+
+def __compare_times(val1, val2):
+    val1 = 100000000 if not val1 else 99999999 if val1 == 'DNF' else val1
+    val2 = 100000000 if not val2 else 99999999 if val2 == 'DNF' else val2
+    return int(val1) - int(val2)
+
+
+def __previous_sort_user_results_with_rankings(results, event_format):
+    by_result = cmp_to_key(lambda result1, result2: __compare_times(result1.result, result2.result))
+    by_single = cmp_to_key(lambda result1, result2: __compare_times(result1.single, result2.single))
+
+    if event_format in [EventFormat.Bo1, EventFormat.Bo3]:
+        results.sort(key=by_result)
+    else:
+        results.sort(key=by_single)
+        results.sort(key=by_result)
+
+    times_values = list()
+    for result in results:
+        try:
+            average = int(result.result)
+        except (ValueError, TypeError):
+            average = 9999999999999
+        try:
+            single = int(result.single)
+        except (ValueError, TypeError):
+            single = 9999999999999
+        times_values.append((average, single))
+
+    if event_format in [EventFormat.Bo1, EventFormat.Bo3]:
+        times_values.sort(key=lambda x: x[1])
+    else:
+        times_values.sort(key=lambda x: x[1])
+        times_values.sort(key=lambda x: x[0])
+
+    ranks_seen = set()
+    ranked_results = list()
+    for i, r in enumerate(Ranking(times_values, start=1, reverse=True)):
+        visible_rank = str(r[0]) if r[0] not in ranks_seen else ''
+        ranks_seen.add(r[0])
+        ranked_results.append((r[0], visible_rank, results[i]))
+
+    return ranked_results
+
+
+def __random_results(count, event_format):
+    """ Returns some complete results with plenty of ties and DNFs. Best-of-N results are their singles. """
+
+    rng = random.Random(count)
+    results = list()
+    for _ in range(count):
+        single = rng.choice(['DNF'] + [str(rng.randint(500, 700)) for _ in range(9)])
+        if event_format in [EventFormat.Bo1, EventFormat.Bo3]:
+            result = single
+        elif single == 'DNF' or rng.random() < 0.05:
+            result = 'DNF'
+        else:
+            result = str(int(single) + rng.randint(0, 200))
+        results.append(UserEventResults(result=result, single=single))
+
+    return results
+
+
+@pytest.mark.parametrize('event_format', [EventFormat.Bo1, EventFormat.Bo3, EventFormat.Mo3, EventFormat.Ao5])
+@pytest.mark.parametrize('count', [1, 2, 10, 1000])
+def test_sort_user_results_with_rankings_matches_previous_sorting(event_format, count):
+    results = __random_results(count, event_format)
+
+    assert sort_user_results_with_rankings(list(results), event_format) ==\
+        __previous_sort_user_results_with_rankings(list(results), event_format)
+
+
+# Timings depend on whatever else the machine is doing, so this only runs when asked for
+@pytest.mark.skipif(not os.environ.get('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS to run benchmarks')
+@pytest.mark.parametrize('event_format', [EventFormat.Bo3, EventFormat.Ao5])
+def test_sort_user_results_with_rankings_is_faster_than_previous_sorting(event_format):
+    results = __random_results(1000, event_format)
+
+    def best_time(sort):
+        return min(timeit.repeat(lambda: sort(list(results), event_format), number=5, repeat=5))
+
+    assert best_time(__previous_sort_user_results_with_rankings) >= 5 * best_time(sort_user_results_with_rankings)
@@ -2,7 +2,8 @@
 
 import pytest
 
-from cubersio.util.times import convert_centiseconds_to_friendly_time
+from cubersio.util.events.mbld import MbldSolve
+from cubersio.util.times import convert_centiseconds_to_friendly_time, convert_time_to_sort_key, NO_TIME_SORT_KEY
 
 
 @pytest.mark.parametrize('input_value, expected_friendly_time', [
@@ -14,3 +15,28 @@ from cubersio.util.times import convert_centiseconds_to_friendly_time
 ])
 def test_convert_centiseconds_to_friendly_time(input_value, expected_friendly_time):
     assert convert_centiseconds_to_friendly_time(input_value) == expected_friendly_time
+
+
+@pytest.mark.parametrize('input_value, expected_sort_key', [
+    ('2345', 2345),
+    (2345, 2345),
+    ('2147483648', 2147483648),
+    ('DNF', NO_TIME_SORT_KEY),
+    ('', NO_TIME_SORT_KEY),
+    (None, NO_TIME_SORT_KEY),
+])
+def test_convert_time_to_sort_key(input_value, expected_sort_key):
+    assert convert_time_to_sort_key(input_value) == expected_sort_key
+
+
+def test_longest_times_sort_before_dnf():
+    # The longest time which fits in the 10 characters a result is stored in
+    assert convert_time_to_sort_key('9999999999') < convert_time_to_sort_key('DNF')
+
+
+def test_mbld_sort_keys_sort_by_points_then_time():
+    coded_results = ['DNF', '97360000', '95348001', '95300001', '96060000', '98010001']
+    by_sort_key = sorted(coded_results, key=convert_time_to_sort_key)
+    by_sort_value = sorted(coded_results, key=lambda coded: -MbldSolve(coded).sort_value)
+
+    assert by_sort_key == by_sort_value